@@ -18,6 +18,7 @@ from logging.handlers import RotatingFileHandler  # 从logging.handlers导入Rot
 from flask import Flask, Response, request
 from flask_cors import CORS
 
+from commands import register_commands  # 从commands模块导入命令注册函数
 from configs import app_config  # 从configs模块导入dify_config
 from extensions import (  # 从extensions模块导入各个扩展模块
     ext_celery,
@@ -25,12 +26,19 @@ from extensions import (  # 从extensions模块导入各个扩展模块
     ext_database,
     ext_login,
     ext_mail,
+    ext_metrics,
     ext_migrate,
+    ext_profiling,
     ext_redis,
     ext_storage,
     ext_weixin,
 )
-from extensions.ext_database import db  # 从extensions.ext_database导入db
+from extensions.ext_database import (  # 从extensions.ext_database导入db
+    db,
+    get_engines_pool_stat,
+    get_pool_recommendation,
+    get_pool_stat,
+)
 from extensions.ext_login import login_manager  # 从extensions.ext_login导入login_manager
 
 # -------------
@@ -105,6 +113,7 @@ def create_app() -> Flask:
             handler.formatter.converter = time_converter
     initialize_extensions(app)  # 初始化扩展
     register_blueprints(app)  # 注册蓝图
+    register_commands(app)  # 注册命令
 
     return app  # 返回应用实例
 
@@ -120,6 +129,8 @@ def initialize_extensions(app):
     ext_login.init_app(app)
     ext_mail.init_app(app)
     ext_weixin.init_app(app)
+    ext_metrics.init_app(app)
+    ext_profiling.init_app(app)
 
 
 def register_blueprints(app):
@@ -194,15 +205,17 @@ def threads():
 
 @app.route('/db-pool-stat')
 def pool_stat():
-    engine = db.engine
-    return {
-        'pool_size': engine.pool.size(),
-        'checked_in_connections': engine.pool.checkedin(),
-        'checked_out_connections': engine.pool.checkedout(),
-        'overflow_connections': engine.pool.overflow(),
-        'connection_timeout': engine.pool.timeout(),
-        'recycle_time': db.engine.pool._recycle
-    }
+    return get_pool_stat(db.engine)
+
+
+@app.route('/db-pool-stat/engines')
+def engines_pool_stat():
+    return get_engines_pool_stat()
+
+
+@app.route('/db-pool-stat/recommendation')
+def pool_recommendation():
+    return get_pool_recommendation(app)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,81 @@
+import json
+import os
+
+import click
+from flask import current_app
+
+from extensions.ext_database import get_pool_recommendation
+from extensions.ext_profiling import generate_profiling_token
+from extensions.storage.local_storage import LocalStorage, is_temp_filename, unshard_filename
+
+
+@click.command('migrate-storage-layout', help='Move local storage files to the flat or sharded layout.')
+@click.option('--to', 'layout', type=click.Choice(['flat', 'sharded']), required=True,
+              help='Target layout, set STORAGE_LOCAL_LAYOUT to the same value afterwards.')
+def migrate_storage_layout(layout):
+    local_storage = LocalStorage(current_app)
+    folder = local_storage.folder
+
+    click.echo(click.style('Start migrating {folder} to the {layout} layout.'.format(folder=folder, layout=layout),
+                           fg='green'))
+    migrated = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            # files still being written by save_stream
+            if is_temp_filename(name):
+                continue
+
+            path = os.path.relpath(os.path.join(root, name), folder).replace(os.sep, '/')
+            filename = unshard_filename(path)
+            if layout == 'sharded':
+                if filename is not None:
+                    continue
+                target = local_storage.get_path(path, layout='sharded')
+            else:
+                if filename is None:
+                    continue
+                target = local_storage.get_path(filename, layout='flat')
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(os.path.join(root, name), target)
+            migrated += 1
+
+            if layout == 'flat':
+                # drop the two shard levels once they are empty
+                for directory in (root, os.path.dirname(root)):
+                    try:
+                        os.rmdir(directory)
+                    except OSError:
+                        break
+
+    click.echo(click.style('Migrated {count} files to the {layout} layout.'.format(count=migrated, layout=layout),
+                           fg='green'))
+
+
+@click.command('generate-profiling-token', help='Generate a token for the X-Profile-Token request header.')
+def generate_profiling_token_command():
+    secret_key = current_app.config.get('SECRET_KEY')
+    if not secret_key:
+        click.echo(click.style('SECRET_KEY is not set, profiling tokens cannot be signed.', fg='red'))
+        return
+
+    click.echo(generate_profiling_token(secret_key))
+    click.echo(click.style('The token is valid for {max_age} seconds.'.format(
+        max_age=current_app.config.get('PROFILING_TOKEN_MAX_AGE')), fg='green'))
+
+
+@click.command('recommend-db-pool', help='Recommend per-process SQLAlchemy pool limits from max_connections.')
+@click.option('--processes', type=int, default=None,
+              help='Processes of all deployments holding a pool, defaults to DB_POOL_PROCESSES or an estimate.')
+@click.option('--peak', type=int, default=None,
+              help='Peak checked out connections per process, e.g. from /db-pool-stat of a busy worker.')
+def recommend_db_pool(processes, peak):
+    if processes:
+        current_app.config['DB_POOL_PROCESSES'] = processes
+    click.echo(json.dumps(get_pool_recommendation(current_app, peak_checked_out=peak), indent=2))
+
+
+def register_commands(app):
+    app.cli.add_command(migrate_storage_layout)
+    app.cli.add_command(generate_profiling_token_command)
+    app.cli.add_command(recommend_db_pool)
@@ -1,6 +1,6 @@
 from typing import Optional
 
-from pydantic import AliasChoices, Field, NonNegativeInt, PositiveInt, computed_field
+from pydantic import AliasChoices, Field, NonNegativeFloat, NonNegativeInt, PositiveInt, computed_field
 from pydantic_settings import BaseSettings
 
 
@@ -29,6 +29,19 @@ class SecurityConfig(BaseSettings):
         default=24,
     )
 
+    TENANT_KEY_CACHE_MAX_SIZE: NonNegativeInt = Field(
+        description='每个进程内存中缓存的租户私钥数'
+                    'Number of parsed tenant private keys cached in memory in each process',
+        default=256,
+    )
+
+    TENANT_KEY_CACHE_TTL: PositiveInt = Field(
+        description='内存和Redis中缓存租户私钥的时间（秒），轮换密钥会立即使所有进程的缓存失效'
+                    'Seconds tenant private keys are cached in memory and in Redis, '
+                    'rotating a key invalidates the caches of all processes right away',
+        default=120,
+    )
+
 
 class FileUploadConfig(BaseSettings):
     """
@@ -72,6 +85,166 @@ class HttpConfig(BaseSettings):
         default=False,
     )
 
+    RESPONSE_CACHE_ENABLED: bool = Field(
+        description='是否在Redis中缓存使用`cached_response`装饰的API响应'
+                    'Whether to cache the API responses decorated with `cached_response` in Redis',
+        default=True,
+    )
+
+    SSRF_PROXY_MAX_CONNECTIONS: PositiveInt = Field(
+        description='每个进程中外部请求客户端的最大连接数'
+                    'Max connections of the outbound request client in each process',
+        default=100,
+    )
+
+    SSRF_PROXY_MAX_KEEPALIVE_CONNECTIONS: NonNegativeInt = Field(
+        description='每个进程中外部请求客户端保持的最大空闲连接数'
+                    'Max idle keep-alive connections of the outbound request client in each process',
+        default=20,
+    )
+
+    SSRF_PROXY_KEEPALIVE_EXPIRY: NonNegativeFloat = Field(
+        description='外部请求空闲连接的保持时间（秒）'
+                    'Seconds an idle outbound connection is kept alive',
+        default=5.0,
+    )
+
+    SSRF_PROXY_PER_HOST_CONCURRENCY: PositiveInt = Field(
+        description='批量外部请求时每个主机的最大并发数'
+                    'Max concurrent requests per host when gathering outbound requests',
+        default=5,
+    )
+
+    SSRF_PROXY_HTTP2_ENABLED: bool = Field(
+        description='是否对外部请求启用HTTP/2，需要安装h2（httpx[http2]）'
+                    'Whether to enable HTTP/2 for outbound requests, requires h2 (httpx[http2])',
+        default=True,
+    )
+
+    inner_SSRF_PROXY_CACHE_HOSTS: str = Field(
+        description='启用外部GET请求HTTP缓存的主机，逗号分隔，以点开头匹配子域名，* 匹配所有主机，为空则不缓存'
+                    'Comma-separated hosts whose outbound GET responses are cached, a leading dot matches '
+                    'subdomains and * matches every host, empty disables the cache',
+        validation_alias=AliasChoices('SSRF_PROXY_CACHE_HOSTS'),
+        default='',
+    )
+
+    SSRF_PROXY_CACHE_MAX_ENTRY_SIZE: PositiveInt = Field(
+        description='可缓存的外部响应最大字节数'
+                    'Max size in bytes of a cacheable outbound response',
+        default=1024 * 1024,
+    )
+
+    SSRF_PROXY_CACHE_L1_MAX_ENTRIES: NonNegativeInt = Field(
+        description='每个进程内存中缓存的外部响应数，0为不使用内存缓存'
+                    'Number of outbound responses kept in memory in each process, 0 to use Redis only',
+        default=256,
+    )
+
+    SSRF_PROXY_CACHE_L1_TTL: NonNegativeInt = Field(
+        description='内存缓存条目在重新读取Redis之前的有效时间（秒）'
+                    'Seconds an in-memory entry is used before it is read from Redis again',
+        default=5,
+    )
+
+    SSRF_PROXY_CACHE_HEURISTIC_MAX_AGE: NonNegativeInt = Field(
+        description='仅有Last-Modified的响应的最大启发式新鲜时间（秒）'
+                    'Max heuristic freshness lifetime in seconds of responses with only Last-Modified',
+        default=24 * 60 * 60,
+    )
+
+    SSRF_PROXY_BREAKER_ENABLED: bool = Field(
+        description='是否为外部请求启用按主机的熔断器，状态通过Redis在进程间共享'
+                    'Whether to enable per-host circuit breakers for outbound requests, shared across processes '
+                    'through Redis',
+        default=True,
+    )
+
+    SSRF_PROXY_BREAKER_FAILURE_RATE: float = Field(
+        description='熔断器打开的失败率（连接错误、超时和5xx），取值0到1'
+                    'Failure rate (connection errors, timeouts and 5xx) at which a breaker opens, between 0 and 1',
+        default=0.5,
+        ge=0,
+        le=1,
+    )
+
+    SSRF_PROXY_BREAKER_MIN_REQUESTS: PositiveInt = Field(
+        description='统计窗口内熔断器计算失败率所需的最少请求数'
+                    'Min requests within the window before a breaker evaluates the failure rate',
+        default=20,
+    )
+
+    SSRF_PROXY_BREAKER_WINDOW: PositiveInt = Field(
+        description='熔断器统计失败率的窗口（秒）'
+                    'Seconds over which a breaker counts requests and failures',
+        default=30,
+    )
+
+    SSRF_PROXY_BREAKER_OPEN_DURATION: PositiveInt = Field(
+        description='熔断器打开后放行一个试探请求之前的时间（秒）'
+                    'Seconds an open breaker rejects requests before letting a probe through',
+        default=30,
+    )
+
+    SSRF_PROXY_MAX_RETRIES: NonNegativeInt = Field(
+        description='幂等外部请求在连接错误、超时、502、503和504时的最大重试次数'
+                    'Max retries of idempotent outbound requests on connection errors, timeouts, 502, 503 and 504',
+        default=2,
+    )
+
+    SSRF_PROXY_RETRY_BACKOFF: NonNegativeFloat = Field(
+        description='重试退避的基础时间（秒），每次重试翻倍并随机抖动'
+                    'Base retry backoff in seconds, doubled on every retry and fully jittered',
+        default=0.2,
+    )
+
+    SSRF_PROXY_RETRY_BUDGET_RATIO: float = Field(
+        description='每个进程中重试数相对于请求数的最大比例'
+                    'Max ratio of retries to requests in each process',
+        default=0.2,
+        ge=0,
+        le=1,
+    )
+
+    SSRF_PROXY_RETRY_BUDGET_MIN_PER_SECOND: NonNegativeFloat = Field(
+        description='每个进程中不受比例限制的每秒重试数'
+                    'Retries per second allowed in each process regardless of the ratio',
+        default=1.0,
+    )
+
+    SSRF_PROXY_ADAPTIVE_TIMEOUT_ENABLED: bool = Field(
+        description='未指定超时的外部请求是否使用根据主机延迟计算的超时'
+                    'Whether outbound requests without a timeout use one derived from the latency of the host',
+        default=True,
+    )
+
+    SSRF_PROXY_ADAPTIVE_TIMEOUT_PERCENTILE: float = Field(
+        description='计算自适应超时所用的延迟百分位'
+                    'Latency percentile adaptive timeouts are derived from',
+        default=99,
+        gt=0,
+        le=100,
+    )
+
+    SSRF_PROXY_ADAPTIVE_TIMEOUT_MULTIPLIER: float = Field(
+        description='自适应超时相对于延迟百分位的倍数'
+                    'Multiple of the latency percentile used as the adaptive timeout',
+        default=3.0,
+        ge=1,
+    )
+
+    SSRF_PROXY_ADAPTIVE_TIMEOUT_MIN: NonNegativeFloat = Field(
+        description='自适应超时的下限（秒）'
+                    'Lower bound in seconds of adaptive timeouts',
+        default=1.0,
+    )
+
+    SSRF_PROXY_ADAPTIVE_TIMEOUT_MAX: NonNegativeFloat = Field(
+        description='自适应超时的上限（秒），应远小于GUNICORN_TIMEOUT'
+                    'Upper bound in seconds of adaptive timeouts, keep it well below GUNICORN_TIMEOUT',
+        default=30.0,
+    )
+
     inner_WEB_API_CORS_ALLOW_ORIGINS: str = Field(
         description='Web API允许的CORS源',
         validation_alias=AliasChoices('WEB_API_CORS_ALLOW_ORIGINS'),
@@ -83,6 +256,11 @@ class HttpConfig(BaseSettings):
     def WEB_API_CORS_ALLOW_ORIGINS(self) -> list[str]:
         return self.inner_WEB_API_CORS_ALLOW_ORIGINS.split(',')
 
+    @computed_field
+    @property
+    def SSRF_PROXY_CACHE_HOSTS(self) -> list[str]:
+        return [host.strip().lower() for host in self.inner_SSRF_PROXY_CACHE_HOSTS.split(',') if host.strip()]
+
 
 class InnerAPIConfig(BaseSettings):
     """
@@ -144,6 +322,71 @@ class LoggingConfig(BaseSettings):
     )
 
 
+class MetricsConfig(BaseSettings):
+    """
+    监控指标相关的配置项。
+
+    Metrics related configuration items.
+    """
+    METRICS_ENABLED: bool = Field(
+        description='是否启用Prometheus监控指标及`/metrics`端点'
+                    'Whether to enable Prometheus metrics and the `/metrics` endpoint',
+        default=True,
+    )
+
+    METRICS_POOL_SAMPLE_INTERVAL: PositiveInt = Field(
+        description='采样数据库和Redis连接池指标的间隔（秒）'
+                    'Interval in seconds for sampling DB and Redis pool metrics',
+        default=5,
+    )
+
+
+class ProfilingConfig(BaseSettings):
+    """
+    请求性能分析相关的配置项。
+
+    Request profiling related configuration items.
+    """
+    PROFILING_ENABLED: bool = Field(
+        description='是否按采样率对请求进行性能分析，携带有效`X-Profile-Token`请求头的请求始终会被分析'
+                    'Whether to profile a sample of requests, requests with a valid `X-Profile-Token` header '
+                    'are always profiled',
+        default=False,
+    )
+
+    PROFILING_SAMPLE_RATE: float = Field(
+        description='被分析的请求比例，取值0到1'
+                    'Fraction of requests to profile, between 0 and 1',
+        default=0.01,
+        ge=0,
+        le=1,
+    )
+
+    PROFILING_INTERVAL_MS: PositiveInt = Field(
+        description='采样调用栈的间隔（毫秒）'
+                    'Interval in milliseconds between stack samples',
+        default=10,
+    )
+
+    PROFILING_OUTPUT_FORMAT: str = Field(
+        description='写入存储的分析文件格式，可选：speedscope, collapsed'
+                    'Format of the profiles written to storage, available: speedscope, collapsed',
+        default='speedscope',
+    )
+
+    PROFILING_TOP_N: PositiveInt = Field(
+        description='每个端点保留的最慢请求分析数量'
+                    'Number of slowest profiled requests kept per endpoint',
+        default=10,
+    )
+
+    PROFILING_TOKEN_MAX_AGE: PositiveInt = Field(
+        description='`X-Profile-Token`的有效期（秒）'
+                    'Validity in seconds of an `X-Profile-Token`',
+        default=3600,
+    )
+
+
 class OAuthConfig(BaseSettings):
     """
     OAuth相关的配置项。
@@ -333,7 +576,9 @@ class FeatureConfig(
     IndexingConfig,
     LoggingConfig,
     MailConfig,
+    MetricsConfig,
     OAuthConfig,
+    ProfilingConfig,
     SecurityConfig,
     WorkspaceConfig,
 
@@ -2,9 +2,11 @@ from typing import Any, Optional
 
 from pydantic import Field, NonNegativeInt, PositiveInt, computed_field
 from pydantic_settings import BaseSettings
+from sqlalchemy.pool import NullPool
 
 from configs.middleware.cache.redis_config import RedisConfig
 from configs.middleware.storage.aliyun_oss_storage_config import AliyunOSSStorageConfig
+from configs.middleware.storage.amazon_s3_storage_config import S3StorageConfig
 from configs.middleware.storage.tencent_cos_storage_config import TencentCloudCOSStorageConfig
 from configs.middleware.vdb.analyticdb_config import AnalyticdbConfig
 from configs.middleware.vdb.chroma_config import ChromaConfig
@@ -25,7 +27,7 @@ class StorageConfig(BaseSettings):
     STORAGE_TYPE: str = Field(
         description='storage type,'
                     ' default to `local`,'
-                    ' available values are `local`, `s3`, `azure-blob`, `aliyun-oss`, `google-storage`.',
+                    ' available values are `local`, `s3`, `aliyun-oss`, `tencent-cos`.',
         default='local',
     )
 
@@ -34,6 +36,91 @@ class StorageConfig(BaseSettings):
         default='storage',
     )
 
+    STORAGE_LOCAL_LAYOUT: str = Field(
+        description='local storage directory layout, default to `flat`, available values are `flat` and `sharded`.'
+                    ' `sharded` fans files out into hash-named subdirectories,'
+                    ' run `flask migrate-storage-layout` when switching.',
+        default='flat',
+    )
+
+    STORAGE_STREAM_CHUNK_SIZE: PositiveInt = Field(
+        description='chunk size in bytes used when streaming files from storage',
+        default=256 * 1024,
+    )
+
+    STORAGE_MULTIPART_PART_SIZE: PositiveInt = Field(
+        description='part size in bytes for multipart uploads,'
+                    ' streamed uploads that fit in one part are saved with a single request',
+        default=8 * 1024 * 1024,
+    )
+
+    STORAGE_MULTIPART_CONCURRENCY: PositiveInt = Field(
+        description='max number of parts uploaded concurrently in a multipart upload',
+        default=4,
+    )
+
+    STORAGE_MULTIPART_RETRIES: NonNegativeInt = Field(
+        description='number of times a failed part is retried before the multipart upload is aborted',
+        default=3,
+    )
+
+    STORAGE_BATCH_CONCURRENCY: PositiveInt = Field(
+        description='max number of concurrent backend requests in batch exists/delete operations',
+        default=8,
+    )
+
+    STORAGE_ASYNC_MAX_WORKERS: PositiveInt = Field(
+        description='max number of threads running blocking storage calls for the async storage facade',
+        default=16,
+    )
+
+    STORAGE_DEDUP_ENABLED: bool = Field(
+        description='whether to store identical file contents once, keyed by their SHA-256 digest',
+        default=False,
+    )
+
+    STORAGE_COMPRESSION: Optional[str] = Field(
+        description='codec used to compress stored objects, default to None (disabled),'
+                    ' available values are `gzip` and `zstd` (requires the zstandard package)',
+        default=None,
+    )
+
+    STORAGE_COMPRESSION_LEVEL: Optional[int] = Field(
+        description='compression level of the storage codec, default to the codec default',
+        default=None,
+    )
+
+    STORAGE_COMPRESSION_MIN_SIZE: NonNegativeInt = Field(
+        description='objects smaller than this many bytes are stored uncompressed',
+        default=1024,
+    )
+
+    STORAGE_CACHE_ENABLED: bool = Field(
+        description='whether to keep a read-through local disk cache in front of remote storage',
+        default=False,
+    )
+
+    STORAGE_CACHE_PATH: str = Field(
+        description='local disk cache path for remote storage',
+        default='storage_cache',
+    )
+
+    STORAGE_CACHE_MAX_SIZE: PositiveInt = Field(
+        description='size budget in bytes of the local disk cache for remote storage',
+        default=1024 * 1024 * 1024,
+    )
+
+    STORAGE_CACHE_REVALIDATE_INTERVAL: NonNegativeInt = Field(
+        description='seconds after which a cached object is revalidated against the remote size and ETag, '
+                    'the longest a write through another host can go unnoticed',
+        default=60,
+    )
+
+    STORAGE_CACHE_EXCLUDED_PREFIXES: str = Field(
+        description='comma-separated filename prefixes that are never kept in the local disk cache',
+        default='privkeys/',
+    )
+
 
 class VectorStoreConfig(BaseSettings):
     VECTOR_STORE: Optional[str] = Field(
@@ -121,9 +208,96 @@ class DatabaseConfig:
         default=False,
     )
 
+    SQLALCHEMY_QUERY_STATS_ENABLED: bool = Field(
+        description='whether to record per-request query counts, DB time, slow queries and repeated statements',
+        default=True,
+    )
+
+    SQLALCHEMY_SLOW_QUERY_THRESHOLD: NonNegativeInt = Field(
+        description='log statements slower than this many milliseconds, 0 to disable',
+        default=500,
+    )
+
+    SQLALCHEMY_N_PLUS_ONE_THRESHOLD: PositiveInt = Field(
+        description='flag a request as a possible N+1 when one statement shape runs at least this many times',
+        default=10,
+    )
+
+    DB_REPLICA_URIS: str = Field(
+        description='comma-separated SQLAlchemy URIs of read replicas, reads stay on the primary when empty',
+        default='',
+    )
+
+    DB_REPLICA_MAX_LAG: NonNegativeInt = Field(
+        description='max replication lag in seconds before reads fall back to the primary',
+        default=10,
+    )
+
+    DB_REPLICA_HEALTH_CHECK_INTERVAL: PositiveInt = Field(
+        description='interval in seconds between replica health and lag checks',
+        default=5,
+    )
+
+    DB_REPLICA_STICKY_SECONDS: NonNegativeInt = Field(
+        description='seconds all reads of a tenant or user stay on the primary after one of its requests wrote, '
+                    'should cover DB_REPLICA_MAX_LAG plus DB_REPLICA_HEALTH_CHECK_INTERVAL, 0 to disable',
+        default=15,
+    )
+
+    DB_REPLICA_ROUTE_SAFE_METHODS: bool = Field(
+        description='whether to send reads of GET, HEAD and OPTIONS requests to replicas, '
+                    'otherwise only statements marked with `execution_options(replica=True)` are',
+        default=True,
+    )
+
+    @computed_field
+    @property
+    def SQLALCHEMY_BINDS(self) -> dict[str, str]:
+        uris = [uri.strip() for uri in self.DB_REPLICA_URIS.split(',') if uri.strip()]
+        return {'replica_{}'.format(index): uri for index, uri in enumerate(uris)}
+
+    DB_POOLER_MODE: str = Field(
+        description='mode of an external connection pooler such as PgBouncer in front of the database, '
+                    'available values are `transaction`, or empty when connecting to Postgres directly',
+        default='',
+    )
+
+    DB_POOLER_POOL_SIZE: NonNegativeInt = Field(
+        description='connections kept open per process in transaction pooler mode, 0 to open one per checkout',
+        default=0,
+    )
+
+    DB_POOL_PROCESSES: NonNegativeInt = Field(
+        description='processes of all deployments holding a pool to the database, used by the pool sizing '
+                    'recommendation, 0 to estimate it from SERVER_WORKER_AMOUNT and CELERY_WORKER_AMOUNT',
+        default=0,
+    )
+
+    DB_RESERVED_CONNECTIONS: NonNegativeInt = Field(
+        description='connections of max_connections left for superusers, migrations and maintenance',
+        default=5,
+    )
+
     @computed_field
     @property
     def SQLALCHEMY_ENGINE_OPTIONS(self) -> dict[str, Any]:
+        if self.DB_POOLER_MODE == 'transaction':
+            # every transaction may run on another server connection: the pooler does the pooling,
+            # and neither startup `options` nor server-side prepared statements survive a transaction
+            options = {
+                'pool_pre_ping': self.SQLALCHEMY_POOL_PRE_PING,
+                'connect_args': {},
+            }
+            if self.DB_POOLER_POOL_SIZE:
+                options.update(pool_size=self.DB_POOLER_POOL_SIZE, max_overflow=0,
+                               pool_recycle=self.SQLALCHEMY_POOL_RECYCLE)
+            else:
+                options['poolclass'] = NullPool
+            if self.SQLALCHEMY_DATABASE_URI_SCHEME.startswith('postgresql+psycopg') \
+                    and not self.SQLALCHEMY_DATABASE_URI_SCHEME.startswith('postgresql+psycopg2'):
+                options['connect_args']['prepare_threshold'] = None
+            return options
+
         return {
             'pool_size': self.SQLALCHEMY_POOL_SIZE,
             'max_overflow': self.SQLALCHEMY_MAX_OVERFLOW,
@@ -165,6 +339,7 @@ class MiddlewareConfig(
     # configs of storage and storage providers
     StorageConfig,
     AliyunOSSStorageConfig,
+    S3StorageConfig,
     TencentCloudCOSStorageConfig,
 
     # configs of vdb and vdb providers
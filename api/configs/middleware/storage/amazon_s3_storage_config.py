@@ -0,0 +1,60 @@
+from typing import Optional
+
+from pydantic import Field, PositiveInt
+from pydantic_settings import BaseSettings
+
+
+class S3StorageConfig(BaseSettings):
+    """
+    S3 storage configs
+    """
+
+    S3_ENDPOINT: Optional[str] = Field(
+        description='S3 storage endpoint, leave empty to use AWS S3',
+        default=None,
+    )
+
+    S3_REGION: Optional[str] = Field(
+        description='S3 storage region',
+        default=None,
+    )
+
+    S3_BUCKET_NAME: Optional[str] = Field(
+        description='S3 storage bucket name',
+        default=None,
+    )
+
+    S3_ACCESS_KEY: Optional[str] = Field(
+        description='S3 storage access key',
+        default=None,
+    )
+
+    S3_SECRET_KEY: Optional[str] = Field(
+        description='S3 storage secret key',
+        default=None,
+    )
+
+    S3_ADDRESS_STYLE: str = Field(
+        description='S3 addressing style, available values are `auto`, `path` and `virtual`',
+        default='auto',
+    )
+
+    S3_USE_AWS_MANAGED_IAM: bool = Field(
+        description='whether to use AWS managed IAM roles for authenticating with the S3 service',
+        default=False,
+    )
+
+    S3_MAX_POOL_CONNECTIONS: PositiveInt = Field(
+        description='max number of kept-alive HTTP connections in the shared S3 connection pool',
+        default=50,
+    )
+
+    S3_CONNECT_TIMEOUT: PositiveInt = Field(
+        description='S3 connect timeout in seconds',
+        default=10,
+    )
+
+    S3_READ_TIMEOUT: PositiveInt = Field(
+        description='S3 read timeout in seconds',
+        default=60,
+    )
@@ -3,9 +3,11 @@ from flask_restful import Resource
 from configs import app_config
 from controllers.service_api import api
 from libs.response import api_response
+from libs.response_cache import cached_response
 
 
 class IndexApi(Resource):
+    @cached_response(ttl=300, vary_by=())
     def get(self):
         """
         获取 API 的基本信息
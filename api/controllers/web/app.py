@@ -2,9 +2,11 @@ from flask import request
 from flask_restful import Resource
 
 from controllers.web import api
+from libs.response_cache import cached_response
 
 
 class AppHello(Resource):
+    @cached_response(ttl=300, vary_by=())
     def get(self):
         """Get app meta"""
         return {
@@ -10,3 +10,17 @@ class AppInvokeQuotaExceededError(Exception):
     Custom exception raised when the quota for an app has been exceeded.
     """
     description = "App Invoke Quota Exceeded"
+
+
+class ResponseSizeExceededError(Exception):
+    """
+    Custom exception raised when an outbound response body exceeds the configured size limit.
+    """
+    description = "Response Size Exceeded"
+
+
+class CircuitBreakerOpenError(Exception):
+    """
+    Custom exception raised when an outbound request is rejected because the circuit breaker of its host is open.
+    """
+    description = "Circuit Breaker Open"
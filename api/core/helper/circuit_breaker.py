@@ -0,0 +1,484 @@
+"""
+Circuit breakers, retry budgets and adaptive timeouts for outbound requests, by host
+"""
+import asyncio
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable, Generator
+from contextlib import contextmanager
+
+import httpx
+from prometheus_client import Counter
+from redis import RedisError
+
+from configs import app_config
+from core.errors.error import CircuitBreakerOpenError
+from extensions.ext_redis import redis_client
+
+BREAKER_KEY_PREFIX = 'ssrf_proxy_breaker'
+# hosts whose breaker has opened, by the time it last opened, for the metrics sampler
+HOSTS_KEY = '{prefix}:hosts'.format(prefix=BREAKER_KEY_PREFIX)
+# a breaker that has not opened again for this long is forgotten, and so closed
+STATE_RETENTION = 24 * 60 * 60
+# how long a process trusts that a breaker it has seen closed is still closed
+CLOSED_STATE_CACHE_TTL = 1
+# how long a process counts the requests to a host before adding them to the shared window
+RECORD_FLUSH_INTERVAL = 1
+RETRY_BACKOFF_MAX = 5
+RETRY_BUDGET_WINDOW = 10
+LATENCY_SAMPLES = 200
+# percentiles of fewer samples are too noisy to derive a timeout from
+MIN_LATENCY_SAMPLES = 20
+# hosts with a breaker, budget and latencies in a process, the least recently used are dropped beyond it
+MAX_TRACKED_HOSTS = 1024
+# hosts labelled by name in the metrics of a process, any further host is counted as OTHER_HOSTS_LABEL
+MAX_LABELLED_HOSTS = 100
+OTHER_HOSTS_LABEL = 'other'
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+FAILURE_STATUS_CODES = {500, 502, 503, 504}
+RETRYABLE_STATUS_CODES = {502, 503, 504}
+
+HTTP_CLIENT_BREAKER_TRANSITIONS = Counter(
+    'http_client_breaker_transitions',
+    'Circuit breaker state changes of outbound hosts',
+    ['host', 'state'],
+)
+HTTP_CLIENT_BREAKER_REJECTIONS = Counter(
+    'http_client_breaker_rejections',
+    'Outbound requests rejected by an open circuit breaker',
+    ['host'],
+)
+HTTP_CLIENT_RETRIES = Counter(
+    'http_client_retries',
+    'Outbound request retries, by whether the retry budget allowed them',
+    ['host', 'outcome'],
+)
+
+# open a breaker with its state and reopen time in one step, so no reader sees one without the other
+OPEN_SCRIPT = """
+if ARGV[1] ~= '1' and redis.call('HEXISTS', KEYS[1], 'state') == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'state', ARGV[2], 'until', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('DEL', KEYS[2])
+redis.call('ZADD', KEYS[3], ARGV[5], ARGV[6])
+return 1
+"""
+
+_open_script = redis_client.register_script(OPEN_SCRIPT)
+
+
+class CircuitBreaker:
+    """
+    Breaker of one host, with its state and failure counts in Redis so all workers share it.
+
+    The breaker opens once SSRF_PROXY_BREAKER_FAILURE_RATE of at least
+    SSRF_PROXY_BREAKER_MIN_REQUESTS requests within SSRF_PROXY_BREAKER_WINDOW seconds failed.
+    After SSRF_PROXY_BREAKER_OPEN_DURATION seconds it is half-open and lets a single probe
+    through, which closes it on success and opens it again on failure. It fails open when
+    Redis is unavailable.
+
+    Outcomes are counted in the process and added to Redis at most every
+    RECORD_FLUSH_INTERVAL seconds, so a breaker opens up to that much later than the
+    failure that tripped it.
+    """
+
+    def __init__(self, host: str, label: str | None = None):
+        self.host = host
+        self.label = label or host
+        self.key = '{prefix}:{host}'.format(prefix=BREAKER_KEY_PREFIX, host=host)
+        self.probe_key = '{key}:probe'.format(key=self.key)
+        self._closed_until = 0.0
+        self._requests = 0
+        self._failures = 0
+        self._flush_at = 0.0
+        self._lock = threading.Lock()
+
+    def _window_key(self, window: int) -> str:
+        return '{key}:window:{window}'.format(key=self.key, window=window)
+
+    def acquire(self) -> bool:
+        """Raise if the breaker rejects the request, return whether the request is the half-open probe."""
+        if not app_config.SSRF_PROXY_BREAKER_ENABLED or time.monotonic() < self._closed_until:
+            return False
+
+        try:
+            state, until = redis_client.hmget(self.key, 'state', 'until')
+            if state is None:
+                self._closed_until = time.monotonic() + CLOSED_STATE_CACHE_TTL
+                return False
+            # a breaker without a reopen time counts as open
+            if until is not None and time.time() >= float(until) \
+                    and redis_client.set(self.probe_key, 1, nx=True, ex=app_config.SSRF_PROXY_BREAKER_OPEN_DURATION):
+                HTTP_CLIENT_BREAKER_TRANSITIONS.labels(self.label, HALF_OPEN).inc()
+                return True
+        except RedisError:
+            logging.warning('Failed to read the circuit breaker of {host}'.format(host=self.host), exc_info=True)
+            return False
+
+        HTTP_CLIENT_BREAKER_REJECTIONS.labels(self.label).inc()
+        raise CircuitBreakerOpenError('Circuit breaker of {host} is open'.format(host=self.host))
+
+    def record(self, probe: bool, failure: bool):
+        if not app_config.SSRF_PROXY_BREAKER_ENABLED:
+            return
+        if probe:
+            try:
+                if failure:
+                    self._open(reopen=True)
+                else:
+                    self._close()
+            except RedisError:
+                logging.warning('Failed to update the circuit breaker of {host}'.format(host=self.host),
+                                exc_info=True)
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            self._requests += 1
+            self._failures += int(failure)
+            if now < self._flush_at:
+                return
+            requests, failures = self._requests, self._failures
+            self._requests = self._failures = 0
+            self._flush_at = now + RECORD_FLUSH_INTERVAL
+        self._flush(requests, failures)
+
+    def _flush(self, requests: int, failures: int):
+        """Add outcomes counted in this process to the current window, and open the breaker if they trip it."""
+        window = app_config.SSRF_PROXY_BREAKER_WINDOW
+        current = int(time.time() // window)
+        try:
+            pipeline = redis_client.pipeline()
+            pipeline.hincrby(self._window_key(current), 'requests', requests)
+            pipeline.hincrby(self._window_key(current), 'failures', failures)
+            pipeline.expire(self._window_key(current), window * 2)
+            pipeline.hmget(self._window_key(current - 1), 'requests', 'failures')
+            window_requests, window_failures, _, previous = pipeline.execute()
+            if not failures:
+                return
+
+            # the previous window counts in proportion to how much of it is still within the last `window` seconds
+            weight = 1 - (time.time() % window) / window
+            window_requests += int(previous[0] or 0) * weight
+            window_failures += int(previous[1] or 0) * weight
+            if window_requests >= app_config.SSRF_PROXY_BREAKER_MIN_REQUESTS \
+                    and window_failures / window_requests >= app_config.SSRF_PROXY_BREAKER_FAILURE_RATE:
+                self._open()
+        except RedisError:
+            logging.warning('Failed to update the circuit breaker of {host}'.format(host=self.host), exc_info=True)
+
+    def release(self, probe: bool):
+        """Give up a probe that ended without a result, so another request can probe."""
+        if probe:
+            try:
+                redis_client.delete(self.probe_key)
+            except RedisError:
+                pass
+
+    def _open(self, reopen: bool = False):
+        # a breaker opened by another worker is not extended by the failures of requests already in flight
+        now = time.time()
+        opened = _open_script(
+            keys=[self.key, self.probe_key, HOSTS_KEY],
+            args=[int(reopen), OPEN, now + app_config.SSRF_PROXY_BREAKER_OPEN_DURATION, STATE_RETENTION, now, self.host],
+        )
+        if not opened:
+            return
+        self._closed_until = 0.0
+        HTTP_CLIENT_BREAKER_TRANSITIONS.labels(self.label, OPEN).inc()
+        logging.warning('Opened the circuit breaker of {host}'.format(host=self.host))
+
+    def _close(self):
+        current = int(time.time() // app_config.SSRF_PROXY_BREAKER_WINDOW)
+        redis_client.delete(self.key, self.probe_key, self._window_key(current), self._window_key(current - 1))
+        HTTP_CLIENT_BREAKER_TRANSITIONS.labels(self.label, CLOSED).inc()
+        logging.info('Closed the circuit breaker of {host}'.format(host=self.host))
+
+
+class RetryBudget:
+    """
+    Allow retries while they stay under a ratio of the requests of the last few seconds.
+
+    Budgets are kept per process, so a degraded upstream gets at most
+    SSRF_PROXY_RETRY_BUDGET_RATIO more load from retries instead of a multiple of it.
+    """
+
+    def __init__(self, window: int = RETRY_BUDGET_WINDOW):
+        self.window = window
+        self._requests: deque[float] = deque()
+        self._retries: deque[float] = deque()
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        for timestamps in (self._requests, self._retries):
+            while timestamps and timestamps[0] <= now - self.window:
+                timestamps.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_retry(self) -> bool:
+        with self._lock:
+            now = time.monotonic()
+            self._prune(now)
+            allowed = app_config.SSRF_PROXY_RETRY_BUDGET_MIN_PER_SECOND * self.window \
+                + app_config.SSRF_PROXY_RETRY_BUDGET_RATIO * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class LatencyTracker:
+    """Latencies of the last successful requests to a host in this process."""
+
+    def __init__(self, size: int = LATENCY_SAMPLES):
+        self._samples: deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, percentile: float) -> float | None:
+        samples = sorted(self._samples)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, math.ceil(len(samples) * percentile / 100) - 1)]
+
+    def timeout(self) -> float | None:
+        """SSRF_PROXY_ADAPTIVE_TIMEOUT_MULTIPLIER times the latency percentile, within the configured bounds."""
+        latency = self.percentile(app_config.SSRF_PROXY_ADAPTIVE_TIMEOUT_PERCENTILE)
+        if latency is None:
+            return None
+        return min(max(latency * app_config.SSRF_PROXY_ADAPTIVE_TIMEOUT_MULTIPLIER,
+                       app_config.SSRF_PROXY_ADAPTIVE_TIMEOUT_MIN),
+                   app_config.SSRF_PROXY_ADAPTIVE_TIMEOUT_MAX)
+
+
+class HostGuard:
+    def __init__(self, host: str, label: str):
+        self.host = host
+        self.label = label
+        self.breaker = CircuitBreaker(host, label)
+        self.retry_budget = RetryBudget()
+        self.latency = LatencyTracker()
+
+
+class OutboundGuard:
+    """
+    Send outbound requests through the breaker, retry budget and latency tracker of their host.
+
+    Idempotent requests are retried up to SSRF_PROXY_MAX_RETRIES times on connection errors,
+    timeouts, 502, 503 and 504, with full-jitter exponential backoff, as long as the retry
+    budget allows. Requests without a timeout of their own get an adaptive one once enough
+    latencies of their host have been observed.
+
+    A process tracks at most MAX_TRACKED_HOSTS hosts and labels metrics with the names of
+    the first MAX_LABELLED_HOSTS of them, so requests to arbitrary URLs cannot grow memory
+    or the number of metric series without bound.
+    """
+
+    def __init__(self):
+        self._hosts: OrderedDict[str, HostGuard] = OrderedDict()
+        self._labels: set[str] = set()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self._hosts = OrderedDict()
+        self._labels = set()
+        self._lock = threading.Lock()
+
+    def host(self, url) -> HostGuard:
+        host = httpx.URL(url).host.lower()
+        with self._lock:
+            guard = self._hosts.get(host)
+            if guard is not None:
+                self._hosts.move_to_end(host)
+                return guard
+
+            guard = self._hosts[host] = HostGuard(host, self._label(host))
+            if len(self._hosts) > MAX_TRACKED_HOSTS:
+                self._hosts.popitem(last=False)
+            return guard
+
+    def label(self, host: str) -> str:
+        """Metric label of a host."""
+        with self._lock:
+            return self._label(host)
+
+    def _label(self, host: str) -> str:
+        # labels are never given back, a series once exported has to keep its meaning
+        if host in self._labels:
+            return host
+        if len(self._labels) < MAX_LABELLED_HOSTS:
+            self._labels.add(host)
+            return host
+        return OTHER_HOSTS_LABEL
+
+    def _apply_timeout(self, guard: HostGuard, kwargs: dict):
+        if 'timeout' in kwargs or not app_config.SSRF_PROXY_ADAPTIVE_TIMEOUT_ENABLED:
+            return
+        timeout = guard.latency.timeout()
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+
+    def _prepare(self, method: str, url, kwargs: dict) -> tuple[HostGuard, int]:
+        guard = self.host(url)
+        self._apply_timeout(guard, kwargs)
+        guard.retry_budget.record_request()
+        return guard, app_config.SSRF_PROXY_MAX_RETRIES if method.upper() in IDEMPOTENT_METHODS else 0
+
+    @staticmethod
+    def _record_response(guard: HostGuard, probe: bool, response: httpx.Response, started_at: float) -> bool:
+        """Record the outcome of a response, return whether it may be retried."""
+        failure = response.status_code in FAILURE_STATUS_CODES
+        guard.breaker.record(probe, failure)
+        if not failure:
+            guard.latency.observe(time.perf_counter() - started_at)
+        return response.status_code in RETRYABLE_STATUS_CODES
+
+    @staticmethod
+    def _retry_delay(guard: HostGuard, attempt: int, retries: int) -> float | None:
+        """Full-jitter backoff before the next attempt, None if the request is not retried."""
+        if attempt >= retries:
+            return None
+        if not guard.retry_budget.try_retry():
+            HTTP_CLIENT_RETRIES.labels(guard.label, 'budget_exhausted').inc()
+            return None
+        HTTP_CLIENT_RETRIES.labels(guard.label, 'retried').inc()
+        return random.uniform(0, min(RETRY_BACKOFF_MAX, app_config.SSRF_PROXY_RETRY_BACKOFF * 2 ** (attempt + 1)))
+
+    def request(self, send: Callable[..., httpx.Response], method: str, url, **kwargs) -> httpx.Response:
+        """Send a request with `send(method=method, url=url, **kwargs)`."""
+        guard, retries = self._prepare(method, url, kwargs)
+
+        attempt = 0
+        while True:
+            probe = guard.breaker.acquire()
+            started_at = time.perf_counter()
+            try:
+                response = send(method=method, url=url, **kwargs)
+            except httpx.TransportError as e:
+                guard.breaker.record(probe, failure=True)
+                error, response = e, None
+            except Exception:
+                guard.breaker.release(probe)
+                raise
+            else:
+                if not self._record_response(guard, probe, response, started_at):
+                    return response
+                error = None
+
+            delay = self._retry_delay(guard, attempt, retries)
+            if delay is None:
+                break
+            attempt += 1
+            time.sleep(delay)
+
+        if error is not None:
+            raise error
+        return response
+
+    async def async_request(self, send: Callable[..., Awaitable[httpx.Response]], method: str, url,
+                            **kwargs) -> httpx.Response:
+        """Like `request` for an async `send`, waiting between attempts without blocking the event loop."""
+        guard, retries = self._prepare(method, url, kwargs)
+
+        attempt = 0
+        while True:
+            probe = guard.breaker.acquire()
+            started_at = time.perf_counter()
+            try:
+                response = await send(method=method, url=url, **kwargs)
+            except httpx.TransportError as e:
+                guard.breaker.record(probe, failure=True)
+                error, response = e, None
+            except BaseException:
+                # including the cancellation of the task, which must not keep the probe
+                guard.breaker.release(probe)
+                raise
+            else:
+                if not self._record_response(guard, probe, response, started_at):
+                    return response
+                error = None
+
+            delay = self._retry_delay(guard, attempt, retries)
+            if delay is None:
+                break
+            attempt += 1
+            await asyncio.sleep(delay)
+
+        if error is not None:
+            raise error
+        return response
+
+    @contextmanager
+    def stream(self, open_stream: Callable, method: str, url, **kwargs) -> Generator[httpx.Response, None, None]:
+        """Like `request` for `client.stream`, without retries since the body is read by the caller."""
+        guard = self.host(url)
+        self._apply_timeout(guard, kwargs)
+        probe = guard.breaker.acquire()
+        recorded = False
+        try:
+            with open_stream(method=method, url=url, **kwargs) as response:
+                guard.breaker.record(probe, response.status_code in FAILURE_STATUS_CODES)
+                recorded = True
+                yield response
+        except httpx.TransportError:
+            if not recorded:
+                guard.breaker.record(probe, failure=True)
+                recorded = True
+            raise
+        finally:
+            if not recorded:
+                guard.breaker.release(probe)
+
+
+outbound_guard = OutboundGuard()
+
+# the lock may be held by another thread while gunicorn --preload forks
+os.register_at_fork(after_in_child=outbound_guard.reset)
+
+
+def get_breaker_stat() -> list[dict]:
+    """
+    State of the breakers that have opened within the last day, shared by all processes.
+    """
+    now = time.time()
+    redis_client.zremrangebyscore(HOSTS_KEY, 0, now - STATE_RETENTION)
+    hosts = [host.decode() for host in redis_client.zrange(HOSTS_KEY, 0, -1)]
+    if not hosts:
+        return []
+
+    pipeline = redis_client.pipeline()
+    for host in hosts:
+        pipeline.hmget(CircuitBreaker(host).key, 'state', 'until')
+    stats = []
+    for host, (state, until) in zip(hosts, pipeline.execute()):
+        open_until = float(until) if until is not None else None
+        if state is None:
+            state = CLOSED
+        else:
+            # a breaker without a reopen time counts as open
+            state = OPEN if open_until is None or now < open_until else HALF_OPEN
+        stats.append({
+            'host': host,
+            'label': outbound_guard.label(host),
+            'state': state,
+            'open_until': open_until,
+        })
+    return stats
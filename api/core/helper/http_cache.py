@@ -0,0 +1,420 @@
+"""
+RFC 9111 cache for outbound GET requests, shared through Redis with an in-process L1
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from collections.abc import Callable
+from email.utils import parsedate_to_datetime
+
+import httpx
+from redis import RedisError
+
+from configs import app_config
+from core.errors.error import CircuitBreakerOpenError
+from extensions.ext_redis import redis_client
+
+CACHE_KEY_PREFIX = 'ssrf_proxy_cache'
+REVALIDATE_LOCK_TIMEOUT = 30
+# an entry with validators is kept this long after it became stale, to be revalidated with a 304
+STALE_RETENTION = 24 * 60 * 60
+
+# RFC 9110 15.1, statuses cacheable without explicit freshness (206 is left out, ranges are not cached)
+CACHEABLE_STATUS_CODES = {200, 203, 204, 300, 301, 308, 404, 405, 410, 414, 501}
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# requests asking for something other than the full current representation bypass the cache
+BYPASS_REQUEST_HEADERS = ('if-none-match', 'if-modified-since', 'if-match', 'if-unmodified-since', 'range')
+# headers not stored with an entry, the body is stored decoded and the age is recomputed on every hit
+EXCLUDED_HEADERS = {
+    'age', 'connection', 'content-encoding', 'content-length', 'keep-alive', 'proxy-connection', 'set-cookie',
+    'te', 'trailer', 'transfer-encoding', 'upgrade',
+}
+# directives that forbid serving a stale response
+REVALIDATE_DIRECTIVES = ('must-revalidate', 'proxy-revalidate', 'no-cache', 's-maxage')
+# request headers carrying credentials, they always select the stored response
+CREDENTIAL_HEADERS = ('authorization', 'cookie')
+# keyword arguments whose credentials are only added to the headers while sending, requests using them bypass the cache
+CREDENTIAL_KWARGS = ('auth', 'cookies')
+
+Send = Callable[..., httpx.Response]
+
+
+def parse_cache_control(value: str) -> dict[str, str | bool]:
+    directives = {}
+    for directive in value.split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip().strip('"') if argument else True
+    return directives
+
+
+def _seconds(value) -> int | None:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return None
+
+
+def _http_date(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def _vary(response_headers: httpx.Headers, request_headers: httpx.Headers) -> dict[str, str] | None:
+    """
+    Hashes of the request headers selecting the stored response, None for `Vary: *`.
+
+    Authorization and Cookie always select the response, so credentials are never answered with
+    a response fetched for other credentials.
+    """
+    names = {name.strip().lower() for name in response_headers.get('vary', '').split(',') if name.strip()}
+    if '*' in names:
+        return None
+    names.update(CREDENTIAL_HEADERS)
+    return {name: _hash(request_headers.get(name, '')) for name in sorted(names)}
+
+
+def _initial_age(headers: httpx.Headers, request_time: float, response_time: float) -> float:
+    # RFC 9111 4.2.3
+    date = _http_date(headers.get('date'))
+    apparent_age = max(0.0, response_time - date) if date is not None else 0.0
+    corrected_age = (_seconds(headers.get('age')) or 0) + (response_time - request_time)
+    return max(apparent_age, corrected_age)
+
+
+class CacheEntry:
+    """A stored response with what is needed to compute its age and freshness."""
+
+    def __init__(self, status_code: int, headers: list, content: bytes, vary: dict[str, str],
+                 response_time: float, initial_age: float):
+        self.status_code = status_code
+        self.headers = httpx.Headers(headers)
+        self.content = content
+        self.vary = vary
+        self.response_time = response_time
+        self.initial_age = initial_age
+        self.cache_control = parse_cache_control(self.headers.get('cache-control', ''))
+
+    @classmethod
+    def from_response(cls, response: httpx.Response, vary: dict[str, str],
+                      request_time: float, response_time: float) -> 'CacheEntry':
+        headers = [(name, value) for name, value in response.headers.multi_items() if name not in EXCLUDED_HEADERS]
+        return cls(response.status_code, headers, response.content, vary, response_time,
+                   _initial_age(response.headers, request_time, response_time))
+
+    @classmethod
+    def loads(cls, meta: bytes, content: bytes) -> 'CacheEntry':
+        meta = json.loads(meta)
+        return cls(meta['status_code'], meta['headers'], content, meta['vary'], meta['response_time'],
+                   meta['initial_age'])
+
+    def dumps(self) -> str:
+        return json.dumps({
+            'status_code': self.status_code,
+            'headers': self.headers.multi_items(),
+            'vary': self.vary,
+            'response_time': self.response_time,
+            'initial_age': self.initial_age,
+        })
+
+    @property
+    def freshness_lifetime(self) -> float:
+        # RFC 9111 4.2.1, s-maxage applies since this cache is shared by every user of the app
+        for directive in ('s-maxage', 'max-age'):
+            seconds = _seconds(self.cache_control.get(directive))
+            if seconds is not None:
+                return seconds
+
+        date = _http_date(self.headers.get('date')) or self.response_time
+        if 'expires' in self.headers:
+            # an invalid Expires means already expired
+            expires = _http_date(self.headers['expires'])
+            return max(0.0, expires - date) if expires is not None else 0
+
+        # RFC 9111 4.2.2, a fraction of the time since the last modification
+        last_modified = _http_date(self.headers.get('last-modified'))
+        if last_modified is not None:
+            return min(max(0.0, date - last_modified) / 10, app_config.SSRF_PROXY_CACHE_HEURISTIC_MAX_AGE)
+        return 0
+
+    @property
+    def has_validators(self) -> bool:
+        return 'etag' in self.headers or 'last-modified' in self.headers
+
+    @property
+    def storage_ttl(self) -> int:
+        ttl = self.freshness_lifetime - self.age(time.time())
+        ttl += max(self.stale_window('stale-while-revalidate'), self.stale_window('stale-if-error'))
+        if self.has_validators:
+            ttl += STALE_RETENTION
+        return max(1, math.ceil(ttl))
+
+    def age(self, now: float) -> float:
+        return self.initial_age + (now - self.response_time)
+
+    def stale_window(self, directive: str) -> int:
+        """Seconds past its lifetime the entry may be served with `stale-while-revalidate` or `stale-if-error`."""
+        if any(name in self.cache_control for name in REVALIDATE_DIRECTIVES):
+            return 0
+        return _seconds(self.cache_control.get(directive)) or 0
+
+    def matches(self, request_headers: httpx.Headers) -> bool:
+        return all(_hash(request_headers.get(name, '')) == value for name, value in self.vary.items())
+
+    def conditional_headers(self) -> dict[str, str]:
+        headers = {}
+        if 'etag' in self.headers:
+            headers['If-None-Match'] = self.headers['etag']
+        if 'last-modified' in self.headers:
+            headers['If-Modified-Since'] = self.headers['last-modified']
+        return headers
+
+    def freshen(self, response: httpx.Response, request_time: float, response_time: float) -> 'CacheEntry':
+        """Return the entry updated with the headers of a 304 response, RFC 9111 4.3.4."""
+        headers = httpx.Headers(self.headers)
+        for name in {name for name in response.headers.keys() if name not in EXCLUDED_HEADERS}:
+            headers[name] = response.headers[name]
+        return CacheEntry(self.status_code, headers.multi_items(), self.content, self.vary, response_time,
+                          _initial_age(response.headers, request_time, response_time))
+
+    def to_response(self, url: httpx.URL, now: float) -> httpx.Response:
+        headers = httpx.Headers(self.headers)
+        headers['Age'] = str(int(self.age(now)))
+        return httpx.Response(self.status_code, headers=headers, content=self.content,
+                              request=httpx.Request('GET', url))
+
+
+def is_storable(response: httpx.Response) -> bool:
+    """RFC 9111 3, for a shared cache, judged by the request as it was sent."""
+    request_headers = response.request.headers
+    if response.request.method != 'GET' or response.status_code not in CACHEABLE_STATUS_CODES:
+        return False
+    response_cache_control = parse_cache_control(response.headers.get('cache-control', ''))
+    if 'no-store' in response_cache_control or 'private' in response_cache_control:
+        return False
+    if 'no-store' in parse_cache_control(request_headers.get('cache-control', '')):
+        return False
+    # RFC 9111 3.5, cookies are treated like Authorization since they usually identify the caller
+    if any(name in request_headers for name in CREDENTIAL_HEADERS) \
+            and not any(name in response_cache_control for name in ('public', 's-maxage', 'must-revalidate')):
+        return False
+    return len(response.content) <= app_config.SSRF_PROXY_CACHE_MAX_ENTRY_SIZE
+
+
+class HttpCache:
+    """
+    Cache outbound GET responses of the hosts in SSRF_PROXY_CACHE_HOSTS.
+
+    Fresh entries are answered without a request, stale ones are revalidated with
+    If-None-Match/If-Modified-Since. Entries within `stale-while-revalidate` are answered
+    right away while one worker revalidates them in the background, and entries within
+    `stale-if-error` are answered when the upstream fails. Entries live in Redis and are kept
+    in memory for SSRF_PROXY_CACHE_L1_TTL seconds, so an invalidation by an unsafe request
+    reaches the other processes after at most that long.
+    """
+
+    def __init__(self):
+        self._l1: OrderedDict[str, tuple[float, CacheEntry]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def enabled_for(url) -> bool:
+        hosts = app_config.SSRF_PROXY_CACHE_HOSTS
+        if not hosts:
+            return False
+        host = httpx.URL(url).host.lower()
+        return any(pattern == '*' or host == pattern
+                   or pattern.startswith('.') and (host.endswith(pattern) or host == pattern[1:])
+                   for pattern in hosts)
+
+    @staticmethod
+    def _key(url: httpx.URL) -> str:
+        return '{prefix}:{digest}'.format(prefix=CACHE_KEY_PREFIX, digest=_hash(str(url)))
+
+    def request(self, send: Send, method: str, url, default_headers: httpx.Headers | None = None,
+                **kwargs) -> httpx.Response:
+        """
+        Send a request through `send(method, url, **kwargs)`, answering GETs from the cache.
+
+        `default_headers` are the headers the client adds to every request, stored responses are
+        selected by the headers actually sent.
+        """
+        method = method.upper()
+        cache_url = httpx.URL(url)
+        if kwargs.get('params'):
+            cache_url = cache_url.copy_merge_params(kwargs['params'])
+        key = self._key(cache_url)
+
+        if method in UNSAFE_METHODS:
+            response = send(method, url, **kwargs)
+            # RFC 9111 4.4
+            if response.status_code < 400:
+                self.invalidate(key)
+            return response
+
+        request_headers = httpx.Headers(default_headers)
+        request_headers.update(httpx.Headers(kwargs.get('headers')))
+        request_cache_control = parse_cache_control(request_headers.get('cache-control', ''))
+        if method != 'GET' or 'no-store' in request_cache_control \
+                or any(kwargs.get(name) for name in CREDENTIAL_KWARGS) \
+                or any(name in request_headers for name in BYPASS_REQUEST_HEADERS):
+            return send(method, url, **kwargs)
+
+        entry = self._load(key)
+        if entry is not None and not entry.matches(request_headers):
+            entry = None
+        if entry is None:
+            return self._forward(send, url, kwargs, key, cache_url)
+
+        now = time.time()
+        age = entry.age(now)
+        max_age = _seconds(request_cache_control.get('max-age'))
+        if 'no-cache' not in request_cache_control and 'no-cache' not in entry.cache_control \
+                and (max_age is None or age <= max_age):
+            if age < entry.freshness_lifetime:
+                return entry.to_response(cache_url, now)
+            if age < entry.freshness_lifetime + entry.stale_window('stale-while-revalidate'):
+                self._revalidate_in_background(send, url, kwargs, key, cache_url, entry)
+                return entry.to_response(cache_url, now)
+        return self._forward(send, url, kwargs, key, cache_url, entry)
+
+    def _forward(self, send: Send, url, kwargs: dict, key: str, cache_url: httpx.URL,
+                 entry: CacheEntry | None = None) -> httpx.Response:
+        if entry is not None:
+            headers = httpx.Headers(kwargs.get('headers'))
+            headers.update(entry.conditional_headers())
+            kwargs = {**kwargs, 'headers': headers}
+
+        request_time = time.time()
+        try:
+            response = send('GET', url, **kwargs)
+        except (httpx.TransportError, CircuitBreakerOpenError):
+            if entry is not None and self._usable_on_error(entry):
+                return entry.to_response(cache_url, time.time())
+            raise
+        response_time = time.time()
+
+        if entry is not None and response.status_code == 304:
+            entry = entry.freshen(response, request_time, response_time)
+            self._save(key, entry)
+            return entry.to_response(cache_url, response_time)
+        if entry is not None and response.status_code >= 500 and self._usable_on_error(entry):
+            return entry.to_response(cache_url, response_time)
+
+        # the client may have added headers, the response is stored for the request as it was sent
+        vary = _vary(response.headers, response.request.headers)
+        if vary is not None and is_storable(response):
+            new_entry = CacheEntry.from_response(response, vary, request_time, response_time)
+            if new_entry.freshness_lifetime > 0 or new_entry.has_validators:
+                self._save(key, new_entry)
+                return response
+        if entry is not None:
+            self.invalidate(key)
+        return response
+
+    @staticmethod
+    def _usable_on_error(entry: CacheEntry) -> bool:
+        return entry.age(time.time()) < entry.freshness_lifetime + entry.stale_window('stale-if-error')
+
+    def _revalidate_in_background(self, send: Send, url, kwargs: dict, key: str, cache_url: httpx.URL,
+                                  entry: CacheEntry):
+        # only one process revalidates an entry, the others keep answering with the stale one
+        lock_key = '{key}:revalidating'.format(key=key)
+        try:
+            if not redis_client.set(lock_key, 1, nx=True, ex=REVALIDATE_LOCK_TIMEOUT):
+                return
+        except RedisError:
+            logging.warning('Failed to lock the revalidation of {url}'.format(url=cache_url), exc_info=True)
+            return
+
+        def revalidate():
+            try:
+                self._forward(send, url, kwargs, key, cache_url, entry)
+            except Exception:
+                logging.warning('Failed to revalidate {url}'.format(url=cache_url), exc_info=True)
+            finally:
+                try:
+                    redis_client.delete(lock_key)
+                except RedisError:
+                    pass
+
+        threading.Thread(target=revalidate, name='ssrf_proxy_cache', daemon=True).start()
+
+    def _load(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            cached = self._l1.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._l1.move_to_end(key)
+                return cached[1]
+
+        try:
+            meta, content = redis_client.hmget(key, 'meta', 'content')
+        except RedisError:
+            logging.warning('Failed to read the outbound response cache', exc_info=True)
+            return None
+        if meta is None:
+            return None
+        entry = CacheEntry.loads(meta, content or b'')
+        self._remember(key, entry)
+        return entry
+
+    def _save(self, key: str, entry: CacheEntry):
+        try:
+            pipeline = redis_client.pipeline()
+            pipeline.delete(key)
+            pipeline.hset(key, mapping={'meta': entry.dumps(), 'content': entry.content})
+            pipeline.expire(key, entry.storage_ttl)
+            pipeline.execute()
+        except RedisError:
+            logging.warning('Failed to write the outbound response cache', exc_info=True)
+        self._remember(key, entry)
+
+    def _remember(self, key: str, entry: CacheEntry):
+        max_entries = app_config.SSRF_PROXY_CACHE_L1_MAX_ENTRIES
+        if not max_entries or not app_config.SSRF_PROXY_CACHE_L1_TTL:
+            return
+        with self._lock:
+            self._l1[key] = (time.monotonic() + app_config.SSRF_PROXY_CACHE_L1_TTL, entry)
+            self._l1.move_to_end(key)
+            while len(self._l1) > max_entries:
+                self._l1.popitem(last=False)
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._l1.pop(key, None)
+        try:
+            redis_client.delete(key)
+        except RedisError:
+            logging.warning('Failed to invalidate the outbound response cache', exc_info=True)
+
+    def invalidate_url(self, url, params=None):
+        """Drop the cached response of a URL, in this process right away and in others within the L1 TTL."""
+        url = httpx.URL(url)
+        if params:
+            url = url.copy_merge_params(params)
+        self.invalidate(self._key(url))
+
+
+http_cache = HttpCache()
+
+# the L1 lock may be held by another thread while gunicorn --preload forks
+os.register_at_fork(after_in_child=http_cache.reset)
@@ -1,10 +1,25 @@
 """
 Proxy requests to avoid SSRF
 """
+import asyncio
+import importlib.util
 import os
+import tempfile
+import threading
+import weakref
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http.cookiejar import CookieJar
 
 import httpx
 
+from configs import app_config
+from core.errors.error import ResponseSizeExceededError
+from core.helper.circuit_breaker import outbound_guard
+from core.helper.http_cache import http_cache
+from extensions.ext_storage import storage
+
 SSRF_PROXY_ALL_URL = os.getenv('SSRF_PROXY_ALL_URL', '')
 SSRF_PROXY_HTTP_URL = os.getenv('SSRF_PROXY_HTTP_URL', '')
 SSRF_PROXY_HTTPS_URL = os.getenv('SSRF_PROXY_HTTPS_URL', '')
@@ -14,14 +29,358 @@ proxies = {
     'https://': SSRF_PROXY_HTTPS_URL
 } if SSRF_PROXY_HTTP_URL and SSRF_PROXY_HTTPS_URL else None
 
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
 
-def make_request(method, url, **kwargs):
+# client settings httpx only takes per client, requests using them get a client of their own
+ONE_OFF_CLIENT_KWARGS = ('cert', 'trust_env')
+# the SSRF proxy is configured by SSRF_PROXY_*, callers must not route around it
+PROXY_KWARGS = ('proxy', 'proxies', 'mounts', 'transport')
+
+TEXT_CONTENT_TYPES = ('application/json', 'application/xml', 'application/javascript', 'application/x-www-form-urlencoded')
+
+# long-lived clients of this process by proxy configuration and TLS verification
+_clients: dict[tuple, httpx.Client] = {}
+_clients_lock = threading.Lock()
+# async clients are bound to the event loop they were created in
+_async_clients: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[tuple, httpx.AsyncClient]] = \
+    weakref.WeakKeyDictionary()
+
+
+def _reset_clients():
+    # a child forked with gunicorn --preload must not reuse the parent's connections, it drops the
+    # clients without closing them since that would shut down the parent's TLS sessions as well
+    global _clients_lock
+    _clients.clear()
+    _clients_lock = threading.Lock()
+    _async_clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset_clients)
+
+
+class DiscardingCookieJar(CookieJar):
+    """Cookie jar that stores nothing.
+
+    The pooled clients are shared by all tenants of a process, a cookie set by one
+    response must not be sent along with the requests of anyone else. Cookies passed
+    per request are still sent.
+    """
+
+    def set_cookie(self, cookie):
+        pass
+
+    def extract_cookies(self, response, request):
+        pass
+
+
+def _proxy_config() -> tuple:
     if SSRF_PROXY_ALL_URL:
-        return httpx.request(method=method, url=url, proxy=SSRF_PROXY_ALL_URL, **kwargs)
+        return 'all', SSRF_PROXY_ALL_URL
     elif proxies:
-        return httpx.request(method=method, url=url, proxies=proxies, **kwargs)
+        return 'http+https', proxies['http://'], proxies['https://']
     else:
-        return httpx.request(method=method, url=url, **kwargs)
+        return 'direct',
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=app_config.SSRF_PROXY_MAX_CONNECTIONS,
+        max_keepalive_connections=app_config.SSRF_PROXY_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=app_config.SSRF_PROXY_KEEPALIVE_EXPIRY,
+    )
+
+
+def _build_client(proxy_config: tuple, verify, asynchronous: bool = False,
+                  **options) -> httpx.Client | httpx.AsyncClient:
+    client_class, transport_class = (httpx.AsyncClient, httpx.AsyncHTTPTransport) if asynchronous \
+        else (httpx.Client, httpx.HTTPTransport)
+    limits = _limits()
+    http2 = app_config.SSRF_PROXY_HTTP2_ENABLED and HTTP2_AVAILABLE
+    cookies = DiscardingCookieJar()
+    if proxy_config[0] == 'all':
+        return client_class(proxy=proxy_config[1], limits=limits, http2=http2, verify=verify, cookies=cookies,
+                            **options)
+    elif proxy_config[0] == 'http+https':
+        transport_options = {name: value for name, value in options.items() if name != 'trust_env'}
+        mounts = {
+            'http://': transport_class(proxy=proxy_config[1], limits=limits, http2=http2, verify=verify,
+                                       **transport_options),
+            'https://': transport_class(proxy=proxy_config[2], limits=limits, http2=http2, verify=verify,
+                                        **transport_options),
+        }
+        return client_class(mounts=mounts, limits=limits, http2=http2, verify=verify, cookies=cookies, **options)
+    else:
+        return client_class(limits=limits, http2=http2, verify=verify, cookies=cookies, **options)
+
+
+def _pop_client_options(kwargs: dict) -> tuple[bool, dict]:
+    """Take the client settings out of the keyword arguments of a request."""
+    for name in PROXY_KWARGS:
+        if name in kwargs:
+            raise ValueError('`{name}` is not supported, outbound requests always use the SSRF proxy '
+                             'configured by SSRF_PROXY_ALL_URL or SSRF_PROXY_HTTP(S)_URL'.format(name=name))
+    verify = kwargs.pop('verify', True)
+    options = {name: kwargs.pop(name) for name in ONE_OFF_CLIENT_KWARGS if name in kwargs}
+    return verify, options
+
+
+def get_client(verify=True) -> httpx.Client:
+    """
+    Return the pooled client of this process for the configured proxies.
+    """
+    key = (_proxy_config(), verify)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = _build_client(*key)
+        return client
+
+
+def get_async_client(verify=True) -> httpx.AsyncClient:
+    """
+    Return the pooled async client of the running event loop for the configured proxies.
+    """
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    key = (_proxy_config(), verify)
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = _build_client(*key, asynchronous=True)
+    return client
+
+
+def get_pool_stat() -> list[dict]:
+    """
+    Connections of the pooled clients of this process, by client.
+    """
+    stats = []
+    for (proxy_config, verify), client in list(_clients.items()):
+        transports = [client._transport, *client._mounts.values()]
+        connections = [connection
+                       for transport in transports if isinstance(transport, httpx.HTTPTransport)
+                       for connection in transport._pool.connections]
+        idle = sum(1 for connection in connections if connection.is_idle())
+        stats.append({
+            'client': proxy_config[0] if verify else '{name}-insecure'.format(name=proxy_config[0]),
+            'max_connections': app_config.SSRF_PROXY_MAX_CONNECTIONS,
+            'connections': len(connections),
+            'idle_connections': idle,
+            'active_connections': len(connections) - idle,
+        })
+    return stats
+
+
+def _send(method, url, **kwargs) -> httpx.Response:
+    # TLS verification is a setting of the pooled clients, everything else is passed per request
+    verify, options = _pop_client_options(kwargs)
+    if options:
+        with _build_client(_proxy_config(), verify, **options) as client:
+            return outbound_guard.request(client.request, method, url, **kwargs)
+    return outbound_guard.request(get_client(verify).request, method, url, **kwargs)
+
+
+def make_request(method, url, **kwargs):
+    # GETs to the hosts in SSRF_PROXY_CACHE_HOSTS go through the HTTP cache, unless the client holds cookies
+    if http_cache.enabled_for(url):
+        client = get_client(kwargs.get('verify', True))
+        if not client.cookies:
+            return http_cache.request(_send, method, url, default_headers=client.headers, **kwargs)
+    return _send(method, url, **kwargs)
+
+
+async def async_make_request(method, url, **kwargs):
+    verify, options = _pop_client_options(kwargs)
+    if options:
+        async with _build_client(_proxy_config(), verify, asynchronous=True, **options) as client:
+            return await outbound_guard.async_request(client.request, method, url, **kwargs)
+    return await outbound_guard.async_request(get_async_client(verify).request, method, url, **kwargs)
+
+
+def _normalize_request(request) -> tuple[str, str, dict]:
+    """
+    Accept `(method, url)`, `(method, url, kwargs)` or `{'method': ..., 'url': ..., **kwargs}`.
+    """
+    if isinstance(request, dict):
+        kwargs = dict(request)
+        return kwargs.pop('method', 'GET'), kwargs.pop('url'), kwargs
+    if len(request) == 2:
+        method, url = request
+        return method, url, {}
+    method, url, kwargs = request
+    return method, url, dict(kwargs)
+
+
+def gather_requests(requests: Iterable, concurrency: int = 10, per_host_concurrency: int | None = None,
+                    timeout: float | None = None) -> list[httpx.Response | Exception]:
+    """
+    Send many requests concurrently through the pooled client.
+
+    Results are returned in input order, with the exception in place of the response for
+    requests that failed. At most `per_host_concurrency` requests (SSRF_PROXY_PER_HOST_CONCURRENCY
+    by default) run against one host at a time, and `timeout` applies both to the wait for a
+    host slot and to every request that sets no timeout of its own. Runs on threads, which are
+    greenlets under gevent, so it works in gevent workers as well as in any Celery pool.
+    """
+    requests = [_normalize_request(request) for request in requests]
+    if not requests:
+        return []
+
+    per_host_concurrency = per_host_concurrency or app_config.SSRF_PROXY_PER_HOST_CONCURRENCY
+    semaphores = {}
+    for _, url, _ in requests:
+        semaphores.setdefault(httpx.URL(url).host, threading.BoundedSemaphore(per_host_concurrency))
+
+    def send(method: str, url: str, kwargs: dict) -> httpx.Response:
+        if timeout is not None:
+            kwargs.setdefault('timeout', timeout)
+        host = httpx.URL(url).host
+        if not semaphores[host].acquire(timeout=timeout):
+            raise TimeoutError('Timed out waiting for a connection slot to {host}'.format(host=host))
+        try:
+            return make_request(method, url, **kwargs)
+        finally:
+            semaphores[host].release()
+
+    results = []
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(requests)), thread_name_prefix='ssrf_proxy') as executor:
+        futures = [executor.submit(send, *request) for request in requests]
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+    return results
+
+
+async def async_gather_requests(requests: Iterable, concurrency: int = 10, per_host_concurrency: int | None = None,
+                                timeout: float | None = None) -> list[httpx.Response | Exception]:
+    """
+    Async variant of `gather_requests` on the pooled async client of the running event loop.
+    """
+    requests = [_normalize_request(request) for request in requests]
+    per_host_concurrency = per_host_concurrency or app_config.SSRF_PROXY_PER_HOST_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    host_semaphores = {}
+    for _, url, _ in requests:
+        host_semaphores.setdefault(httpx.URL(url).host, asyncio.Semaphore(per_host_concurrency))
+
+    async def send(method: str, url: str, kwargs: dict) -> httpx.Response:
+        if timeout is not None:
+            kwargs.setdefault('timeout', timeout)
+        host_semaphore = host_semaphores[httpx.URL(url).host]
+        async with semaphore:
+            # wait_for raises asyncio.TimeoutError, which is only the builtin TimeoutError
+            # from Python 3.11 on, so wait for the slot without relying on its exception
+            acquire = asyncio.ensure_future(host_semaphore.acquire())
+            done, _ = await asyncio.wait((acquire,), timeout=timeout)
+            if not done:
+                acquire.cancel()
+                raise TimeoutError('Timed out waiting for a connection slot to {host}'.format(
+                    host=httpx.URL(url).host))
+            try:
+                return await async_make_request(method, url, **kwargs)
+            finally:
+                host_semaphore.release()
+
+    return await asyncio.gather(*(send(*request) for request in requests), return_exceptions=True)
+
+
+@contextmanager
+def stream(method, url, **kwargs) -> Generator[httpx.Response, None, None]:
+    """
+    Send a request through the pooled client without reading the body, see `iter_capped`.
+    """
+    verify, options = _pop_client_options(kwargs)
+    if options:
+        with _build_client(_proxy_config(), verify, **options) as client, \
+                outbound_guard.stream(client.stream, method, url, **kwargs) as response:
+            yield response
+        return
+    with outbound_guard.stream(get_client(verify).stream, method, url, **kwargs) as response:
+        yield response
+
+
+def _size_limit(response: httpx.Response) -> int:
+    content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type.startswith('text/') or content_type in TEXT_CONTENT_TYPES \
+            or content_type.endswith(('+json', '+xml')):
+        return app_config.HTTP_REQUEST_NODE_MAX_TEXT_SIZE
+    return app_config.HTTP_REQUEST_NODE_MAX_BINARY_SIZE
+
+
+def iter_capped(response: httpx.Response, max_size: int | None = None,
+                chunk_size: int | None = None) -> Generator[bytes, None, None]:
+    """
+    Iterate over the decoded body of a streamed response, aborting once it exceeds `max_size`.
+
+    Without `max_size`, text responses are limited to HTTP_REQUEST_NODE_MAX_TEXT_SIZE and
+    everything else to HTTP_REQUEST_NODE_MAX_BINARY_SIZE. The limit applies to the decoded
+    body, so a small compressed response cannot expand past it either.
+    """
+    max_size = _size_limit(response) if max_size is None else max_size
+    content_length = response.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > max_size:
+        raise ResponseSizeExceededError('Response of {size} bytes exceeds the limit of {limit} bytes'.format(
+            size=content_length, limit=max_size))
+
+    received = 0
+    for chunk in response.iter_bytes(chunk_size):
+        received += len(chunk)
+        if received > max_size:
+            raise ResponseSizeExceededError('Response exceeds the limit of {limit} bytes'.format(limit=max_size))
+        yield chunk
+
+
+def fetch(method, url, max_size: int | None = None, **kwargs) -> httpx.Response:
+    """
+    Like `make_request`, but reads the body incrementally and stops at the size limit.
+    """
+    with stream(method, url, **kwargs) as response:
+        # what `Response.read()` does, with the limit enforced while reading
+        response._content = b''.join(iter_capped(response, max_size))
+    return response
+
+
+def save_to_storage(filename: str, method, url, max_size: int | None = None, **kwargs) -> int:
+    """
+    Pipe a response body into `storage.save_stream` without buffering it, return its size.
+
+    Raises for error statuses, and an oversized body aborts the upload.
+    """
+    size = 0
+
+    def counted(chunks: Iterable[bytes]) -> Generator[bytes, None, None]:
+        nonlocal size
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+
+    with stream(method, url, **kwargs) as response:
+        response.raise_for_status()
+        storage.save_stream(filename, counted(iter_capped(response, max_size)))
+    return size
+
+
+def save_to_tempfile(method, url, max_size: int | None = None, **kwargs) -> tempfile.NamedTemporaryFile:
+    """
+    Write a response body to a temporary file, rewound and removed once closed.
+
+    Raises for error statuses and oversized bodies.
+    """
+    file = tempfile.NamedTemporaryFile()
+    try:
+        with stream(method, url, **kwargs) as response:
+            response.raise_for_status()
+            for chunk in iter_capped(response, max_size):
+                file.write(chunk)
+        file.seek(0)
+        return file
+    except Exception:
+        file.close()
+        raise
 
 
 def get(url, **kwargs):
@@ -7,6 +7,11 @@ if [[ "${MIGRATION_ENABLED}" == "true" ]]; then
   flask upgrade-db
 fi
 
+# share prometheus metrics between the worker processes, see extensions/ext_metrics.py
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "${PROMETHEUS_MULTIPROC_DIR}"
+mkdir -p "${PROMETHEUS_MULTIPROC_DIR}"
+
 if [[ "${MODE}" == "worker" ]]; then
   exec celery -A app.celery worker -P ${CELERY_WORKER_CLASS:-gevent} -c ${CELERY_WORKER_AMOUNT:-1} --loglevel INFO \
     -Q ${CELERY_QUEUES:-dataset,generation,mail,ops_trace,app_deletion}
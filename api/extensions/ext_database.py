@@ -1,7 +1,508 @@
+import functools
+import hashlib
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Flask, g, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+from prometheus_client import Counter as PrometheusCounter
+from prometheus_client import Histogram
+from redis import RedisError
+from sqlalchemy import Executable, Select, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool, QueuePool
+
+from extensions.ext_redis import redis_client
+
+# bind keys of the replica engines, see DatabaseConfig.SQLALCHEMY_BINDS
+REPLICA_BIND_PREFIX = 'replica_'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_KEY_PREFIX = 'db_primary_sticky'
+
+# seconds the replica is behind, 0 while it has replayed everything it received
+REPLICA_LAG_QUERY = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+
+class Replica:
+    def __init__(self, name: str, engine: Engine):
+        self.name = name
+        self.engine = engine
+        # unhealthy until the first check, reads stay on the primary meanwhile
+        self.healthy = False
+        self.lag = None
+
+
+class ReplicaRouter:
+    """Tracks the health and replication lag of the replica engines.
+
+    Each process checks its replicas in a background thread every
+    `DB_REPLICA_HEALTH_CHECK_INTERVAL` seconds. A replica is used only while it answers and
+    lags at most `DB_REPLICA_MAX_LAG` seconds; without one, reads fall back to the primary.
+    """
+
+    def __init__(self):
+        self.replicas = []
+        self.max_lag = 0
+        self.interval = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app: Flask):
+        self.max_lag = app.config.get('DB_REPLICA_MAX_LAG')
+        self.interval = app.config.get('DB_REPLICA_HEALTH_CHECK_INTERVAL')
+        with app.app_context():
+            self.replicas = [Replica(key, engine) for key, engine in sorted(db.engines.items(), key=lambda item: str(item[0]))
+                             if key and key.startswith(REPLICA_BIND_PREFIX)]
+
+    def ensure_started(self):
+        # started lazily, a thread started before gunicorn forks would not survive in the workers
+        if not self.replicas or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='db_replica_health_check', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self.check()
+            time.sleep(self.interval)
+
+    def check(self):
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    replica.lag = float(connection.execute(REPLICA_LAG_QUERY).scalar())
+                replica.healthy = replica.lag <= self.max_lag
+            except Exception:
+                logging.exception('Health check of database replica {name} failed'.format(name=replica.name))
+                replica.healthy = False
+                replica.lag = None
+
+    def choose(self) -> Engine | None:
+        healthy = [replica.engine for replica in self.replicas if replica.healthy]
+        return random.choice(healthy) if healthy else None
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """Session that sends reads to a healthy replica when that is safe.
+
+    A SELECT goes to a replica when the session is read-only (requests with a safe method,
+    or within `read_only()`), or when the statement is marked with
+    `execution_options(replica=True)`. Everything else uses the primary, and so does every
+    statement after the session has written or within `use_primary()`, so a request always
+    reads its own writes. For `DB_REPLICA_STICKY_SECONDS` after a request wrote, later
+    requests of the same tenant or user use the primary too.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not replica_router.replicas or engine is not self._db.engines.get(None):
+            return engine
+
+        if self._flushing or (clause is not None and clause.is_dml):
+            self.info['wrote'] = True
+        if not self._use_replica(clause) or is_sticky_to_primary():
+            return engine
+        return replica_router.choose() or engine
+
+    def _use_replica(self, clause) -> bool:
+        if clause is None or self.info.get('wrote') or self.info.get('use_primary'):
+            return False
+        if isinstance(clause, Executable) and clause.get_execution_options().get('replica'):
+            return True
+        return (self.info.get('read_only', False) and isinstance(clause, Select)
+                and clause._for_update_arg is None)
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+
+@contextmanager
+def use_primary():
+    """Send all statements of `db.session` to the primary, as a context manager or decorator."""
+    previous = db.session.info.get('use_primary')
+    db.session.info['use_primary'] = True
+    try:
+        yield
+    finally:
+        db.session.info['use_primary'] = previous
+
+
+@contextmanager
+def read_only():
+    """Allow reads of `db.session` to go to a replica, as a context manager or decorator."""
+    previous = db.session.info.get('read_only')
+    db.session.info['read_only'] = True
+    try:
+        yield
+    finally:
+        db.session.info['read_only'] = previous
+
+
+def _sticky_keys() -> list[str]:
+    """Redis keys marking that the tenant or user of the current request wrote recently.
+
+    The logged in user is only used once something else loaded it, loading it here would
+    query the database before the route is decided. The credentials of the request always
+    count, so the query loading the user is covered too. Requests without any identity are
+    never sticky.
+    """
+    identities = []
+    user = g.get('_login_user')
+    if user is not None and user.is_authenticated:
+        tenant_id = getattr(user, 'current_tenant_id', None)
+        identities.append('tenant:{}'.format(tenant_id) if tenant_id else 'user:{}'.format(user.get_id()))
+    if authorization := request.headers.get('Authorization'):
+        # never keep credentials in keys
+        identities.append('auth:{}'.format(hashlib.sha256(authorization.encode()).hexdigest()))
+    return ['{prefix}:{identity}'.format(prefix=STICKY_KEY_PREFIX, identity=identity) for identity in identities]
+
+
+def is_sticky_to_primary() -> bool:
+    """Whether the tenant or user of the current request wrote within `DB_REPLICA_STICKY_SECONDS`."""
+    if not has_request_context() or not g.get('db_sticky_seconds'):
+        return False
+    keys = _sticky_keys()
+    if not keys:
+        return False
+
+    # checked once per request and identity, the user may only be known after the first queries
+    checked = g.setdefault('db_sticky_checked', {})
+    if keys[0] not in checked:
+        try:
+            checked[keys[0]] = bool(redis_client.exists(keys[0]))
+        except RedisError:
+            # without the marker a recent write cannot be ruled out
+            logging.warning('Failed to read the primary stickiness of {key}'.format(key=keys[0]), exc_info=True)
+            checked[keys[0]] = True
+    return checked[keys[0]]
+
+
+def stick_to_primary(seconds: int):
+    """Send reads of the tenant and user of the current request to the primary for `seconds`."""
+    keys = _sticky_keys()
+    if not keys:
+        return
+    try:
+        pipeline = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.set(key, 1, ex=seconds)
+        pipeline.execute()
+    except RedisError:
+        logging.warning('Failed to make reads stick to the primary', exc_info=True)
+
+
+DB_QUERY_DURATION = Histogram(
+    'db_query_duration_seconds',
+    'Latency of SQL statements',
+    ['operation'],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_SLOW_QUERIES = PrometheusCounter(
+    'db_slow_queries',
+    'SQL statements slower than SQLALCHEMY_SLOW_QUERY_THRESHOLD',
+    ['operation'],
+)
+DB_REQUEST_QUERIES = Histogram(
+    'db_request_queries',
+    'SQL statements executed per HTTP request',
+    ['blueprint', 'endpoint'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+DB_REQUEST_DURATION = Histogram(
+    'db_request_duration_seconds',
+    'Time spent in SQL statements per HTTP request',
+    ['blueprint', 'endpoint'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_N_PLUS_ONE = PrometheusCounter(
+    'db_n_plus_one',
+    'HTTP requests that repeated one statement shape at least SQLALCHEMY_N_PLUS_ONE_THRESHOLD times',
+    ['blueprint', 'endpoint'],
+)
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_BIND_PARAM = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\$\d+')
+_VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+
+# milliseconds per instrumented engine
+_slow_query_thresholds = weakref.WeakKeyDictionary()
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_statement(statement: str) -> str:
+    """Reduce a statement to its shape: literals and bind parameters become `?`, value lists `(?)`."""
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _BIND_PARAM.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    return _VALUE_LIST.sub('(?)', statement)
+
+
+def _operation(statement: str) -> str:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return operation if operation in ('SELECT', 'INSERT', 'UPDATE', 'DELETE') else 'OTHER'
+
 
-db = SQLAlchemy()
+class QueryStats:
+    """SQL statements executed while handling one request."""
 
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
 
-def init_app(app):
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started_at', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info['query_started_at'].pop()
+    duration = time.perf_counter() - started_at
+    operation = _operation(statement)
+    DB_QUERY_DURATION.labels(operation).observe(duration)
+
+    stats = g.get('query_stats') if has_request_context() else None
+    if stats is not None:
+        stats.count += 1
+        stats.duration += duration
+        stats.shapes[normalize_statement(statement)] += 1
+
+    threshold = _slow_query_thresholds.get(conn.engine)
+    if threshold and duration * 1000 >= threshold:
+        DB_SLOW_QUERIES.labels(operation).inc()
+        logging.warning('Slow query ({duration:.1f} ms) in {endpoint}: {statement}'.format(
+            duration=duration * 1000,
+            endpoint=request.endpoint if has_request_context() else None,
+            statement=normalize_statement(statement),
+        ))
+
+
+def _handle_error(exception_context):
+    # the after hook does not run for failed statements
+    connection = exception_context.connection
+    if connection is not None and connection.info.get('query_started_at'):
+        connection.info['query_started_at'].pop()
+
+
+class PoolUsage:
+    """Connections checked out of a pool and their high-water mark, for any pool class."""
+
+    def __init__(self):
+        self.checked_out = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self._lock:
+            self.checked_out += 1
+            self.peak = max(self.peak, self.checked_out)
+
+    def checkin(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.checked_out -= 1
+
+
+_pool_usage = weakref.WeakKeyDictionary()
+
+
+def track_pool_usage(pool: Pool):
+    if pool in _pool_usage:
+        return
+    usage = _pool_usage[pool] = PoolUsage()
+    event.listen(pool, 'checkout', usage.checkout)
+    event.listen(pool, 'checkin', usage.checkin)
+
+
+def instrument_engine(engine: Engine, slow_query_threshold: int):
+    _slow_query_thresholds[engine] = slow_query_threshold
+    if event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def init_app(app: Flask):
     db.init_app(app)
+    replica_router.init_app(app)
+    with app.app_context():
+        for engine in db.engines.values():
+            track_pool_usage(engine.pool)
+
+    if replica_router.replicas:
+        route_safe_methods = app.config.get('DB_REPLICA_ROUTE_SAFE_METHODS')
+        sticky_seconds = app.config.get('DB_REPLICA_STICKY_SECONDS')
+
+        @app.before_request
+        def route_to_replicas():
+            replica_router.ensure_started()
+            if route_safe_methods:
+                db.session.info['read_only'] = request.method in SAFE_METHODS
+            # a replica may not have replayed the writes of an earlier request yet, e.g. a GET right after a POST
+            g.db_sticky_seconds = sticky_seconds
+
+        @app.after_request
+        def mark_writes(response):
+            if sticky_seconds and db.session.info.get('wrote'):
+                stick_to_primary(sticky_seconds)
+            return response
+
+    if not app.config.get('SQLALCHEMY_QUERY_STATS_ENABLED'):
+        return
+
+    with app.app_context():
+        for engine in db.engines.values():
+            instrument_engine(engine, app.config.get('SQLALCHEMY_SLOW_QUERY_THRESHOLD'))
+    n_plus_one_threshold = app.config.get('SQLALCHEMY_N_PLUS_ONE_THRESHOLD')
+
+    @app.before_request
+    def before_request():
+        g.query_stats = QueryStats()
+
+    @app.after_request
+    def after_request(response):
+        stats = g.pop('query_stats', None)
+        if stats is None:
+            return response
+
+        labels = (request.blueprint or '', request.endpoint or '')
+        DB_REQUEST_QUERIES.labels(*labels).observe(stats.count)
+        DB_REQUEST_DURATION.labels(*labels).observe(stats.duration)
+
+        repeated = stats.repeated(n_plus_one_threshold)
+        if repeated:
+            DB_N_PLUS_ONE.labels(*labels).inc()
+            for shape, count in repeated:
+                logging.warning('Possible N+1 query in {endpoint}, executed {count} times: {statement}'.format(
+                    endpoint=request.endpoint, count=count, statement=shape))
+
+        if app.debug:
+            response.headers['X-DB-Query-Count'] = str(stats.count)
+            response.headers['X-DB-Time-Ms'] = '{:.1f}'.format(stats.duration * 1000)
+            response.headers['X-DB-Repeated-Queries'] = str(len(repeated))
+        return response
+
+
+def get_pool_stat(engine) -> dict:
+    pool = engine.pool
+    usage = _pool_usage.get(pool)
+    if isinstance(pool, QueuePool):
+        stat = {
+            'pool_size': pool.size(),
+            'checked_in_connections': pool.checkedin(),
+            'checked_out_connections': pool.checkedout(),
+            'overflow_connections': pool.overflow(),
+            'connection_timeout': pool.timeout(),
+            'recycle_time': pool._recycle
+        }
+    else:
+        # NullPool (transaction pooler mode) and the single-connection pools keep nothing to report
+        stat = {
+            'pool_size': 0,
+            'checked_in_connections': 0,
+            'checked_out_connections': usage.checked_out if usage else 0,
+            'overflow_connections': 0,
+            'connection_timeout': None,
+            'recycle_time': pool._recycle
+        }
+    stat['pool_class'] = type(pool).__name__
+    stat['peak_checked_out_connections'] = usage.peak if usage else None
+    return stat
+
+
+def get_engines_pool_stat() -> dict:
+    """Pool stats of the primary and every replica, with the replicas' health and lag."""
+    stats = {'primary': get_pool_stat(db.engine)}
+    for replica in replica_router.replicas:
+        stats[replica.name] = {
+            **get_pool_stat(replica.engine),
+            'healthy': replica.healthy,
+            'lag': replica.lag,
+        }
+    return stats
+
+
+def count_pool_processes() -> int:
+    """Estimate the processes holding a pool, from the variables read by docker/entrypoint.sh.
+
+    Counts the gunicorn workers of one API container plus one Celery worker, which runs a
+    single process unless it uses the prefork pool. Set `DB_POOL_PROCESSES` for anything
+    else, e.g. several containers.
+    """
+    processes = int(os.environ.get('SERVER_WORKER_AMOUNT') or 1)
+    if os.environ.get('CELERY_WORKER_CLASS') == 'prefork':
+        processes += int(os.environ.get('CELERY_WORKER_AMOUNT') or 1)
+    else:
+        processes += 1
+    return processes
+
+
+def recommend_pool_limits(max_connections: int, processes: int, reserved_connections: int = 0,
+                          peak_checked_out: int | None = None) -> dict:
+    """Split the connections of the database between the processes holding a pool.
+
+    Each process gets an equal share of `max_connections - reserved_connections`. When the
+    observed peak of checked out connections is known, the persistent pool covers the peak
+    with 25% headroom and the rest of the share is left to overflow; otherwise two thirds
+    of the share are kept open.
+    """
+    budget = max((max_connections - reserved_connections) // max(processes, 1), 1)
+    if peak_checked_out:
+        pool_size = min(budget, math.ceil(peak_checked_out * 1.25))
+    else:
+        pool_size = max(budget * 2 // 3, 1)
+    return {
+        'max_connections': max_connections,
+        'reserved_connections': reserved_connections,
+        'processes': processes,
+        'connections_per_process': budget,
+        'peak_checked_out_connections': peak_checked_out,
+        'pool_size': pool_size,
+        'max_overflow': budget - pool_size,
+    }
+
+
+def get_pool_recommendation(app: Flask, peak_checked_out: int | None = None) -> dict:
+    """Recommend SQLALCHEMY_POOL_SIZE/SQLALCHEMY_MAX_OVERFLOW from `max_connections` and the pool stats.
+
+    Unless given, the peak of checked out connections is the one observed by this process.
+    Behind a transaction pooler `SHOW max_connections` still reaches Postgres, and the split
+    then applies to the server connections of the pooler rather than to DB_POOLER_POOL_SIZE.
+    """
+    # taken before the query below checks out a connection itself
+    stat = get_pool_stat(db.engine)
+    with db.engine.connect() as connection:
+        max_connections = int(connection.execute(text('SHOW max_connections')).scalar())
+
+    recommendation = recommend_pool_limits(
+        max_connections=max_connections,
+        processes=app.config.get('DB_POOL_PROCESSES') or count_pool_processes(),
+        reserved_connections=app.config.get('DB_RESERVED_CONNECTIONS'),
+        peak_checked_out=peak_checked_out or stat['peak_checked_out_connections'],
+    )
+    recommendation['current'] = stat
+    return recommendation
@@ -0,0 +1,218 @@
+import os
+import threading
+import time
+
+from flask import Flask, Response, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.registry import Collector
+
+from core.helper.circuit_breaker import CLOSED, HALF_OPEN, OPEN, get_breaker_stat
+from core.helper.ssrf_proxy import get_pool_stat as get_http_client_pool_stat
+from extensions.ext_database import get_engines_pool_stat
+from extensions.ext_redis import get_pool_stat as get_redis_pool_stat
+from extensions.ext_storage import storage
+from extensions.storage.cached_storage import CachedStorage
+
+# gauges of several gunicorn workers are summed over the live processes in multiprocess mode
+HTTP_REQUESTS = Counter(
+    'http_requests',
+    'HTTP requests handled',
+    ['blueprint', 'endpoint', 'method', 'status'],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds',
+    'HTTP request latency',
+    ['blueprint', 'endpoint', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+HTTP_RESPONSE_SIZE = Histogram(
+    'http_response_size_bytes',
+    'HTTP response body size, streamed responses without a Content-Length are not counted',
+    ['blueprint', 'endpoint'],
+    buckets=(100, 1000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000),
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge(
+    'http_requests_in_progress',
+    'HTTP requests being handled',
+    ['blueprint', 'endpoint'],
+    multiprocess_mode='livesum',
+)
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections',
+    'SQLAlchemy pool connections by engine (primary or replica bind key) and state',
+    ['engine', 'state'],
+    multiprocess_mode='livesum',
+)
+REDIS_POOL_CONNECTIONS = Gauge(
+    'redis_pool_connections',
+    'Redis pool connections by state',
+    ['state'],
+    multiprocess_mode='livesum',
+)
+HTTP_CLIENT_POOL_CONNECTIONS = Gauge(
+    'http_client_pool_connections',
+    'Connections of the pooled outbound HTTP clients (core.helper.ssrf_proxy) by client and state',
+    ['client', 'state'],
+    multiprocess_mode='livesum',
+)
+# breaker states are shared through Redis, every worker reports the same value
+HTTP_CLIENT_BREAKER_STATE = Gauge(
+    'http_client_breaker_state',
+    'Circuit breaker state of outbound hosts (core.helper.circuit_breaker): 0 closed, 1 half-open, 2 open',
+    ['host'],
+    multiprocess_mode='livemax',
+)
+APP_THREADS = Gauge(
+    'app_threads',
+    'Threads (greenlets when gevent is patched) alive in the process',
+    multiprocess_mode='livesum',
+)
+
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class StorageCacheCollector(Collector):
+    """Exports the counters of the local disk cache tier of the storage layer, if enabled.
+
+    In multiprocess mode these only reflect the worker that serves the scrape.
+    """
+
+    def collect(self):
+        runner = storage.storage_runner
+        while runner is not None and not isinstance(runner, CachedStorage):
+            runner = getattr(runner, 'runner', None)
+        if runner is None:
+            return
+
+        stats = runner.stats()
+        yield CounterMetricFamily('storage_cache_hits', 'Storage cache hits', value=stats['hits'])
+        yield CounterMetricFamily('storage_cache_misses', 'Storage cache misses', value=stats['misses'])
+        yield CounterMetricFamily('storage_cache_evictions', 'Storage cache evictions', value=stats['evictions'])
+        yield GaugeMetricFamily('storage_cache_entries', 'Objects in the storage cache', value=stats['entries'])
+        yield GaugeMetricFamily('storage_cache_size_bytes', 'Bytes in the storage cache', value=stats['size'])
+
+
+storage_cache_collector = StorageCacheCollector()
+
+
+class PoolSampler:
+    """Periodically copies DB/Redis/HTTP client pool, breaker and thread stats into gauges.
+
+    Sampling runs in each worker, so the gauges can be summed across gunicorn workers
+    and nothing is computed on the request path. The sampler is started lazily in the
+    process serving requests, since a thread started before gunicorn forks with
+    `--preload` would not survive in the workers.
+    """
+
+    def __init__(self, app: Flask, interval: int):
+        self.app = app
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='metrics_pool_sampler', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception:
+                self.app.logger.exception('Failed to sample pool metrics')
+            time.sleep(self.interval)
+
+    def sample(self):
+        with self.app.app_context():
+            engines_stat = get_engines_pool_stat()
+        for engine, db_stat in engines_stat.items():
+            DB_POOL_CONNECTIONS.labels(engine, 'size').set(db_stat['pool_size'])
+            DB_POOL_CONNECTIONS.labels(engine, 'checked_in').set(db_stat['checked_in_connections'])
+            DB_POOL_CONNECTIONS.labels(engine, 'checked_out').set(db_stat['checked_out_connections'])
+            DB_POOL_CONNECTIONS.labels(engine, 'overflow').set(db_stat['overflow_connections'])
+
+        redis_stat = get_redis_pool_stat()
+        REDIS_POOL_CONNECTIONS.labels('created').set(redis_stat['created_connections'])
+        REDIS_POOL_CONNECTIONS.labels('available').set(redis_stat['available_connections'])
+        REDIS_POOL_CONNECTIONS.labels('in_use').set(redis_stat['in_use_connections'])
+
+        for client_stat in get_http_client_pool_stat():
+            HTTP_CLIENT_POOL_CONNECTIONS.labels(client_stat['client'], 'idle').set(client_stat['idle_connections'])
+            HTTP_CLIENT_POOL_CONNECTIONS.labels(client_stat['client'], 'active').set(client_stat['active_connections'])
+
+        # hosts sharing the `other` label report the worst state among them
+        breaker_states = {}
+        for breaker_stat in get_breaker_stat():
+            state = BREAKER_STATE_VALUES[breaker_stat['state']]
+            breaker_states[breaker_stat['label']] = max(state, breaker_states.get(breaker_stat['label'], state))
+        for label, state in breaker_states.items():
+            HTTP_CLIENT_BREAKER_STATE.labels(label).set(state)
+
+        APP_THREADS.set(threading.active_count())
+
+
+def init_app(app: Flask):
+    if not app.config.get('METRICS_ENABLED'):
+        return
+
+    REGISTRY.register(storage_cache_collector)
+    sampler = PoolSampler(app, app.config.get('METRICS_POOL_SAMPLE_INTERVAL'))
+
+    @app.before_request
+    def before_request():
+        sampler.ensure_started()
+        g.metrics_started_at = time.perf_counter()
+        g.metrics_labels = (request.blueprint or '', request.endpoint or '')
+        HTTP_REQUESTS_IN_PROGRESS.labels(*g.metrics_labels).inc()
+
+    @app.after_request
+    def after_request(response):
+        labels = g.get('metrics_labels')
+        if labels is None:
+            return response
+
+        duration = time.perf_counter() - g.metrics_started_at
+        HTTP_REQUEST_DURATION.labels(*labels, request.method).observe(duration)
+        HTTP_REQUESTS.labels(*labels, request.method, response.status_code).inc()
+        if response.content_length is not None:
+            HTTP_RESPONSE_SIZE.labels(*labels).observe(response.content_length)
+        return response
+
+    @app.teardown_request
+    def teardown_request(exc):
+        labels = g.pop('metrics_labels', None)
+        if labels is not None:
+            HTTP_REQUESTS_IN_PROGRESS.labels(*labels).dec()
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def metrics():
+    """Expose all registered metrics in the Prometheus text format.
+
+    With `PROMETHEUS_MULTIPROC_DIR` set (see docker/entrypoint.sh), the metrics of all
+    gunicorn workers are aggregated from the shared directory.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(storage_cache_collector)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
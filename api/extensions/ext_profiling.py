@@ -0,0 +1,162 @@
+import json
+import logging
+import random
+import time
+import uuid
+
+from flask import Flask, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.exceptions import Unauthorized
+from werkzeug.wsgi import ClosingIterator
+
+from extensions.ext_redis import redis_client
+from extensions.ext_storage import storage
+from libs.profiler import RequestProfile, SamplingProfiler
+
+PROFILING_TOKEN_HEADER = 'X-Profile-Token'
+PROFILING_TOKEN_SALT = 'request-profiling'
+
+ENDPOINTS_KEY = 'profiling:endpoints'
+OUTPUT_EXTENSIONS = {
+    'collapsed': 'txt',
+    'speedscope': 'speedscope.json',
+}
+
+
+def _slowest_key(endpoint: str) -> str:
+    return 'profiling:slowest:{endpoint}'.format(endpoint=endpoint)
+
+
+def generate_profiling_token(secret_key: str) -> str:
+    return URLSafeTimedSerializer(secret_key, salt=PROFILING_TOKEN_SALT).dumps('profile')
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles a sample of requests with a wall-clock sampling profiler.
+
+    A request is profiled when `PROFILING_ENABLED` is set and it falls into
+    `PROFILING_SAMPLE_RATE`, or when it carries a valid `X-Profile-Token` header (see
+    `flask generate-profiling-token`). The profile is written through the storage layer and
+    kept in a per-endpoint top-N of the slowest profiled requests in Redis, after the
+    response has been sent. Bodies of streamed responses are produced after the profiled
+    call returns and are not part of the profile. The same token is required to read the
+    top-N from `/profiling/slowest`.
+    """
+
+    def __init__(self, app: Flask, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.enabled = app.config.get('PROFILING_ENABLED')
+        self.sample_rate = app.config.get('PROFILING_SAMPLE_RATE')
+        self.output_format = app.config.get('PROFILING_OUTPUT_FORMAT')
+        self.top_n = app.config.get('PROFILING_TOP_N')
+        self.token_max_age = app.config.get('PROFILING_TOKEN_MAX_AGE')
+        self.serializer = None
+        if app.config.get('SECRET_KEY'):
+            self.serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=PROFILING_TOKEN_SALT)
+        self.profiler = SamplingProfiler(app.config.get('PROFILING_INTERVAL_MS') / 1000)
+
+        if self.output_format not in OUTPUT_EXTENSIONS:
+            raise ValueError('Unsupported profiling output format: {output_format}'.format(
+                output_format=self.output_format))
+
+    def has_valid_token(self, environ) -> bool:
+        token = environ.get('HTTP_X_PROFILE_TOKEN')
+        if not token or self.serializer is None:
+            return False
+        try:
+            self.serializer.loads(token, max_age=self.token_max_age)
+            return True
+        except BadSignature:
+            return False
+
+    def should_profile(self, environ) -> bool:
+        if self.has_valid_token(environ):
+            return True
+        return self.enabled and random.random() < self.sample_rate
+
+    def __call__(self, environ, start_response):
+        if not self.should_profile(environ):
+            return self.wsgi_app(environ, start_response)
+
+        # this frame stays on the stack while the request is handled, see RequestProfile
+        profile = self.profiler.start()
+        try:
+            response = self.wsgi_app(environ, start_response)
+        finally:
+            self.profiler.stop(profile)
+        return ClosingIterator(response, lambda: self.record(environ, profile))
+
+    def record(self, environ, profile: RequestProfile):
+        try:
+            self._record(environ, profile)
+        except Exception:
+            logging.exception('Failed to record request profile')
+
+    def _record(self, environ, profile: RequestProfile):
+        endpoint = environ.get('profiling.endpoint') or 'unmatched'
+        key = _slowest_key(endpoint)
+
+        # skip the upload when the request would not make it into the top-N anyway
+        slowest = redis_client.zrange(key, 0, 0, withscores=True)
+        if slowest and redis_client.zcard(key) >= self.top_n and profile.duration <= slowest[0][1]:
+            return
+
+        filename = 'profiles/{endpoint}/{date}/{id}.{ext}'.format(
+            endpoint=endpoint,
+            date=time.strftime('%Y%m%d'),
+            id=uuid.uuid4().hex,
+            ext=OUTPUT_EXTENSIONS[self.output_format],
+        )
+        if self.output_format == 'speedscope':
+            data = profile.to_speedscope('{method} {path}'.format(method=environ.get('REQUEST_METHOD'),
+                                                                  path=environ.get('PATH_INFO')))
+        else:
+            data = profile.to_collapsed()
+        storage.save(filename, data.encode())
+
+        entry = json.dumps({
+            'method': environ.get('REQUEST_METHOD'),
+            'path': environ.get('PATH_INFO'),
+            'duration_ms': round(profile.duration * 1000, 3),
+            'samples': sum(profile.samples.values()),
+            'profile': filename,
+            'created_at': int(time.time()),
+        })
+        pipeline = redis_client.pipeline()
+        pipeline.sadd(ENDPOINTS_KEY, endpoint)
+        pipeline.zadd(key, {entry: profile.duration})
+        pipeline.zrange(key, 0, -(self.top_n + 1))
+        pipeline.zremrangebyrank(key, 0, -(self.top_n + 1))
+        evicted = pipeline.execute()[2]
+
+        for member in evicted:
+            storage.delete(json.loads(member)['profile'])
+
+
+def init_app(app: Flask):
+    middleware = ProfilingMiddleware(app, app.wsgi_app)
+    app.wsgi_app = middleware
+
+    @app.before_request
+    def before_request():
+        # the endpoint is only known inside the request context, the middleware reads it after the call
+        request.environ['profiling.endpoint'] = request.endpoint
+
+    def slowest():
+        # request paths and timings are not public, read them with a profiling token
+        if not middleware.has_valid_token(request.environ):
+            raise Unauthorized('Invalid or missing {header} header.'.format(header=PROFILING_TOKEN_HEADER))
+        return slowest_profiles()
+
+    app.add_url_rule('/profiling/slowest', 'profiling_slowest', slowest)
+
+
+def slowest_profiles():
+    """Return the slowest profiled requests of every endpoint, or of `?endpoint=` only."""
+    endpoint = request.args.get('endpoint')
+    endpoints = [endpoint] if endpoint else sorted(member.decode() for member in redis_client.smembers(ENDPOINTS_KEY))
+
+    return {
+        endpoint: [json.loads(member) for member in redis_client.zrevrange(_slowest_key(endpoint), 0, -1)]
+        for endpoint in endpoints
+    }
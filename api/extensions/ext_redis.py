@@ -21,3 +21,13 @@ def init_app(app):
     }, connection_class=connection_class)
 
     app.extensions['redis'] = redis_client
+
+
+def get_pool_stat() -> dict:
+    pool = redis_client.connection_pool
+    return {
+        'max_connections': pool.max_connections,
+        'created_connections': pool._created_connections,
+        'available_connections': len(pool._available_connections),
+        'in_use_connections': len(pool._in_use_connections),
+    }
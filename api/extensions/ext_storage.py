@@ -1,20 +1,34 @@
-from collections.abc import Generator
+import io
+from collections.abc import Generator, Iterable
 from typing import Union
 
 from flask import Flask
 
 from extensions.storage.aliyun_storage import AliyunStorage
+from extensions.storage.async_storage import AsyncStorage
+from extensions.storage.base_storage import ObjectInfo
+from extensions.storage.cached_storage import CachedStorage
+from extensions.storage.compressed_storage import CompressedStorage
+from extensions.storage.dedup_storage import DedupStorage
+from extensions.storage.instrumented_storage import InstrumentedStorage
 from extensions.storage.local_storage import LocalStorage
+from extensions.storage.s3_storage import S3Storage
 from extensions.storage.tencent_storage import TencentStorage
 
 
 class Storage:
     def __init__(self):
         self.storage_runner = None
+        self.batch_concurrency = 1
 
     def init_app(self, app: Flask):
+        self.batch_concurrency = app.config.get('STORAGE_BATCH_CONCURRENCY') or 1
         storage_type = app.config.get('STORAGE_TYPE')
-        if storage_type == 'aliyun-oss':
+        if storage_type == 's3':
+            self.storage_runner = S3Storage(
+                app=app
+            )
+        elif storage_type == 'aliyun-oss':
             self.storage_runner = AliyunStorage(
                 app=app
             )
@@ -25,9 +39,37 @@ class Storage:
         else:
             self.storage_runner = LocalStorage(app=app)
 
+        if app.config.get('STORAGE_CACHE_ENABLED') and not isinstance(self.storage_runner, LocalStorage):
+            self.storage_runner = CachedStorage(
+                app=app,
+                runner=self.storage_runner
+            )
+
+        if app.config.get('STORAGE_COMPRESSION'):
+            self.storage_runner = CompressedStorage(
+                app=app,
+                runner=self.storage_runner
+            )
+
+        if app.config.get('STORAGE_DEDUP_ENABLED'):
+            self.storage_runner = DedupStorage(
+                app=app,
+                runner=self.storage_runner
+            )
+
+        if app.config.get('METRICS_ENABLED'):
+            self.storage_runner = InstrumentedStorage(
+                app=app,
+                runner=self.storage_runner,
+                backend=storage_type or 'local'
+            )
+
     def save(self, filename, data):
         self.storage_runner.save(filename, data)
 
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        self.storage_runner.save_stream(filename, data)
+
     def load(self, filename: str, stream: bool = False) -> Union[bytes, Generator]:
         if stream:
             return self.load_stream(filename)
@@ -40,6 +82,24 @@ class Storage:
     def load_stream(self, filename: str) -> Generator:
         return self.storage_runner.load_stream(filename)
 
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        return self.storage_runner.load_range(filename, start, end)
+
+    def size(self, filename: str) -> int:
+        return self.storage_runner.size(filename)
+
+    def get_etag(self, filename: str) -> str | None:
+        return self.storage_runner.get_etag(filename)
+
+    def head(self, filename: str) -> ObjectInfo:
+        return self.storage_runner.head(filename)
+
+    def get_local_path(self, filename: str) -> str | None:
+        return self.storage_runner.get_local_path(filename)
+
+    def open_reader(self, filename: str, buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> io.BufferedReader:
+        return self.storage_runner.open_reader(filename, buffer_size)
+
     def download(self, filename, target_filepath):
         self.storage_runner.download(filename, target_filepath)
 
@@ -49,9 +109,20 @@ class Storage:
     def delete(self, filename):
         return self.storage_runner.delete(filename)
 
+    def exists_many(self, filenames: Iterable[str], concurrency: int | None = None) -> list[bool]:
+        return self.storage_runner.exists_many(filenames, concurrency or self.batch_concurrency)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int | None = None):
+        self.storage_runner.delete_many(filenames, concurrency or self.batch_concurrency)
+
+    def list(self, prefix: str = '') -> Generator:
+        return self.storage_runner.list(prefix)
+
 
 storage = Storage()
+async_storage = AsyncStorage(storage)
 
 
 def init_app(app: Flask):
     storage.init_app(app)
+    async_storage.init_app(app)
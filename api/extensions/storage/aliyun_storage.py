@@ -1,10 +1,11 @@
-from collections.abc import Generator
+import io
+from collections.abc import Generator, Iterable, Iterator
 from contextlib import closing
 
 import oss2 as aliyun_s3
 from flask import Flask
 
-from extensions.storage.base_storage import BaseStorage
+from extensions.storage.base_storage import BaseStorage, ObjectInfo
 
 
 class AliyunStorage(BaseStorage):
@@ -33,19 +34,80 @@ class AliyunStorage(BaseStorage):
     def save(self, filename, data):
         self.client.put_object(filename, data)
 
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        single_part, parts = self.peek_single_part(self.iter_parts(data, self.part_size))
+        if single_part is not None:
+            self.client.put_object(filename, single_part)
+            return
+
+        upload_id = self.client.init_multipart_upload(filename).upload_id
+        try:
+            uploaded = self.upload_parts(
+                parts,
+                lambda part_number, part: self.client.upload_part(filename, upload_id, part_number, part).etag
+            )
+            self.client.complete_multipart_upload(
+                filename,
+                upload_id,
+                [aliyun_s3.models.PartInfo(part_number, etag) for part_number, etag in uploaded]
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(filename, upload_id)
+            raise
+
     def load_once(self, filename: str) -> bytes:
-        with closing(self.client.get_object(filename)) as obj:
+        with closing(self._get_object(filename)) as obj:
             data = obj.read()
         return data
 
     def load_stream(self, filename: str) -> Generator:
         def generate(filename: str = filename) -> Generator:
-            with closing(self.client.get_object(filename)) as obj:
-                while chunk := obj.read(4096):
+            with closing(self._get_object(filename)) as obj:
+                while chunk := obj.read(self.chunk_size):
                     yield chunk
 
         return generate()
 
+    def load_stream_with_etag(self, filename: str) -> tuple[Iterator[bytes], str | None]:
+        obj = self._get_object(filename)
+
+        def generate() -> Generator:
+            with closing(obj):
+                while chunk := obj.read(self.chunk_size):
+                    yield chunk
+
+        return generate(), obj.etag
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        # without the standard range behavior OSS silently returns the whole object for invalid ranges
+        headers = {'x-oss-range-behavior': 'standard'}
+        with closing(self._get_object(filename, byte_range=(start, end), headers=headers)) as obj:
+            data = obj.read()
+        return data
+
+    def size(self, filename: str) -> int:
+        return self._head_object(filename).content_length
+
+    def get_etag(self, filename: str) -> str | None:
+        return self._head_object(filename).etag
+
+    def head(self, filename: str) -> ObjectInfo:
+        result = self._head_object(filename)
+        return ObjectInfo(result.content_length, result.etag)
+
+    def _get_object(self, filename: str, **kwargs):
+        try:
+            return self.client.get_object(filename, **kwargs)
+        except aliyun_s3.exceptions.NoSuchKey:
+            raise FileNotFoundError("File not found")
+
+    def _head_object(self, filename: str):
+        try:
+            return self.client.head_object(filename)
+        except aliyun_s3.exceptions.NotFound:
+            # HEAD responses have no body, so a missing key is a plain 404 rather than NoSuchKey
+            raise FileNotFoundError("File not found")
+
     def download(self, filename, target_filepath):
         self.client.get_object_to_file(filename, target_filepath)
 
@@ -54,3 +116,19 @@ class AliyunStorage(BaseStorage):
 
     def delete(self, filename):
         self.client.delete_object(filename)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        filenames = [*filenames]
+        # OSS accepts at most 1000 keys per batch delete request
+        batches = [filenames[i:i + 1000] for i in range(0, len(filenames), 1000)]
+
+        def delete_batch(batch: list[str]) -> dict[str, str]:
+            # OSS lists the deleted keys, including ones that did not exist, anything else failed
+            deleted = set(self.client.batch_delete_objects(batch).deleted_keys)
+            return {filename: 'not deleted' for filename in batch if filename not in deleted}
+
+        self.raise_batch_delete_errors(self.map_concurrently(delete_batch, batches, concurrency))
+
+    def list(self, prefix: str = '') -> Generator:
+        for obj in aliyun_s3.ObjectIteratorV2(self.client, prefix=prefix, max_keys=1000):
+            yield obj.key
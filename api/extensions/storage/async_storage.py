@@ -0,0 +1,84 @@
+import asyncio
+import io
+from collections.abc import AsyncGenerator, Iterable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import partial
+
+from flask import Flask
+
+
+class AsyncStorage:
+    """Asyncio facade over the synchronous storage facade.
+
+    Every backend call runs in a bounded pool of real OS threads, so SDKs that block
+    in C code or on sockets they do not yield on never stall the event loop, and
+    concurrent fetches of many objects overlap instead of serializing.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.max_workers = 16
+        self._executor = None
+
+    def init_app(self, app: Flask):
+        self.max_workers = app.config.get('STORAGE_ASYNC_MAX_WORKERS') or self.max_workers
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self._create_executor()
+        return self._executor
+
+    def _create_executor(self) -> Executor:
+        try:
+            from gevent import monkey
+        except ImportError:
+            return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='async_storage')
+
+        if monkey.is_module_patched('threading'):
+            # monkey-patched threads are greenlets, use gevent's pool of native threads instead
+            from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+            return NativeThreadPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='async_storage')
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def save(self, filename: str, data: bytes):
+        await self._run(self.storage.save, filename, data)
+
+    async def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        await self._run(self.storage.save_stream, filename, data)
+
+    async def load(self, filename: str) -> bytes:
+        return await self._run(self.storage.load_once, filename)
+
+    async def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        return await self._run(self.storage.load_range, filename, start, end)
+
+    async def stream(self, filename: str) -> AsyncGenerator[bytes, None]:
+        chunks = self.storage.load_stream(filename)
+        sentinel = object()
+        try:
+            while (chunk := await self._run(next, chunks, sentinel)) is not sentinel:
+                yield chunk
+        finally:
+            await self._run(chunks.close)
+
+    async def exists(self, filename: str) -> bool:
+        return await self._run(self.storage.exists, filename)
+
+    async def delete(self, filename: str):
+        await self._run(self.storage.delete, filename)
+
+    async def load_many(self, filenames: Iterable[str], concurrency: int | None = None) -> list[bytes | Exception]:
+        """Fetch many objects concurrently, results are returned in input order with
+        the exception in place of the data for objects that failed to load."""
+        semaphore = asyncio.Semaphore(concurrency or self.max_workers)
+
+        async def load_one(filename: str) -> bytes:
+            async with semaphore:
+                return await self.load(filename)
+
+        return await asyncio.gather(*(load_one(filename) for filename in filenames), return_exceptions=True)
@@ -1,10 +1,32 @@
 """Abstract interface for file storage implementations."""
+import io
+import logging
+import os
+import threading
+import time
 from abc import ABC, abstractmethod
-from collections.abc import Generator
+from collections.abc import Callable, Generator, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from typing import NamedTuple
 
 from flask import Flask
 
 
+class BatchDeleteError(Exception):
+    """Raised by ``delete_many`` when the backend reports files it could not delete."""
+
+    def __init__(self, errors: dict[str, str]):
+        self.errors = errors
+        super().__init__('Failed to delete {count} files: {filenames}'.format(
+            count=len(errors), filenames=', '.join(sorted(errors))))
+
+
+class ObjectInfo(NamedTuple):
+    size: int
+    etag: str | None
+
+
 class BaseStorage(ABC):
     """Interface for file storage.
     """
@@ -12,11 +34,22 @@ class BaseStorage(ABC):
 
     def __init__(self, app: Flask):
         self.app = app
+        self.chunk_size = app.config.get('STORAGE_STREAM_CHUNK_SIZE') or 256 * 1024
+        self.part_size = app.config.get('STORAGE_MULTIPART_PART_SIZE') or 8 * 1024 * 1024
+        self.multipart_concurrency = app.config.get('STORAGE_MULTIPART_CONCURRENCY') or 4
+        self.multipart_retries = app.config.get('STORAGE_MULTIPART_RETRIES', 3)
 
     @abstractmethod
     def save(self, filename, data):
         raise NotImplementedError
 
+    @abstractmethod
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        """Save a file from an iterable of byte chunks or a readable file object,
+        without holding the whole payload in memory.
+        """
+        raise NotImplementedError
+
     @abstractmethod
     def load_once(self, filename: str) -> bytes:
         raise NotImplementedError
@@ -25,6 +58,42 @@ class BaseStorage(ABC):
     def load_stream(self, filename: str) -> Generator:
         raise NotImplementedError
 
+    @abstractmethod
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        """Load bytes ``start`` to ``end`` (inclusive, like HTTP ranges) of a file.
+
+        ``end`` of None reads to the end of the file.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def size(self, filename: str) -> int:
+        raise NotImplementedError
+
+    def get_etag(self, filename: str) -> str | None:
+        """Return the ETag of the file, or None if the backend does not provide one."""
+        return None
+
+    def head(self, filename: str) -> ObjectInfo:
+        """Return the size and ETag of the file, backends override it to fetch both with one request."""
+        return ObjectInfo(self.size(filename), self.get_etag(filename))
+
+    def load_stream_with_etag(self, filename: str) -> tuple[Iterator[bytes], str | None]:
+        """Start reading the file and return its chunks with the ETag of the version being read.
+
+        Backends answering the read with the ETag override it to save the separate lookup.
+        """
+        etag = self.get_etag(filename)
+        return iter(self.load_stream(filename)), etag
+
+    def get_local_path(self, filename: str) -> str | None:
+        """Return the path of the file on the local filesystem, or None if it is not stored locally."""
+        return None
+
+    def open_reader(self, filename: str, buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> io.BufferedReader:
+        """Open a read-only, seekable file-like object backed by ranged reads."""
+        return io.BufferedReader(StorageReader(self, filename), buffer_size=buffer_size)
+
     @abstractmethod
     def download(self, filename, target_filepath):
         raise NotImplementedError
@@ -36,3 +105,148 @@ class BaseStorage(ABC):
     @abstractmethod
     def delete(self, filename):
         raise NotImplementedError
+
+    def exists_many(self, filenames: Iterable[str], concurrency: int = 1) -> list[bool]:
+        """Check many files at once, results are returned in input order."""
+        return self.map_concurrently(self.exists, filenames, concurrency)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        self.map_concurrently(self.delete, filenames, concurrency)
+
+    @staticmethod
+    def raise_batch_delete_errors(batch_errors: Iterable[dict[str, str]]):
+        """Log and raise the per-file failures of all batches of a batch delete, if any."""
+        errors = {filename: error for errors in batch_errors for filename, error in errors.items()}
+        if errors:
+            for filename, error in errors.items():
+                logging.error("Failed to delete %s: %s", filename, error)
+            raise BatchDeleteError(errors)
+
+    @staticmethod
+    def map_concurrently(func: Callable, items: Iterable, concurrency: int) -> list:
+        items = list(items)
+        if concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(items))) as executor:
+            return [*executor.map(func, items)]
+
+    def iter_parts(self, data: Iterable[bytes] | io.IOBase, part_size: int) -> Iterator[bytes]:
+        """Re-chunk a file object or an iterable of bytes into parts of exactly ``part_size``
+        bytes, except for the last one.
+        """
+        if hasattr(data, 'read'):
+            while part := data.read(part_size):
+                yield part
+            return
+
+        buffer = bytearray()
+        for chunk in data:
+            buffer += chunk
+            while len(buffer) >= part_size:
+                yield bytes(buffer[:part_size])
+                del buffer[:part_size]
+        if buffer:
+            yield bytes(buffer)
+
+    def peek_single_part(self, parts: Iterator[bytes]) -> tuple[bytes | None, Iterator[bytes]]:
+        """Return ``(data, parts)`` where ``data`` is the whole payload if it fits in one part,
+        otherwise None and ``parts`` still yields every part.
+        """
+        first = next(parts, b'')
+        second = next(parts, None)
+        if second is None:
+            return first, iter(())
+        return None, chain((first, second), parts)
+
+    def upload_parts(self, parts: Iterator[bytes], upload_part: Callable[[int, bytes], str]) -> list[tuple[int, str]]:
+        """Upload parts concurrently with ``upload_part(part_number, data) -> etag``.
+
+        At most ``2 * multipart_concurrency`` parts are held in memory at once. A failed part is
+        retried on its own, so parts that were already uploaded are never sent again.
+        Returns ``(part_number, etag)`` pairs in part order.
+        """
+        in_flight = threading.BoundedSemaphore(self.multipart_concurrency * 2)
+        failed = threading.Event()
+
+        def on_done(future):
+            if future.exception() is not None:
+                failed.set()
+            in_flight.release()
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.multipart_concurrency) as executor:
+            for part_number, part in enumerate(parts, start=1):
+                in_flight.acquire()
+                if failed.is_set():
+                    in_flight.release()
+                    break
+                future = executor.submit(self._upload_part_with_retry, upload_part, part_number, part)
+                future.add_done_callback(on_done)
+                futures.append((part_number, future))
+
+        return [(part_number, future.result()) for part_number, future in futures]
+
+    def _upload_part_with_retry(self, upload_part: Callable[[int, bytes], str], part_number: int, data: bytes) -> str:
+        attempt = 0
+        while True:
+            try:
+                return upload_part(part_number, data)
+            except Exception:
+                if attempt >= self.multipart_retries:
+                    raise
+                attempt += 1
+                logging.warning("Retrying upload of part %s (attempt %s)", part_number, attempt, exc_info=True)
+                time.sleep(min(2 ** attempt * 0.1, 5))
+
+    # keep `list` last in the class body, it would shadow the builtin in later annotations
+    @abstractmethod
+    def list(self, prefix: str = '') -> Generator:
+        """Lazily yield the names of all files starting with ``prefix``, fetching one page at a time."""
+        raise NotImplementedError
+
+
+class StorageReader(io.RawIOBase):
+    """Seekable raw reader that fetches only the requested byte ranges of a stored file.
+    """
+
+    def __init__(self, storage: BaseStorage, filename: str, size: int | None = None):
+        self._storage = storage
+        self._filename = filename
+        self._size = storage.size(filename) if size is None else size
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        if whence == os.SEEK_SET:
+            position = offset
+        elif whence == os.SEEK_CUR:
+            position = self._position + offset
+        elif whence == os.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError("Invalid whence ({whence})".format(whence=whence))
+
+        if position < 0:
+            raise ValueError("Negative seek position {position}".format(position=position))
+        self._position = position
+        return position
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self._size or len(buffer) == 0:
+            return 0
+
+        end = min(self._position + len(buffer), self._size) - 1
+        data = self._storage.load_range(self._filename, self._position, end)
+        length = len(data)
+        buffer[:length] = data
+        self._position += length
+        return length
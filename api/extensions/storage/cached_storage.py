@@ -0,0 +1,352 @@
+import fcntl
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import Generator, Iterable
+from dataclasses import dataclass
+
+from flask import Flask
+
+from extensions.storage.base_storage import BaseStorage
+
+ETAG_SUFFIX = '.etag'
+TEMP_SUFFIX = '.tmp'
+EVICTION_LOCK_FILE = '.evict.lock'
+# fraction of the budget a process writes before it scans the directory for eviction again
+EVICTION_SCAN_FRACTION = 1 / 64
+STALE_TEMP_FILE_AGE = 60 * 60
+
+
+@dataclass
+class CacheEntry:
+    path: str
+    size: int
+
+
+class CachedStorage(BaseStorage):
+    """Read-through local disk cache in front of another storage runner.
+
+    The cache directory is the index, shared by all processes of the host: lookups go to
+    the disk, so a save or delete through any worker drops the cached copy for all of them,
+    and the ``STORAGE_CACHE_MAX_SIZE`` budget covers the files of every worker, including
+    those left from before a restart. A file's access time (set explicitly on every hit, so
+    it does not depend on mount options) orders eviction, and its modification time records
+    when it was last validated.
+
+    Cached copies are validated against the remote size and ETag once they are older than
+    ``STORAGE_CACHE_REVALIDATE_INTERVAL`` seconds, which bounds how long a write through
+    another host can go unnoticed. Objects under ``STORAGE_CACHE_EXCLUDED_PREFIXES``, such
+    as tenant private keys, are never cached. Hit, miss and eviction counters are per process.
+    """
+
+    def __init__(self, app: Flask, runner: BaseStorage):
+        super().__init__(app)
+        self.runner = runner
+
+        folder = app.config.get('STORAGE_CACHE_PATH')
+        if not os.path.isabs(folder):
+            folder = os.path.join(app.root_path, folder)
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.max_size = app.config.get('STORAGE_CACHE_MAX_SIZE')
+        self.revalidate_interval = app.config.get('STORAGE_CACHE_REVALIDATE_INTERVAL')
+        self.excluded_prefixes = tuple(
+            prefix.strip() for prefix in (app.config.get('STORAGE_CACHE_EXCLUDED_PREFIXES') or '').split(',')
+            if prefix.strip()
+        )
+
+        self._lock = threading.Lock()
+        self._written_since_eviction = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._remove_stale_temp_files()
+        self._evict()
+
+    def save(self, filename, data):
+        self.invalidate(filename)
+        self.runner.save(filename, data)
+
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        self.invalidate(filename)
+        self.runner.save_stream(filename, data)
+
+    def load_once(self, filename: str) -> bytes:
+        entry = self._get_valid_entry(filename)
+        if entry:
+            try:
+                with open(entry.path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                self.invalidate(filename)
+
+        # the ETag comes with the read, a separate lookup could also race with a concurrent write
+        chunks, etag = self.runner.load_stream_with_etag(filename)
+        data = b''.join(chunks)
+        self._put(filename, [data], len(data), etag)
+        return data
+
+    def load_stream(self, filename: str) -> Generator:
+        def generate(filename: str = filename) -> Generator:
+            entry = self._get_valid_entry(filename)
+            if entry:
+                try:
+                    f = open(entry.path, "rb")
+                except FileNotFoundError:
+                    self.invalidate(filename)
+                else:
+                    with f:
+                        while chunk := f.read(self.chunk_size):
+                            yield chunk
+                    return
+
+            chunks, etag = self.runner.load_stream_with_etag(filename)
+            yield from self._tee(filename, chunks, etag)
+
+        return generate()
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        entry = self._get_valid_entry(filename)
+        if entry:
+            try:
+                with open(entry.path, "rb") as f:
+                    f.seek(start)
+                    return f.read(-1 if end is None else end - start + 1)
+            except FileNotFoundError:
+                self.invalidate(filename)
+
+        # partial reads go straight to the backend instead of pulling the whole object
+        return self.runner.load_range(filename, start, end)
+
+    def size(self, filename: str) -> int:
+        entry = self._get_valid_entry(filename)
+        if entry:
+            return entry.size
+        return self.runner.size(filename)
+
+    def get_etag(self, filename: str) -> str | None:
+        return self.runner.get_etag(filename)
+
+    def get_local_path(self, filename: str) -> str | None:
+        entry = self._get_valid_entry(filename)
+        if entry and os.path.isfile(entry.path):
+            return entry.path
+        return None
+
+    def download(self, filename, target_filepath):
+        entry = self._get_valid_entry(filename)
+        if entry:
+            try:
+                shutil.copyfile(entry.path, target_filepath)
+                return
+            except FileNotFoundError:
+                self.invalidate(filename)
+
+        self.runner.download(filename, target_filepath)
+
+    def exists(self, filename):
+        return self.runner.exists(filename)
+
+    def delete(self, filename):
+        self.invalidate(filename)
+        return self.runner.delete(filename)
+
+    def exists_many(self, filenames: Iterable[str], concurrency: int = 1) -> list[bool]:
+        return self.runner.exists_many(filenames, concurrency)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        filenames = [*filenames]
+        for filename in filenames:
+            self.invalidate(filename)
+        self.runner.delete_many(filenames, concurrency)
+
+    def invalidate(self, filename: str):
+        path = self._path(filename)
+        self._remove_file(path)
+        self._remove_file(path + ETAG_SUFFIX)
+
+    def stats(self) -> dict:
+        files = self._scan()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(files),
+                'size': sum(size for _, _, size in files),
+                'max_size': self.max_size,
+            }
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.folder, hashlib.sha256(filename.encode()).hexdigest())
+
+    def _cacheable(self, filename: str) -> bool:
+        return not filename.startswith(self.excluded_prefixes)
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _get_valid_entry(self, filename: str) -> CacheEntry | None:
+        if not self._cacheable(filename):
+            return None
+
+        path = self._path(filename)
+        try:
+            stat = os.stat(path)
+            validated_at = stat.st_mtime
+            if time.time() - validated_at >= self.revalidate_interval:
+                if not self._revalidate(filename, path, stat.st_size):
+                    self.invalidate(filename)
+                    self._count(hit=False)
+                    return None
+                validated_at = time.time()
+            # mark the access for eviction, and the validation if there was one
+            os.utime(path, (time.time(), validated_at))
+        except FileNotFoundError:
+            self._count(hit=False)
+            return None
+
+        self._count(hit=True)
+        return CacheEntry(path=path, size=stat.st_size)
+
+    def _revalidate(self, filename: str, path: str, size: int) -> bool:
+        try:
+            # one HEAD for both validators
+            info = self.runner.head(filename)
+        except FileNotFoundError:
+            return False
+        if info.size != size:
+            return False
+        etag = self._read_etag(path)
+        return etag is None or info.etag == etag
+
+    @staticmethod
+    def _read_etag(path: str) -> str | None:
+        try:
+            with open(path + ETAG_SUFFIX, encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _tee(self, filename: str, chunks: Iterable[bytes], etag: str | None) -> Generator:
+        """Yield chunks to the caller while writing them to the cache, keeping the copy only
+        if the stream was consumed completely and fits in the budget."""
+        if not self._cacheable(filename):
+            yield from chunks
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.', suffix=TEMP_SUFFIX)
+        size = 0
+        completed = False
+        try:
+            with open(fd, "wb") as f:
+                for chunk in chunks:
+                    if size <= self.max_size:
+                        f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            completed = True
+        finally:
+            if completed and size <= self.max_size:
+                self._commit(filename, tmp_path, size, etag)
+            else:
+                self._remove_file(tmp_path)
+
+    def _put(self, filename: str, chunks: Iterable[bytes], size: int, etag: str | None):
+        if size > self.max_size or not self._cacheable(filename):
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.', suffix=TEMP_SUFFIX)
+        try:
+            with open(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+        except BaseException:
+            self._remove_file(tmp_path)
+            raise
+        self._commit(filename, tmp_path, size, etag)
+
+    def _commit(self, filename: str, tmp_path: str, size: int, etag: str | None):
+        path = self._path(filename)
+        if etag is None:
+            self._remove_file(path + ETAG_SUFFIX)
+        else:
+            fd, etag_tmp_path = tempfile.mkstemp(dir=self.folder, prefix='.', suffix=TEMP_SUFFIX)
+            with open(fd, "w", encoding='utf-8') as f:
+                f.write(etag)
+            os.replace(etag_tmp_path, path + ETAG_SUFFIX)
+        os.replace(tmp_path, path)
+
+        # scanning the directory costs a stat per cached file, so it only happens once this
+        # process has written a slice of the budget since the last scan
+        with self._lock:
+            self._written_since_eviction += size
+            if self._written_since_eviction < self.max_size * EVICTION_SCAN_FRACTION:
+                return
+            self._written_since_eviction = 0
+        self._evict()
+
+    def _scan(self) -> list[tuple[float, str, int]]:
+        """(access time, path, size) of the cached files of all processes."""
+        files = []
+        for entry in os.scandir(self.folder):
+            if entry.name.startswith('.') or entry.name.endswith(ETAG_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_atime, entry.path, stat.st_size))
+        return files
+
+    def _evict(self):
+        """Remove the least recently used files until the directory fits in the budget."""
+        with open(os.path.join(self.folder, EVICTION_LOCK_FILE), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # another process is evicting and will account for our files too
+                return
+
+            files = sorted(self._scan())
+            total = sum(size for _, _, size in files)
+            # the most recently used file stays even if it alone exceeds the budget
+            for _, path, size in files[:-1]:
+                if total <= self.max_size:
+                    break
+                self._remove_file(path)
+                self._remove_file(path + ETAG_SUFFIX)
+                total -= size
+                with self._lock:
+                    self.evictions += 1
+
+    def _remove_stale_temp_files(self):
+        # left behind by processes that died while writing to the cache
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(TEMP_SUFFIX):
+                try:
+                    if time.time() - entry.stat().st_mtime > STALE_TEMP_FILE_AGE:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix: str = '') -> Generator:
+        return self.runner.list(prefix)
@@ -0,0 +1,391 @@
+import gzip
+import io
+import mimetypes
+import struct
+import tempfile
+import zlib
+from collections.abc import Generator, Iterable
+from typing import NamedTuple
+
+from flask import Flask
+
+from extensions.storage.base_storage import BaseStorage, StorageReader
+
+# header of a compressed object: magic, codec id, uncompressed size and block size, followed by
+# the compressed length of every block; blocks are compressed independently so a range read
+# only fetches and decodes the blocks it overlaps
+HEADER_MAGIC = b'\x89SCZ'
+HEADER_FORMAT = '>4sBQI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+BLOCK_LENGTH_FORMAT = '>I'
+BLOCK_LENGTH_SIZE = struct.calcsize(BLOCK_LENGTH_FORMAT)
+BLOCK_SIZE = 1024 * 1024
+
+# formats that are already compressed and would only cost CPU to compress again
+COMPRESSED_MIMETYPE_PREFIXES = ('image/', 'video/', 'audio/')
+COMPRESSED_MIMETYPES = {
+    'application/gzip',
+    'application/pdf',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-rar-compressed',
+    'application/x-xz',
+    'application/zip',
+    'application/zstd',
+}
+# leading bytes of the same formats, for keys without a telling extension such as the
+# `blobs/<digest>` keys DedupStorage saves through this storage
+COMPRESSED_SIGNATURES = (
+    b'\x1f\x8b',  # gzip
+    b'\x28\xb5\x2f\xfd',  # zstd
+    b'\xfd7zXZ\x00',  # xz
+    b'BZh',  # bzip2
+    b"7z\xbc\xaf'\x1c",  # 7z
+    b'Rar!\x1a\x07',  # rar
+    b'PK\x03\x04',  # zip, docx, xlsx, pptx
+    b'%PDF-',
+    b'\x89PNG\r\n\x1a\n',
+    b'\xff\xd8\xff',  # jpeg
+    b'GIF87a',
+    b'GIF89a',
+    b'ID3',  # mp3
+    b'OggS',
+    b'fLaC',
+    b'\x1a\x45\xdf\xa3',  # webm, mkv
+)
+SNIFF_SIZE = 16
+
+
+class GzipCodec:
+    codec_id = 1
+
+    def __init__(self, level: int | None = None):
+        self.level = 6 if level is None else level
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def compressobj(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+    def decompressobj(self):
+        return zlib.decompressobj(31)
+
+
+class ZstdCodec:
+    codec_id = 2
+
+    def __init__(self, level: int | None = None):
+        import zstandard
+
+        self.zstandard = zstandard
+        self.level = 3 if level is None else level
+
+    def compress(self, data: bytes) -> bytes:
+        return self.zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def compressobj(self):
+        return self.zstandard.ZstdCompressor(level=self.level).compressobj()
+
+    def decompressobj(self):
+        return self.zstandard.ZstdDecompressor().decompressobj()
+
+
+CODECS = {
+    'gzip': GzipCodec,
+    'zstd': ZstdCodec,
+}
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+class Layout(NamedTuple):
+    """Block layout of a compressed object, read from its header."""
+    codec_id: int
+    size: int
+    block_size: int
+    # offset of every block in the stored object, followed by the end of the last block
+    offsets: list[int]
+
+    @property
+    def block_count(self) -> int:
+        return len(self.offsets) - 1
+
+
+class CompressedStorage(BaseStorage):
+    """Transparently compresses stored objects with a pluggable codec.
+
+    Compressed objects start with a small header naming the codec, so reads of objects
+    stored raw (skipped MIME types, incompressible data, or files written before
+    compression was enabled) keep working unchanged.
+    """
+
+    def __init__(self, app: Flask, runner: BaseStorage):
+        super().__init__(app)
+        self.runner = runner
+
+        codec_name = app.config.get('STORAGE_COMPRESSION')
+        if codec_name not in CODECS:
+            raise ValueError('Unsupported storage compression codec: {codec}'.format(codec=codec_name))
+        self.codec = CODECS[codec_name](app.config.get('STORAGE_COMPRESSION_LEVEL'))
+        self.min_size = app.config.get('STORAGE_COMPRESSION_MIN_SIZE', 0)
+
+    def should_compress(self, filename: str, head: bytes = b'') -> bool:
+        """Whether data saved as `filename` that starts with `head` is worth compressing.
+
+        Names are not always those of the file, so the leading bytes are checked as well.
+        """
+        if _is_compressed_format(head):
+            return False
+        mimetype, encoding = mimetypes.guess_type(filename)
+        if encoding is not None:
+            return False
+        if mimetype is None:
+            return True
+        return not (mimetype.startswith(COMPRESSED_MIMETYPE_PREFIXES) or mimetype in COMPRESSED_MIMETYPES)
+
+    def _compress_blocks(self, data: bytes) -> list[bytes]:
+        return [self.codec.compress(data[i:i + BLOCK_SIZE]) for i in range(0, len(data), BLOCK_SIZE)]
+
+    def _header(self, size: int, block_lengths: list[int]) -> bytes:
+        return struct.pack(HEADER_FORMAT, HEADER_MAGIC, self.codec.codec_id, size, BLOCK_SIZE) + b''.join(
+            struct.pack(BLOCK_LENGTH_FORMAT, length) for length in block_lengths
+        )
+
+    @staticmethod
+    def _parse_header(data: bytes) -> tuple[int, int, int] | None:
+        """Return ``(codec_id, size, block_size)`` if ``data`` starts with a compression header."""
+        if len(data) < HEADER_SIZE or not data.startswith(HEADER_MAGIC):
+            return None
+        _, codec_id, size, block_size = struct.unpack(HEADER_FORMAT, data[:HEADER_SIZE])
+        return codec_id, size, block_size
+
+    @staticmethod
+    def _index_size(size: int, block_size: int) -> int:
+        return -(-size // block_size) * BLOCK_LENGTH_SIZE
+
+    @classmethod
+    def _parse_layout(cls, header: tuple[int, int, int], index: bytes) -> Layout:
+        codec_id, size, block_size = header
+        offset = HEADER_SIZE + len(index)
+        offsets = [offset]
+        for (length,) in struct.iter_unpack(BLOCK_LENGTH_FORMAT, index):
+            offset += length
+            offsets.append(offset)
+        return Layout(codec_id, size, block_size, offsets)
+
+    @staticmethod
+    def _decoder(codec_id: int):
+        codec = CODECS_BY_ID.get(codec_id)
+        if codec is None:
+            raise ValueError('Unknown storage compression codec id: {codec_id}'.format(codec_id=codec_id))
+        return codec().decompressobj()
+
+    def _decompress_block(self, codec_id: int, data: bytes) -> bytes:
+        decompressor = self._decoder(codec_id)
+        return decompressor.decompress(data) + decompressor.flush()
+
+    def _keep_compressed(self, size: int, stored_size: int) -> bool:
+        return size >= self.min_size and stored_size < size
+
+    def save(self, filename, data):
+        # raw data that happens to look like a header must be stored with one
+        looks_compressed = data.startswith(HEADER_MAGIC)
+        if looks_compressed or (self.should_compress(filename, data[:SNIFF_SIZE]) and len(data) >= self.min_size):
+            blocks = self._compress_blocks(data)
+            header = self._header(len(data), [len(block) for block in blocks])
+            if looks_compressed or self._keep_compressed(len(data), len(header) + sum(map(len, blocks))):
+                self.runner.save(filename, b''.join([header, *blocks]))
+                return
+        self.runner.save(filename, data)
+
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        blocks = self.iter_parts(data, BLOCK_SIZE)
+        first = next(blocks, b'')
+        looks_compressed = first.startswith(HEADER_MAGIC)
+        if not self.should_compress(filename, first[:SNIFF_SIZE]) and not looks_compressed:
+            self.runner.save_stream(filename, _prepend(first, blocks))
+            return
+
+        # spool both forms, the header needs every block length and save's rules need the final sizes
+        with (tempfile.SpooledTemporaryFile(max_size=self.part_size) as raw,
+              tempfile.SpooledTemporaryFile(max_size=self.part_size) as compressed):
+            size = 0
+            block_lengths = []
+            for block in _prepend(first, blocks):
+                raw.write(block)
+                size += len(block)
+                block_lengths.append(compressed.write(self.codec.compress(block)))
+
+            header = self._header(size, block_lengths)
+            if looks_compressed or self._keep_compressed(size, len(header) + compressed.tell()):
+                compressed.seek(0)
+                self.runner.save_stream(filename, _prepend(header, self.iter_parts(compressed, self.chunk_size)))
+            else:
+                raw.seek(0)
+                self.runner.save_stream(filename, raw)
+
+    def load_once(self, filename: str) -> bytes:
+        data = self.runner.load_once(filename)
+        header = self._parse_header(data)
+        if header is None:
+            return data
+
+        layout = self._parse_layout(header, data[HEADER_SIZE:HEADER_SIZE + self._index_size(*header[1:])])
+        return b''.join(
+            self._decompress_block(layout.codec_id, data[layout.offsets[i]:layout.offsets[i + 1]])
+            for i in range(layout.block_count)
+        )
+
+    def load_stream(self, filename: str) -> Generator:
+        def generate(filename: str = filename) -> Generator:
+            chunks = iter(self.runner.load_stream(filename))
+            buffer = bytearray()
+
+            def fill(length: int):
+                while len(buffer) < length and (chunk := next(chunks, None)) is not None:
+                    buffer.extend(chunk)
+
+            fill(HEADER_SIZE)
+            header = self._parse_header(buffer)
+            if header is None:
+                if buffer:
+                    yield bytes(buffer)
+                yield from chunks
+                return
+
+            index_end = HEADER_SIZE + self._index_size(*header[1:])
+            fill(index_end)
+            layout = self._parse_layout(header, bytes(buffer[HEADER_SIZE:index_end]))
+            del buffer[:index_end]
+            for i in range(layout.block_count):
+                length = layout.offsets[i + 1] - layout.offsets[i]
+                fill(length)
+                yield self._decompress_block(layout.codec_id, bytes(buffer[:length]))
+                del buffer[:length]
+
+        return generate()
+
+    def _read_layout(self, filename: str) -> Layout | None:
+        header = self._parse_header(self.runner.load_range(filename, 0, HEADER_SIZE - 1))
+        if header is None:
+            return None
+
+        index_size = self._index_size(*header[1:])
+        index = self.runner.load_range(filename, HEADER_SIZE, HEADER_SIZE + index_size - 1) if index_size else b''
+        return self._parse_layout(header, index)
+
+    def _load_blocks(self, filename: str, layout: Layout, first: int, last: int) -> bytes:
+        """Fetch blocks ``first`` to ``last`` (inclusive) with one ranged read and decode them."""
+        data = self.runner.load_range(filename, layout.offsets[first], layout.offsets[last + 1] - 1)
+        base = layout.offsets[first]
+        return b''.join(
+            self._decompress_block(layout.codec_id, data[layout.offsets[i] - base:layout.offsets[i + 1] - base])
+            for i in range(first, last + 1)
+        )
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        layout = self._read_layout(filename)
+        if layout is None:
+            return self.runner.load_range(filename, start, end)
+
+        stop = layout.size if end is None else min(end + 1, layout.size)
+        if start >= stop:
+            return b''
+        first, last = start // layout.block_size, (stop - 1) // layout.block_size
+        data = self._load_blocks(filename, layout, first, last)
+        offset = first * layout.block_size
+        return data[start - offset:stop - offset]
+
+    def open_reader(self, filename: str, buffer_size: int = io.DEFAULT_BUFFER_SIZE) -> io.BufferedReader:
+        layout = self._read_layout(filename)
+        if layout is None:
+            return super().open_reader(filename, buffer_size)
+        return io.BufferedReader(CompressedReader(self, filename, layout), buffer_size=buffer_size)
+
+    def size(self, filename: str) -> int:
+        header = self._parse_header(self.runner.load_range(filename, 0, HEADER_SIZE - 1))
+        if header is None:
+            return self.runner.size(filename)
+        return header[1]
+
+    def _is_compressed(self, filename: str) -> bool:
+        return self._parse_header(self.runner.load_range(filename, 0, HEADER_SIZE - 1)) is not None
+
+    def get_etag(self, filename: str) -> str | None:
+        return self.runner.get_etag(filename)
+
+    def get_local_path(self, filename: str) -> str | None:
+        local_path = self.runner.get_local_path(filename)
+        if local_path is None or self._is_compressed(filename):
+            # the stored bytes are not what the caller would serve
+            return None
+        return local_path
+
+    def download(self, filename, target_filepath):
+        if not self._is_compressed(filename):
+            self.runner.download(filename, target_filepath)
+            return
+
+        with open(target_filepath, 'wb') as f:
+            for chunk in self.load_stream(filename):
+                f.write(chunk)
+
+    def exists(self, filename):
+        return self.runner.exists(filename)
+
+    def delete(self, filename):
+        return self.runner.delete(filename)
+
+    def exists_many(self, filenames: Iterable[str], concurrency: int = 1) -> list[bool]:
+        return self.runner.exists_many(filenames, concurrency)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        self.runner.delete_many(filenames, concurrency)
+
+    def list(self, prefix: str = '') -> Generator:
+        return self.runner.list(prefix)
+
+
+def _is_compressed_format(head: bytes) -> bool:
+    if head.startswith(COMPRESSED_SIGNATURES):
+        return True
+    # ISO media (mp4, mov, heic, avif) and webp only have a fixed tag after a length or size field
+    return head[4:8] == b'ftyp' or (head.startswith(b'RIFF') and head[8:12] == b'WEBP')
+
+
+def _prepend(first: bytes, chunks: Iterable[bytes]) -> Generator:
+    if first:
+        yield first
+    yield from chunks
+
+
+class CompressedReader(StorageReader):
+    """Seekable reader over a compressed object that decodes one block at a time.
+
+    The layout is read once and the last decoded block is kept, so sequential reads
+    fetch and decompress every block only once.
+    """
+
+    def __init__(self, storage: CompressedStorage, filename: str, layout: Layout):
+        super().__init__(storage, filename, layout.size)
+        self._layout = layout
+        self._block_number = None
+        self._block = b''
+
+    def readinto(self, buffer) -> int:
+        if self._position >= self._size or len(buffer) == 0:
+            return 0
+
+        block_number, offset = divmod(self._position, self._layout.block_size)
+        if block_number != self._block_number:
+            self._block = self._storage._load_blocks(self._filename, self._layout, block_number, block_number)
+            self._block_number = block_number
+
+        data = self._block[offset:offset + len(buffer)]
+        length = len(data)
+        buffer[:length] = data
+        self._position += length
+        return length
@@ -0,0 +1,147 @@
+import hashlib
+import io
+import tempfile
+from collections.abc import Generator, Iterable
+
+from flask import Flask
+
+from extensions.ext_redis import redis_client
+from extensions.storage.base_storage import BaseStorage, ObjectInfo
+
+# atomically drop one reference and remove the counter once nothing refers to the blob
+DECREF_SCRIPT = """
+local remaining = redis.call('DECR', KEYS[1])
+if remaining <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return remaining
+"""
+
+
+class DedupStorage(BaseStorage):
+    """Content-addressed storage on top of another storage runner.
+
+    Data is stored once per SHA-256 digest under ``blobs/``, and logical filenames are
+    mapped to digests in Redis together with a reference count per digest. Saving data
+    that is already stored only touches Redis. Files saved before dedup was enabled have
+    no mapping and are still read from their own path, overwriting one leaves the old copy
+    shadowed until the file is deleted.
+    """
+
+    def __init__(self, app: Flask, runner: BaseStorage):
+        super().__init__(app)
+        self.runner = runner
+        self._decref = redis_client.register_script(DECREF_SCRIPT)
+
+    @staticmethod
+    def _ref_key(filename: str) -> str:
+        return 'storage_dedup:ref:{filename}'.format(filename=filename)
+
+    @staticmethod
+    def _refcount_key(digest: str) -> str:
+        return 'storage_dedup:refcount:{digest}'.format(digest=digest)
+
+    @staticmethod
+    def _lock_key(digest: str) -> str:
+        return 'storage_dedup:lock:{digest}'.format(digest=digest)
+
+    @staticmethod
+    def _blob_path(digest: str) -> str:
+        return 'blobs/{prefix}/{digest}'.format(prefix=digest[:2], digest=digest)
+
+    def _resolve(self, filename: str) -> str:
+        digest = redis_client.get(self._ref_key(filename))
+        if digest is None:
+            return filename
+        return self._blob_path(digest.decode())
+
+    def save(self, filename, data):
+        digest = hashlib.sha256(data).hexdigest()
+        self._link(filename, digest, lambda blob_path: self.runner.save(blob_path, data))
+
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        # hash while spooling to disk, the digest is only known once the stream is consumed
+        sha256 = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=self.part_size) as spool:
+            for part in self.iter_parts(data, self.chunk_size):
+                sha256.update(part)
+                spool.write(part)
+
+            def upload(blob_path: str):
+                spool.seek(0)
+                self.runner.save_stream(blob_path, spool)
+
+            self._link(filename, sha256.hexdigest(), upload)
+
+    def _link(self, filename: str, digest: str, upload):
+        refcount_key = self._refcount_key(digest)
+        # the blob is uploaded before it is referenced, so a failed upload leaves nothing behind
+        # and concurrent savers of the same data wait here instead of linking to a partial blob
+        with redis_client.lock(self._lock_key(digest), timeout=600):
+            if int(redis_client.get(refcount_key) or 0) <= 0:
+                upload(self._blob_path(digest))
+            redis_client.incr(refcount_key)
+
+        previous = redis_client.getset(self._ref_key(filename), digest)
+        if previous is not None:
+            self._release(previous.decode())
+
+    def _release(self, digest: str):
+        with redis_client.lock(self._lock_key(digest), timeout=600):
+            if self._decref(keys=[self._refcount_key(digest)]) <= 0:
+                self.runner.delete(self._blob_path(digest))
+
+    def load_once(self, filename: str) -> bytes:
+        return self.runner.load_once(self._resolve(filename))
+
+    def load_stream(self, filename: str) -> Generator:
+        def generate(filename: str = filename) -> Generator:
+            yield from self.runner.load_stream(self._resolve(filename))
+
+        return generate()
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        return self.runner.load_range(self._resolve(filename), start, end)
+
+    def size(self, filename: str) -> int:
+        return self.runner.size(self._resolve(filename))
+
+    def get_etag(self, filename: str) -> str | None:
+        return self.runner.get_etag(self._resolve(filename))
+
+    def head(self, filename: str) -> ObjectInfo:
+        return self.runner.head(self._resolve(filename))
+
+    def get_local_path(self, filename: str) -> str | None:
+        return self.runner.get_local_path(self._resolve(filename))
+
+    def download(self, filename, target_filepath):
+        self.runner.download(self._resolve(filename), target_filepath)
+
+    def exists(self, filename):
+        return bool(redis_client.exists(self._ref_key(filename))) or self.runner.exists(filename)
+
+    def delete(self, filename):
+        digest = redis_client.getdel(self._ref_key(filename))
+        if digest is not None:
+            self._release(digest.decode())
+        # also drop a copy saved before dedup was enabled, deleting a missing file is a no-op
+        self.runner.delete(filename)
+
+    def list(self, prefix: str = '') -> Generator:
+        listed = set()
+        ref_prefix = self._ref_key('')
+        for key in redis_client.scan_iter(match=self._ref_key(_escape_glob(prefix)) + '*', count=1000):
+            filename = key.decode()[len(ref_prefix):]
+            listed.add(filename)
+            yield filename
+
+        for filename in self.runner.list(prefix):
+            if filename not in listed and not filename.startswith('blobs/'):
+                yield filename
+
+
+def _escape_glob(pattern: str) -> str:
+    for char in '\\*?[]':
+        pattern = pattern.replace(char, '\\' + char)
+    return pattern
@@ -0,0 +1,164 @@
+import io
+import json
+import logging
+import time
+from collections.abc import Generator, Iterable
+
+from flask import Flask
+from prometheus_client import Counter, Histogram
+
+from extensions.storage.base_storage import BaseStorage, ObjectInfo
+
+STORAGE_OPERATION_DURATION = Histogram(
+    'storage_operation_duration_seconds',
+    'Latency of storage operations',
+    ['backend', 'operation'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+STORAGE_OPERATION_BYTES = Counter(
+    'storage_operation_bytes',
+    'Bytes moved by storage operations',
+    ['backend', 'operation'],
+)
+STORAGE_OPERATION_ERRORS = Counter(
+    'storage_operation_errors',
+    'Storage operations that raised an exception',
+    ['backend', 'operation'],
+)
+
+
+class InstrumentedStorage(BaseStorage):
+    """Records latency, bytes moved and errors of every storage operation.
+
+    Metrics are exported by `ext_metrics`, and each operation is also written as a
+    JSON log line at DEBUG level.
+    """
+
+    OPERATIONS = (
+        'save', 'save_stream', 'load_once', 'load_stream', 'load_range', 'size', 'download',
+        'exists', 'delete', 'exists_many', 'delete_many', 'list',
+    )
+
+    def __init__(self, app: Flask, runner: BaseStorage, backend: str):
+        super().__init__(app)
+        self.runner = runner
+        self.backend = backend
+        # resolve the labelled children once so that recording is a plain method call
+        self._duration = {op: STORAGE_OPERATION_DURATION.labels(backend, op) for op in self.OPERATIONS}
+        self._bytes = {op: STORAGE_OPERATION_BYTES.labels(backend, op) for op in self.OPERATIONS}
+        self._errors = {op: STORAGE_OPERATION_ERRORS.labels(backend, op) for op in self.OPERATIONS}
+
+    def _record(self, operation: str, started_at: float, size: int = 0, error: Exception | None = None):
+        duration = time.perf_counter() - started_at
+        self._duration[operation].observe(duration)
+        if size:
+            self._bytes[operation].inc(size)
+        if error is not None:
+            self._errors[operation].inc()
+
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(json.dumps({
+                'event': 'storage_operation',
+                'backend': self.backend,
+                'operation': operation,
+                'duration_ms': round(duration * 1000, 3),
+                'bytes': size,
+                'error': type(error).__name__ if error is not None else None,
+            }))
+
+    def _call(self, operation: str, func, *args, count_bytes: bool = False):
+        started_at = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self._record(operation, started_at, error=e)
+            raise
+        self._record(operation, started_at, len(result) if count_bytes else 0)
+        return result
+
+    def save(self, filename, data):
+        started_at = time.perf_counter()
+        try:
+            self.runner.save(filename, data)
+        except Exception as e:
+            self._record('save', started_at, error=e)
+            raise
+        self._record('save', started_at, len(data))
+
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        size = 0
+
+        def counted(chunks: Iterable[bytes]) -> Generator:
+            nonlocal size
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+
+        started_at = time.perf_counter()
+        try:
+            self.runner.save_stream(filename, counted(self.iter_parts(data, self.chunk_size)))
+        except Exception as e:
+            self._record('save_stream', started_at, size, error=e)
+            raise
+        self._record('save_stream', started_at, size)
+
+    def load_once(self, filename: str) -> bytes:
+        return self._call('load_once', self.runner.load_once, filename, count_bytes=True)
+
+    def load_stream(self, filename: str) -> Generator:
+        def generate(filename: str = filename) -> Generator:
+            # the duration covers the whole stream, including the time the consumer spends between chunks
+            started_at = time.perf_counter()
+            size = 0
+            try:
+                for chunk in self.runner.load_stream(filename):
+                    size += len(chunk)
+                    yield chunk
+            except Exception as e:
+                self._record('load_stream', started_at, size, error=e)
+                raise
+            self._record('load_stream', started_at, size)
+
+        return generate()
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        return self._call('load_range', self.runner.load_range, filename, start, end, count_bytes=True)
+
+    def size(self, filename: str) -> int:
+        return self._call('size', self.runner.size, filename)
+
+    def get_etag(self, filename: str) -> str | None:
+        return self.runner.get_etag(filename)
+
+    def head(self, filename: str) -> ObjectInfo:
+        return self._call('head', self.runner.head, filename)
+
+    def get_local_path(self, filename: str) -> str | None:
+        return self.runner.get_local_path(filename)
+
+    def download(self, filename, target_filepath):
+        return self._call('download', self.runner.download, filename, target_filepath)
+
+    def exists(self, filename):
+        return self._call('exists', self.runner.exists, filename)
+
+    def delete(self, filename):
+        return self._call('delete', self.runner.delete, filename)
+
+    def exists_many(self, filenames: Iterable[str], concurrency: int = 1) -> list[bool]:
+        return self._call('exists_many', self.runner.exists_many, filenames, concurrency)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        return self._call('delete_many', self.runner.delete_many, filenames, concurrency)
+
+    def list(self, prefix: str = '') -> Generator:
+        def generate(prefix: str = prefix) -> Generator:
+            started_at = time.perf_counter()
+            try:
+                yield from self.runner.list(prefix)
+            except Exception as e:
+                self._record('list', started_at, error=e)
+                raise
+            self._record('list', started_at)
+
+        return generate()
@@ -1,11 +1,23 @@
+import hashlib
+import io
 import os
 import shutil
-from collections.abc import Generator
+import tempfile
+from collections.abc import Generator, Iterable
 
 from flask import Flask
 
 from extensions.storage.base_storage import BaseStorage
 
+# files being written by save_stream are named `.<random>.tmp` until they are complete
+TEMP_PREFIX = '.'
+TEMP_SUFFIX = '.tmp'
+
+# mkstemp creates files readable by the owner only, give them the mode open() would
+_umask = os.umask(0)
+os.umask(_umask)
+FILE_MODE = 0o666 & ~_umask
+
 
 class LocalStorage(BaseStorage):
     """Implementation for local storage.
@@ -17,72 +29,191 @@ class LocalStorage(BaseStorage):
         if not os.path.isabs(folder):
             folder = os.path.join(app.root_path, folder)
         self.folder = folder
+        self.layout = self.app.config.get('STORAGE_LOCAL_LAYOUT') or 'flat'
+
+    def get_path(self, filename: str, layout: str | None = None) -> str:
+        """Map a filename to its path on disk.
+
+        The `sharded` layout fans files out below their directory into two levels of
+        hash-named subdirectories, e.g. `privkeys/{tenant_id}/3f/a2/private.pem`.
+        """
+        if (layout or self.layout) == 'sharded':
+            filename = shard_filename(filename)
 
-    def save(self, filename, data):
         if not self.folder or self.folder.endswith('/'):
-            filename = self.folder + filename
-        else:
-            filename = self.folder + '/' + filename
+            return self.folder + filename
+        return self.folder + '/' + filename
 
-        folder = os.path.dirname(filename)
-        os.makedirs(folder, exist_ok=True)
+    def _open_for_write(self, path: str):
+        try:
+            return open(path, "wb")
+        except FileNotFoundError:
+            # only create the parent directories when the open proves they are missing
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return open(path, "wb")
 
-        with open(os.path.join(os.getcwd(), filename), "wb") as f:
+    def save(self, filename, data):
+        with self._open_for_write(self.get_path(filename)) as f:
             f.write(data)
 
-    def load_once(self, filename: str) -> bytes:
-        if not self.folder or self.folder.endswith('/'):
-            filename = self.folder + filename
-        else:
-            filename = self.folder + '/' + filename
-
-        if not os.path.exists(filename):
-            raise FileNotFoundError("File not found")
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        filename = self.get_path(filename)
+        folder = os.path.dirname(filename)
 
-        with open(filename, "rb") as f:
-            data = f.read()
+        # write next to the target and rename, so readers never see a partially written file
+        try:
+            fd, tmp_filename = tempfile.mkstemp(dir=folder, prefix=TEMP_PREFIX, suffix=TEMP_SUFFIX)
+        except FileNotFoundError:
+            os.makedirs(folder, exist_ok=True)
+            fd, tmp_filename = tempfile.mkstemp(dir=folder, prefix=TEMP_PREFIX, suffix=TEMP_SUFFIX)
+        try:
+            with open(fd, "wb") as f:
+                os.fchmod(fd, FILE_MODE)
+                if hasattr(data, 'read'):
+                    shutil.copyfileobj(data, f, self.chunk_size)
+                else:
+                    for chunk in data:
+                        f.write(chunk)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            os.unlink(tmp_filename)
+            raise
 
-        return data
+    def load_once(self, filename: str) -> bytes:
+        try:
+            with open(self.get_path(filename), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found")
 
     def load_stream(self, filename: str) -> Generator:
         def generate(filename: str = filename) -> Generator:
-            if not self.folder or self.folder.endswith('/'):
-                filename = self.folder + filename
-            else:
-                filename = self.folder + '/' + filename
-
-            if not os.path.exists(filename):
+            try:
+                f = open(self.get_path(filename), "rb", buffering=0)
+            except FileNotFoundError:
                 raise FileNotFoundError("File not found")
 
-            with open(filename, "rb") as f:
-                while chunk := f.read(4096):  # Read in chunks of 4KB
-                    yield chunk
+            # read into one reused buffer instead of allocating a new one per chunk
+            buffer = bytearray(self.chunk_size)
+            view = memoryview(buffer)
+            with f:
+                while size := f.readinto(buffer):
+                    yield bytes(view[:size])
 
         return generate()
 
-    def download(self, filename, target_filepath):
-        if not self.folder or self.folder.endswith('/'):
-            filename = self.folder + filename
-        else:
-            filename = self.folder + '/' + filename
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        try:
+            fd = os.open(self.get_path(filename), os.O_RDONLY)
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found")
 
-        if not os.path.exists(filename):
+        try:
+            if end is None:
+                end = os.fstat(fd).st_size - 1
+            length = end - start + 1
+            if length <= 0:
+                return b''
+
+            chunks = []
+            while length > 0:
+                chunk = os.pread(fd, length, start)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                start += len(chunk)
+                length -= len(chunk)
+            return b''.join(chunks)
+        finally:
+            os.close(fd)
+
+    def size(self, filename: str) -> int:
+        try:
+            return os.path.getsize(self.get_path(filename))
+        except FileNotFoundError:
             raise FileNotFoundError("File not found")
 
-        shutil.copyfile(filename, target_filepath)
+    def get_local_path(self, filename: str) -> str | None:
+        filename = self.get_path(filename)
+        return filename if os.path.isfile(filename) else None
 
-    def exists(self, filename):
-        if not self.folder or self.folder.endswith('/'):
-            filename = self.folder + filename
-        else:
-            filename = self.folder + '/' + filename
+    def download(self, filename, target_filepath):
+        try:
+            shutil.copyfile(self.get_path(filename), target_filepath)
+        except FileNotFoundError:
+            raise FileNotFoundError("File not found")
 
-        return os.path.exists(filename)
+    def exists(self, filename):
+        return os.path.exists(self.get_path(filename))
 
     def delete(self, filename):
-        if not self.folder or self.folder.endswith('/'):
-            filename = self.folder + filename
-        else:
-            filename = self.folder + '/' + filename
-        if os.path.exists(filename):
-            os.remove(filename)
+        try:
+            os.remove(self.get_path(filename))
+        except FileNotFoundError:
+            pass
+
+    def exists_many(self, filenames: Iterable[str], concurrency: int = 1) -> list[bool]:
+        # local lookups are cheap syscalls, threads would only add overhead
+        return [self.exists(filename) for filename in filenames]
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        for filename in filenames:
+            self.delete(filename)
+
+    def list(self, prefix: str = '') -> Generator:
+        folder = self.folder if self.folder.endswith('/') else self.folder + '/'
+        directory, _, name_prefix = prefix.rpartition('/')
+        if directory:
+            directory += '/'
+
+        def scan(path: str, relative: str, name_prefix: str = '') -> Generator:
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if not entry.name.startswith(name_prefix) or is_temp_filename(entry.name):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            yield from scan(entry.path, relative + entry.name + '/')
+                        else:
+                            yield relative + entry.name
+            except (FileNotFoundError, NotADirectoryError):
+                return
+
+        if self.layout != 'sharded':
+            return scan(folder + directory, directory, name_prefix)
+
+        def unshard(paths: Iterable[str]) -> Generator:
+            # shard directories sit below the file's own directory, so scan the whole directory
+            for path in paths:
+                filename = unshard_filename(path)
+                if filename is not None and filename.startswith(prefix):
+                    yield filename
+
+        return unshard(scan(folder + directory, directory))
+
+
+def is_temp_filename(name: str) -> bool:
+    return name.startswith(TEMP_PREFIX) and name.endswith(TEMP_SUFFIX)
+
+
+def shard_filename(filename: str) -> str:
+    directory, _, name = filename.rpartition('/')
+    digest = hashlib.sha256(filename.encode()).hexdigest()
+    return '{directory}{first}/{second}/{name}'.format(
+        directory=directory + '/' if directory else '',
+        first=digest[:2],
+        second=digest[2:4],
+        name=name,
+    )
+
+
+def unshard_filename(path: str) -> str | None:
+    """Return the filename stored at a sharded relative path, or None if the path is not sharded."""
+    parts = path.split('/')
+    if len(parts) < 3:
+        return None
+
+    filename = '/'.join(parts[:-3] + parts[-1:])
+    if shard_filename(filename) != path:
+        return None
+    return filename
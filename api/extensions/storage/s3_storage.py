@@ -0,0 +1,177 @@
+import io
+from collections.abc import Generator, Iterable, Iterator
+from contextlib import closing
+
+import boto3
+from botocore.client import Config
+from botocore.exceptions import ClientError
+from flask import Flask
+
+from extensions.storage.base_storage import BaseStorage, ObjectInfo
+
+
+class S3Storage(BaseStorage):
+    """Implementation for s3 storage.
+    """
+
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        app_config = self.app.config
+        self.bucket_name = app_config.get('S3_BUCKET_NAME')
+
+        # boto3 clients are thread-safe, so one client and its connection pool is shared by the whole process
+        client_config = Config(
+            max_pool_connections=app_config.get('S3_MAX_POOL_CONNECTIONS'),
+            connect_timeout=app_config.get('S3_CONNECT_TIMEOUT'),
+            read_timeout=app_config.get('S3_READ_TIMEOUT'),
+            tcp_keepalive=True,
+            retries={'max_attempts': 3, 'mode': 'standard'},
+            s3={'addressing_style': app_config.get('S3_ADDRESS_STYLE')},
+        )
+        if app_config.get('S3_USE_AWS_MANAGED_IAM'):
+            session = boto3.Session()
+            self.client = session.client(
+                service_name='s3',
+                region_name=app_config.get('S3_REGION'),
+                config=client_config,
+            )
+        else:
+            self.client = boto3.client(
+                's3',
+                aws_secret_access_key=app_config.get('S3_SECRET_KEY'),
+                aws_access_key_id=app_config.get('S3_ACCESS_KEY'),
+                endpoint_url=app_config.get('S3_ENDPOINT') or None,
+                region_name=app_config.get('S3_REGION'),
+                config=client_config,
+            )
+
+    def save(self, filename, data):
+        self.client.put_object(Bucket=self.bucket_name, Key=filename, Body=data)
+
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        single_part, parts = self.peek_single_part(self.iter_parts(data, self.part_size))
+        if single_part is not None:
+            self.client.put_object(Bucket=self.bucket_name, Key=filename, Body=single_part)
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=filename)['UploadId']
+        try:
+            uploaded = self.upload_parts(
+                parts,
+                lambda part_number, part: self.client.upload_part(
+                    Bucket=self.bucket_name, Key=filename, Body=part, PartNumber=part_number, UploadId=upload_id
+                )['ETag']
+            )
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': part_number, 'ETag': etag} for part_number, etag in uploaded]}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=filename, UploadId=upload_id)
+            raise
+
+    def load_once(self, filename: str) -> bytes:
+        try:
+            with closing(self._get_object(filename)['Body']) as body:
+                return body.read()
+        except ClientError as ex:
+            if ex.response['Error']['Code'] == 'NoSuchKey':
+                raise FileNotFoundError("File not found")
+            raise
+
+    def load_stream(self, filename: str) -> Generator:
+        def generate(filename: str = filename) -> Generator:
+            try:
+                response = self._get_object(filename)
+            except ClientError as ex:
+                if ex.response['Error']['Code'] == 'NoSuchKey':
+                    raise FileNotFoundError("File not found")
+                raise
+
+            with closing(response['Body']) as body:
+                yield from body.iter_chunks(chunk_size=self.chunk_size)
+
+        return generate()
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        byte_range = 'bytes={start}-{end}'.format(start=start, end='' if end is None else end)
+        try:
+            with closing(self._get_object(filename, Range=byte_range)['Body']) as body:
+                return body.read()
+        except ClientError as ex:
+            if ex.response['Error']['Code'] == 'NoSuchKey':
+                raise FileNotFoundError("File not found")
+            raise
+
+    def load_stream_with_etag(self, filename: str) -> tuple[Iterator[bytes], str | None]:
+        try:
+            response = self._get_object(filename)
+        except ClientError as ex:
+            if ex.response['Error']['Code'] == 'NoSuchKey':
+                raise FileNotFoundError("File not found")
+            raise
+
+        def generate() -> Generator:
+            with closing(response['Body']) as body:
+                yield from body.iter_chunks(chunk_size=self.chunk_size)
+
+        return generate(), response.get('ETag')
+
+    def size(self, filename: str) -> int:
+        return self._head_object(filename)['ContentLength']
+
+    def get_etag(self, filename: str) -> str | None:
+        return self._head_object(filename).get('ETag')
+
+    def head(self, filename: str) -> ObjectInfo:
+        response = self._head_object(filename)
+        return ObjectInfo(response['ContentLength'], response.get('ETag'))
+
+    def download(self, filename, target_filepath):
+        # the managed transfer splits large objects into concurrent ranged GETs
+        self.client.download_file(self.bucket_name, filename, target_filepath)
+
+    def exists(self, filename):
+        try:
+            self._head_object(filename)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, filename):
+        self.client.delete_object(Bucket=self.bucket_name, Key=filename)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        filenames = [*filenames]
+        # S3 accepts at most 1000 keys per batch delete request
+        batches = [filenames[i:i + 1000] for i in range(0, len(filenames), 1000)]
+
+        def delete_batch(batch: list[str]) -> dict[str, str]:
+            # quiet mode only reports the keys that failed
+            response = self.client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': filename} for filename in batch], 'Quiet': True}
+            )
+            return {error['Key']: '{code}: {message}'.format(code=error.get('Code'), message=error.get('Message'))
+                    for error in response.get('Errors', [])}
+
+        self.raise_batch_delete_errors(self.map_concurrently(delete_batch, batches, concurrency))
+
+    def _get_object(self, filename: str, **kwargs) -> dict:
+        return self.client.get_object(Bucket=self.bucket_name, Key=filename, **kwargs)
+
+    def _head_object(self, filename: str) -> dict:
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=filename)
+        except ClientError as ex:
+            if ex.response['Error']['Code'] in {'404', 'NoSuchKey', 'NotFound'}:
+                raise FileNotFoundError("File not found")
+            raise
+
+    def list(self, prefix: str = '') -> Generator:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix, PaginationConfig={'PageSize': 1000}):
+            for obj in page.get('Contents', []):
+                yield obj['Key']
@@ -1,9 +1,11 @@
-from collections.abc import Generator
+import io
+from collections.abc import Generator, Iterable, Iterator
 
 from flask import Flask
 from qcloud_cos import CosConfig, CosS3Client
+from qcloud_cos.cos_exception import CosServiceError
 
-from extensions.storage.base_storage import BaseStorage
+from extensions.storage.base_storage import BaseStorage, ObjectInfo
 
 
 class TencentStorage(BaseStorage):
@@ -25,20 +27,78 @@ class TencentStorage(BaseStorage):
     def save(self, filename, data):
         self.client.put_object(Bucket=self.bucket_name, Body=data, Key=filename)
 
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        single_part, parts = self.peek_single_part(self.iter_parts(data, self.part_size))
+        if single_part is not None:
+            self.client.put_object(Bucket=self.bucket_name, Body=single_part, Key=filename)
+            return
+
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=filename)['UploadId']
+        try:
+            uploaded = self.upload_parts(
+                parts,
+                lambda part_number, part: self.client.upload_part(
+                    Bucket=self.bucket_name, Key=filename, Body=part, PartNumber=part_number, UploadId=upload_id
+                )['ETag']
+            )
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket_name,
+                Key=filename,
+                UploadId=upload_id,
+                MultipartUpload={'Part': [{'PartNumber': part_number, 'ETag': etag} for part_number, etag in uploaded]}
+            )
+        except BaseException:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=filename, UploadId=upload_id)
+            raise
+
     def load_once(self, filename: str) -> bytes:
-        data = self.client.get_object(Bucket=self.bucket_name, Key=filename)['Body'].get_raw_stream().read()
+        data = self._get_object(filename)['Body'].get_raw_stream().read()
         return data
 
     def load_stream(self, filename: str) -> Generator:
         def generate(filename: str = filename) -> Generator:
-            response = self.client.get_object(Bucket=self.bucket_name, Key=filename)
-            while chunk := response['Body'].get_stream(chunk_size=4096):
-                yield chunk
+            response = self._get_object(filename)
+            yield from response['Body'].get_stream(chunk_size=self.chunk_size)
 
         return generate()
 
+    def load_stream_with_etag(self, filename: str) -> tuple[Iterator[bytes], str | None]:
+        response = self._get_object(filename)
+        return iter(response['Body'].get_stream(chunk_size=self.chunk_size)), response.get('ETag')
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        byte_range = 'bytes={start}-{end}'.format(start=start, end='' if end is None else end)
+        response = self._get_object(filename, Range=byte_range)
+        return response['Body'].get_raw_stream().read()
+
+    def size(self, filename: str) -> int:
+        return int(self._head_object(filename)['Content-Length'])
+
+    def get_etag(self, filename: str) -> str | None:
+        return self._head_object(filename).get('ETag')
+
+    def head(self, filename: str) -> ObjectInfo:
+        response = self._head_object(filename)
+        return ObjectInfo(int(response['Content-Length']), response.get('ETag'))
+
+    def _get_object(self, filename: str, **kwargs) -> dict:
+        try:
+            return self.client.get_object(Bucket=self.bucket_name, Key=filename, **kwargs)
+        except CosServiceError as ex:
+            if ex.get_status_code() == 404:
+                raise FileNotFoundError("File not found")
+            raise
+
+    def _head_object(self, filename: str) -> dict:
+        try:
+            return self.client.head_object(Bucket=self.bucket_name, Key=filename)
+        except CosServiceError as ex:
+            if ex.get_status_code() == 404:
+                raise FileNotFoundError("File not found")
+            raise
+
     def download(self, filename, target_filepath):
-        response = self.client.get_object(Bucket=self.bucket_name, Key=filename)
+        response = self._get_object(filename)
         response['Body'].get_stream_to_file(target_filepath)
 
     def exists(self, filename):
@@ -46,3 +106,30 @@ class TencentStorage(BaseStorage):
 
     def delete(self, filename):
         self.client.delete_object(Bucket=self.bucket_name, Key=filename)
+
+    def delete_many(self, filenames: Iterable[str], concurrency: int = 1):
+        filenames = [*filenames]
+        # COS accepts at most 1000 keys per batch delete request
+        batches = [filenames[i:i + 1000] for i in range(0, len(filenames), 1000)]
+
+        def delete_batch(batch: list[str]) -> dict[str, str]:
+            # quiet mode only reports the keys that failed
+            response = self.client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Object': [{'Key': filename} for filename in batch], 'Quiet': 'true'}
+            )
+            return {error['Key']: '{code}: {message}'.format(code=error.get('Code'), message=error.get('Message'))
+                    for error in response.get('Error', [])}
+
+        self.raise_batch_delete_errors(self.map_concurrently(delete_batch, batches, concurrency))
+
+    def list(self, prefix: str = '') -> Generator:
+        marker = ''
+        while True:
+            response = self.client.list_objects(Bucket=self.bucket_name, Prefix=prefix, Marker=marker, MaxKeys=1000)
+            for obj in response.get('Contents', []):
+                yield obj['Key']
+
+            if response.get('IsTruncated') != 'true':
+                return
+            marker = response.get('NextMarker') or response['Contents'][-1]['Key']
@@ -0,0 +1,11 @@
+# Loaded automatically by gunicorn from the working directory.
+
+
+def child_exit(server, worker):
+    # drop the live gauges of exited workers from the aggregated prometheus metrics
+    import os
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -74,6 +74,8 @@ class PKCS1OAEP_Cipher:
 
         self._label = _copy_bytes(None, None, label)
         self._randfunc = randfunc
+        # CRT parameters of the private key, computed on first decryption
+        self._crt_params = None
 
     def can_encrypt(self):
         """Legacy function to check if you can call :meth:`encrypt`.
@@ -168,8 +170,7 @@ class PKCS1OAEP_Cipher:
         # Step 2a (O2SIP)
         ct_int = bytes_to_long(ciphertext)
         # Step 2b (RSADP)
-        # m_int = self._key._decrypt(ct_int)
-        m_int = gmpy2.powmod(ct_int, self._key.d, self._key.n)
+        m_int = self._decrypt_int(ct_int)
         # Complete step 2c (I2OSP)
         em = long_to_bytes(m_int, k)
         # Step 3a
@@ -202,6 +203,49 @@ class PKCS1OAEP_Cipher:
         # Step 4
         return db[one_pos + 1:]
 
+    def _get_crt_params(self):
+        """Precompute and cache ``(n, e, p, q, dp, dq, q_inv)`` as gmpy2 integers."""
+        if self._crt_params is None:
+            if not self._key.has_private():
+                raise TypeError("This is not a private key")
+            n = gmpy2.mpz(self._key.n)
+            e = gmpy2.mpz(self._key.e)
+            d = gmpy2.mpz(self._key.d)
+            p = gmpy2.mpz(self._key.p)
+            q = gmpy2.mpz(self._key.q)
+            self._crt_params = (n, e, p, q, d % (p - 1), d % (q - 1), gmpy2.invert(q, p))
+        return self._crt_params
+
+    def _decrypt_int(self, ct_int):
+        """RSADP using the Chinese Remainder Theorem, with base blinding.
+
+        The ciphertext is blinded with a fresh random ``r`` so that the timing of
+        the two half-size exponentiations does not depend on the attacker-chosen
+        input, and the result is checked against the public exponent so that a
+        faulty CRT computation never leaks a factor of the modulus.
+        """
+        n, e, p, q, dp, dq, q_inv = self._get_crt_params()
+        if not 0 <= ct_int < n:
+            raise ValueError("Ciphertext too large")
+
+        k = ceil_div(gmpy2.bit_length(n), 8)
+        while True:
+            r = gmpy2.mpz(bytes_to_long(self._randfunc(k))) % n
+            if r > 1 and gmpy2.gcd(r, n) == 1:
+                break
+        blinded = (ct_int * gmpy2.powmod(r, e, n)) % n
+
+        # Garner's recombination
+        m1 = gmpy2.powmod(blinded % p, dp, p)
+        m2 = gmpy2.powmod(blinded % q, dq, q)
+        h = (q_inv * (m1 - m2)) % p
+        m_blinded = m2 + h * q
+
+        m_int = (m_blinded * gmpy2.invert(r, n)) % n
+        if gmpy2.powmod(m_int, e, n) != ct_int:
+            raise ValueError("Fault detected in RSA decryption")
+        return int(m_int)
+
 def new(key, hashAlgo=None, mgfunc=None, label=b'', randfunc=None):
     """Return a cipher object :class:`PKCS1OAEP_Cipher` that can be used to perform PKCS#1 OAEP encryption or decryption.
 
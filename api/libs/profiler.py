@@ -0,0 +1,174 @@
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+
+def _native(module: str, name: str):
+    """
+    Return `module.name` as it was before gevent patched it.
+
+    The sampler has to run in a real OS thread, a greenlet would only get to sample
+    while the profiled request is waiting on I/O. Thread ids, locks and sleeps used by
+    or shared with that thread have to be the native ones too.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return getattr(__import__(module), name)
+
+    return monkey.get_original(module, name)
+
+
+def _current_greenlet():
+    """
+    Return the current greenlet when threading is patched by gevent, otherwise None.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return None
+    if not monkey.is_module_patched('threading'):
+        return None
+
+    import greenlet
+    return greenlet.getcurrent()
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return '{name} ({filename}:{lineno})'.format(name=code.co_name, filename=code.co_filename,
+                                                 lineno=code.co_firstlineno)
+
+
+class RequestProfile:
+    """
+    Wall-clock stack samples of a single request.
+
+    `marker_frame` is a frame that stays on the stack for the whole profiled call. Under
+    gevent all greenlets share the main thread, so the thread's current stack only belongs
+    to the request while that frame is part of it; otherwise the request's greenlet is
+    switched out and its suspended stack (usually an I/O wait) is sampled instead.
+    """
+
+    def __init__(self, interval: float, marker_frame):
+        self.interval = interval
+        self.marker_frame = marker_frame
+        self.thread_id = _native('_thread', 'get_ident')()
+        self.greenlet = _current_greenlet()
+        self.samples = Counter()
+        self.started_at = time.perf_counter()
+        self.duration = None
+
+    def sample(self, frames: dict):
+        frame = frames.get(self.thread_id)
+        if self.greenlet is not None and not self._on_stack(frame):
+            frame = self.greenlet.gr_frame
+
+        stack = []
+        while frame is not None:
+            stack.append(_frame_key(frame))
+            frame = frame.f_back
+        if stack:
+            self.samples[tuple(reversed(stack))] += 1
+
+    def _on_stack(self, frame) -> bool:
+        while frame is not None:
+            if frame is self.marker_frame:
+                return True
+            frame = frame.f_back
+        return False
+
+    def to_collapsed(self) -> str:
+        """
+        Export in the collapsed stack format read by flamegraph.pl and speedscope.
+        """
+        return '\n'.join('{stack} {count}'.format(stack=';'.join(stack), count=count)
+                         for stack, count in self.samples.items())
+
+    def to_speedscope(self, name: str) -> str:
+        """
+        Export as a speedscope sampled profile, weighted in seconds.
+        """
+        frames = []
+        frame_indexes = {}
+        samples = []
+        weights = []
+        for stack, count in self.samples.items():
+            sample = []
+            for key in stack:
+                if key not in frame_indexes:
+                    frame_indexes[key] = len(frames)
+                    frames.append({'name': key})
+                sample.append(frame_indexes[key])
+            samples.append(sample)
+            weights.append(count * self.interval)
+
+        return json.dumps({
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        })
+
+
+class SamplingProfiler:
+    """
+    Process-wide sampler of all active request profiles.
+
+    A single native thread wakes up every `interval` seconds and only walks stacks while
+    at least one request is being profiled, so unprofiled requests pay nothing. The thread
+    is started lazily per process, since one started before gunicorn forks would not exist
+    in the workers.
+    """
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self._active = set()
+        self._lock = _native('_thread', 'allocate_lock')()
+        self._pid = None
+
+    def start(self) -> RequestProfile:
+        """
+        Start profiling the caller, which has to stay on the stack until `stop` is called.
+        """
+        self._ensure_thread()
+        profile = RequestProfile(self.interval, sys._getframe(1))
+        with self._lock:
+            self._active.add(profile)
+        return profile
+
+    def stop(self, profile: RequestProfile) -> RequestProfile:
+        with self._lock:
+            self._active.discard(profile)
+        profile.duration = time.perf_counter() - profile.started_at
+        return profile
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            _native('_thread', 'start_new_thread')(self._run, ())
+
+    def _run(self):
+        sleep = _native('time', 'sleep')
+        while True:
+            sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+
+                frames = sys._current_frames()
+                for profile in self._active:
+                    profile.sample(frames)
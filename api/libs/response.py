@@ -1,3 +1,11 @@
+from flask import Response, request, send_file
+from werkzeug.datastructures import ContentRange, Range
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import quote_etag, unquote_etag
+
+from extensions.ext_storage import storage
+
+
 def api_response(status="success", message=None, data=None, status_code=200, headers=None):
     """
     生成统一的 API 响应
@@ -16,3 +24,75 @@ def api_response(status="success", message=None, data=None, status_code=200, hea
         "code": status_code
     }
     return response, status_code, headers
+
+
+def _single_range() -> Range | None:
+    """
+    The Range header of the request if it asks for a single range.
+
+    multipart/byteranges bodies are not supported, RFC 9110 14.2 allows ignoring the header
+    and answering with the whole file instead.
+    """
+    byte_range = request.range
+    if byte_range is None or len(byte_range.ranges) != 1:
+        return None
+    return byte_range
+
+
+def _if_range_matches(etag: str | None) -> bool:
+    """Whether the If-Range header, if any, allows answering with a range of the file with this ETag."""
+    if_range = request.if_range
+    if if_range.etag is None and if_range.date is None:
+        return True
+    if etag is None or if_range.etag is None:
+        # there is no Last-Modified to compare an If-Range date with
+        return False
+    value, weak = unquote_etag(etag)
+    return not weak and value == if_range.etag
+
+
+def storage_file_response(filename, mimetype="application/octet-stream", headers=None):
+    """
+    从存储中返回文件，支持 HTTP Range 请求（206 Partial Content）
+
+    :param filename: 存储中的文件名
+    :param mimetype: 响应的 MIME 类型
+    :param headers: 额外的响应头
+    :return: Flask Response 对象
+    """
+    local_path = storage.get_local_path(filename)
+    if local_path:
+        # let the WSGI server hand the file to sendfile(2); werkzeug handles the conditional and Range headers
+        response = send_file(local_path, mimetype=mimetype, conditional=False)
+        environ = request.environ
+        if request.range is not None and _single_range() is None:
+            environ = {name: value for name, value in environ.items() if name != 'HTTP_RANGE'}
+        try:
+            response = response.make_conditional(environ, accept_ranges=True,
+                                                 complete_length=response.content_length)
+        except RequestedRangeNotSatisfiable:
+            response.close()
+            raise
+        response.headers.update(headers or {})
+        return response
+
+    size, etag = storage.head(filename)
+    response_headers = {"Accept-Ranges": "bytes", **(headers or {})}
+    if etag:
+        # some SDKs strip the quotes of the ETag
+        response_headers["ETag"] = etag if etag.startswith(('"', 'W/"')) else quote_etag(etag)
+
+    byte_range = _single_range()
+    if byte_range is None or not _if_range_matches(response_headers.get("ETag")):
+        response_headers["Content-Length"] = str(size)
+        return Response(storage.load_stream(filename), status=200, mimetype=mimetype, headers=response_headers)
+
+    range_for_length = byte_range.range_for_length(size)
+    if range_for_length is None:
+        raise RequestedRangeNotSatisfiable(length=size)
+
+    start, stop = range_for_length
+    response = Response(storage.load_range(filename, start, stop - 1), status=206, mimetype=mimetype,
+                        headers=response_headers)
+    response.content_range = ContentRange("bytes", start, stop, size)
+    return response
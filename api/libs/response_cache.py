@@ -0,0 +1,212 @@
+import functools
+import hashlib
+import json
+import logging
+import math
+import random
+import time
+from collections.abc import Callable, Iterable
+
+from flask import Response, current_app, request
+from flask_login import current_user
+from flask_restful.utils import unpack
+from redis import RedisError
+from werkzeug.http import quote_etag
+
+from extensions.ext_redis import redis_client
+
+CACHE_KEY_PREFIX = 'response_cache'
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 3
+LOCK_POLL_INTERVAL = 0.05
+
+# add a cache key to a tag and only ever extend the tag's expiry, so it outlives all its keys
+TAG_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+if redis.call('TTL', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+"""
+# drop a tag and every cache key in it atomically, so no key is added in between and missed
+INVALIDATE_SCRIPT = """
+local deleted = 0
+for _, tag in ipairs(KEYS) do
+    local keys = redis.call('SMEMBERS', tag)
+    for i = 1, #keys, 1000 do
+        deleted = deleted + redis.call('DEL', unpack(keys, i, math.min(i + 999, #keys)))
+    end
+    redis.call('DEL', tag)
+end
+return deleted
+"""
+
+_tag_script = redis_client.register_script(TAG_SCRIPT)
+_invalidate_script = redis_client.register_script(INVALIDATE_SCRIPT)
+
+
+def _tag_key(tag: str) -> str:
+    return '{prefix}:tag:{tag}'.format(prefix=CACHE_KEY_PREFIX, tag=tag)
+
+
+def _vary_value(vary) -> str:
+    if callable(vary):
+        return str(vary())
+    if vary == 'args':
+        return json.dumps(sorted(request.args.items(multi=True)))
+    if vary == 'auth':
+        # never keep credentials in keys
+        return hashlib.sha256(request.headers.get('Authorization', '').encode()).hexdigest()
+    if vary == 'user':
+        return current_user.get_id() if current_user and current_user.is_authenticated else ''
+    if vary == 'tenant':
+        if current_user and current_user.is_authenticated:
+            return str(getattr(current_user, 'current_tenant_id', '') or '')
+        return ''
+    raise ValueError('Unsupported response cache vary key: {vary}'.format(vary=vary))
+
+
+def _cache_key(vary_by: Iterable) -> str:
+    parts = [request.method if request.method != 'HEAD' else 'GET', request.path]
+    parts.extend(_vary_value(vary) for vary in vary_by)
+    digest = hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+    return '{prefix}:{endpoint}:{digest}'.format(prefix=CACHE_KEY_PREFIX, endpoint=request.endpoint, digest=digest)
+
+
+def _etag(data) -> str:
+    return hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _respond(entry: dict, cache_status: str):
+    headers = dict(entry['headers'])
+    headers['ETag'] = quote_etag(entry['etag'], weak=True)
+    headers['X-Cache'] = cache_status
+    if request.if_none_match.contains_weak(entry['etag']):
+        return Response(status=304, headers={'ETag': headers['ETag'], 'X-Cache': cache_status})
+    return entry['data'], entry['status'], headers
+
+
+def cached_response(ttl: int = 60, vary_by: Iterable[str | Callable] = ('args',),
+                    tags: Iterable[str] = (), beta: float = 1.0):
+    """
+    缓存 flask_restful Resource 的 GET 响应到 Redis
+
+    可直接装饰方法，或通过 `method_decorators = {'get': [cached_response(...)]}` 使用。
+    响应带有弱 ETag，`If-None-Match` 命中时返回 304。接近过期时，按计算耗时以概率提前由单个请求刷新
+    (XFetch)，其余请求继续返回旧值；完全未命中时只有持有锁的请求计算，其余请求短暂等待其结果。
+    只缓存 200 响应，失效请使用 `invalidate_response_cache(*tags)`。
+
+    :param ttl: 缓存时间（秒）
+    :param vary_by: 参与缓存键的维度：'args'、'auth'、'user'、'tenant'，或返回字符串的函数；路径总是参与
+    :param tags: 失效标签，可引用路由参数，例如 'app:{app_id}'
+    :param beta: 提前刷新的系数，越大越早刷新，0 为不提前
+    """
+    vary_by = tuple(vary_by)
+    tags = tuple(tags)
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not current_app.config.get('RESPONSE_CACHE_ENABLED'):
+                return func(*args, **kwargs)
+
+            key = _cache_key(vary_by)
+            try:
+                entry, locked = _lookup(key, beta)
+            except RedisError:
+                # the cache is an optimization, serve uncached responses while Redis is unavailable
+                logging.warning('Failed to read the response cache of {endpoint}'.format(endpoint=request.endpoint),
+                                exc_info=True)
+                return func(*args, **kwargs)
+
+            if entry is not None:
+                return _respond(entry, 'HIT')
+            return _compute(func, args, kwargs, key, ttl, tags, locked=locked)
+
+        return wrapper
+
+    return decorator
+
+
+def _lookup(key: str, beta: float) -> tuple[dict | None, bool]:
+    """
+    Return the cached entry to serve, or None and whether this request holds the lock to compute it.
+    """
+    cached = redis_client.get(key)
+    if cached is not None:
+        entry = json.loads(cached)
+        # XFetch: refresh early with a probability growing as expiry approaches
+        refresh_at = entry['expires_at'] + entry['delta'] * beta * math.log(random.random() or 1e-12)
+        if time.time() < refresh_at or not _acquire(key):
+            return entry, False
+        return None, True
+
+    if _acquire(key):
+        return None, True
+
+    # someone else is computing it, wait for their result rather than piling onto the backend
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        cached = redis_client.get(key)
+        if cached is not None:
+            return json.loads(cached), False
+    return None, False
+
+
+def _compute(func, args, kwargs, key: str, ttl: int, tags: tuple, locked: bool):
+    started_at = time.time()
+    try:
+        result = func(*args, **kwargs)
+        if isinstance(result, Response):
+            return result
+
+        data, status, headers = unpack(result)
+        if status != 200:
+            return result
+
+        now = time.time()
+        entry = {
+            'data': data,
+            'status': status,
+            'headers': dict(headers or {}),
+            'etag': _etag(data),
+            'delta': now - started_at,
+            'expires_at': now + ttl,
+        }
+        try:
+            pipeline = redis_client.pipeline()
+            pipeline.set(key, json.dumps(entry, default=str), ex=ttl)
+            for tag in tags:
+                _tag_script(keys=[_tag_key(tag.format(**(request.view_args or {})))], args=[key, ttl], client=pipeline)
+            pipeline.execute()
+        except RedisError:
+            logging.warning('Failed to store the response cache of {endpoint}'.format(endpoint=request.endpoint),
+                            exc_info=True)
+        return _respond(entry, 'MISS')
+    finally:
+        if locked:
+            try:
+                redis_client.delete(_lock_key(key))
+            except RedisError:
+                # the lock expires on its own
+                pass
+
+
+def _lock_key(key: str) -> str:
+    return '{key}:lock'.format(key=key)
+
+
+def _acquire(key: str) -> bool:
+    return bool(redis_client.set(_lock_key(key), 1, nx=True, ex=LOCK_TIMEOUT))
+
+
+def invalidate_response_cache(*tags: str) -> int:
+    """
+    删除带有任一标签的缓存响应
+
+    :param tags: 标签，与 `cached_response` 的标签格式化后一致
+    :return: 删除的缓存条目数
+    """
+    if not tags:
+        return 0
+    return _invalidate_script(keys=[_tag_key(tag) for tag in tags])
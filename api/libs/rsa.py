@@ -1,10 +1,18 @@
+import atexit
 import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from Crypto.Cipher import AES
 from Crypto.PublicKey import RSA
 from Crypto.Random import get_random_bytes
 
 import libs.gmpy2_pkcs10aep_cipher as gmpy2_pkcs10aep_cipher
+from configs import app_config
 from extensions.ext_redis import redis_client
 from extensions.ext_storage import storage
 
@@ -20,6 +28,10 @@ def generate_key_pair(tenant_id):
 
     storage.save(filepath, pem_private)
 
+    # bumping the version retires the old key in the Redis tier and in the memory of every process
+    redis_client.incr(_get_privkey_version_key(tenant_id))
+    tenant_key_cache.invalidate(tenant_id)
+
     return pem_public.decode()
 
 
@@ -30,14 +42,31 @@ def encrypt(text, public_key):
     if isinstance(public_key, str):
         public_key = public_key.encode()
 
-    aes_key = get_random_bytes(16)
-    cipher_aes = AES.new(aes_key, AES.MODE_EAX)
+    rsa_key = RSA.import_key(public_key)
+    cipher_rsa = gmpy2_pkcs10aep_cipher.new(rsa_key)
 
-    ciphertext, tag = cipher_aes.encrypt_and_digest(text.encode())
+    return encrypt_token_with_encoding(text, cipher_rsa)
+
+
+def encrypt_many(texts, public_key):
+    """
+    Encrypt a batch of texts with the same public key, importing the key only once.
+    """
+    if isinstance(public_key, str):
+        public_key = public_key.encode()
 
     rsa_key = RSA.import_key(public_key)
     cipher_rsa = gmpy2_pkcs10aep_cipher.new(rsa_key)
 
+    return [encrypt_token_with_encoding(text, cipher_rsa) for text in texts]
+
+
+def encrypt_token_with_encoding(text, cipher_rsa):
+    aes_key = get_random_bytes(16)
+    cipher_aes = AES.new(aes_key, AES.MODE_EAX)
+
+    ciphertext, tag = cipher_aes.encrypt_and_digest(text.encode())
+
     enc_aes_key = cipher_rsa.encrypt(aes_key)
 
     encrypted_data = enc_aes_key + cipher_aes.nonce + tag + ciphertext
@@ -45,10 +74,95 @@ def encrypt(text, public_key):
     return prefix_hybrid + encrypted_data
 
 
+class TenantKeyCache:
+    """
+    In-process LRU/TTL cache of parsed tenant private keys.
+
+    Sits in front of the Redis `tenant_privkey:*` entry so that hot tenants skip the PEM
+    parsing in `RSA.import_key`. Entries are stored with the key version they were loaded
+    at, and lookups pass the current version from Redis, so a rotation in any process
+    retires the cached key everywhere on the next lookup.
+    """
+
+    def __init__(self, max_size: int = 256, ttl: int = 120):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, tenant_id, version=None):
+        with self._lock:
+            entry = self._entries.get(tenant_id)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, entry_version, value = entry
+            if expires_at <= time.monotonic() or entry_version != version:
+                del self._entries[tenant_id]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(tenant_id)
+            self.hits += 1
+            return value
+
+    def set(self, tenant_id, value, version=None):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[tenant_id] = (time.monotonic() + self.ttl, version, value)
+            self._entries.move_to_end(tenant_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tenant_id):
+        with self._lock:
+            self._entries.pop(tenant_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+tenant_key_cache = TenantKeyCache(app_config.TENANT_KEY_CACHE_MAX_SIZE, app_config.TENANT_KEY_CACHE_TTL)
+
+
+def _get_privkey_cache_key(filepath, version=None):
+    cache_key = 'tenant_privkey:{hash}'.format(hash=hashlib.sha3_256(filepath.encode()).hexdigest())
+    if version is not None:
+        cache_key += ':{version}'.format(version=version.decode())
+    return cache_key
+
+
+def _get_privkey_version_key(tenant_id):
+    return 'tenant_privkey_version:{tenant_id}'.format(tenant_id=tenant_id)
+
+
 def get_decrypt_decoding(tenant_id):
+    # a single small read, the parsed key is only reused while its version is current
+    version = redis_client.get(_get_privkey_version_key(tenant_id))
+    cached = tenant_key_cache.get(tenant_id, version)
+    if cached is not None:
+        return cached
+
     filepath = "privkeys/{tenant_id}".format(tenant_id=tenant_id) + "/private.pem"
 
-    cache_key = 'tenant_privkey:{hash}'.format(hash=hashlib.sha3_256(filepath.encode()).hexdigest())
+    cache_key = _get_privkey_cache_key(filepath, version)
     private_key = redis_client.get(cache_key)
     if not private_key:
         try:
@@ -56,11 +170,13 @@ def get_decrypt_decoding(tenant_id):
         except FileNotFoundError:
             raise PrivkeyNotFoundError("Private key not found, tenant_id: {tenant_id}".format(tenant_id=tenant_id))
 
-        redis_client.setex(cache_key, 120, private_key)
+        redis_client.setex(cache_key, app_config.TENANT_KEY_CACHE_TTL, private_key)
 
     rsa_key = RSA.import_key(private_key)
     cipher_rsa = gmpy2_pkcs10aep_cipher.new(rsa_key)
 
+    tenant_key_cache.set(tenant_id, (rsa_key, cipher_rsa), version)
+
     return rsa_key, cipher_rsa
 
 
@@ -89,5 +205,138 @@ def decrypt(encrypted_text, tenant_id):
     return decrypt_token_with_decoding(encrypted_text, rsa_key, cipher_rsa)
 
 
+# batches with at least this many ciphertexts for one tenant are unwrapped in a process pool,
+# smaller ones do not make up for shipping the key and ciphertexts to the workers
+DECRYPT_MANY_POOL_THRESHOLD = 512
+DECRYPT_MANY_CHUNK_SIZE = 128
+DECRYPT_MANY_MAX_WORKERS = min(os.cpu_count() or 1, 8)
+
+_decrypt_pool = None
+_decrypt_pool_pid = None
+_decrypt_pool_lock = threading.Lock()
+
+
+def _pool_supported() -> bool:
+    if DECRYPT_MANY_MAX_WORKERS < 2:
+        return False
+    try:
+        from gevent import monkey
+    except ImportError:
+        return True
+    # workers forked from a patched process inherit the hub, and the pool's management thread
+    # is a greenlet that never gets to run once the interpreter exits, which hangs the shutdown
+    return not monkey.is_module_patched('threading')
+
+
+def _get_decrypt_pool():
+    """
+    Return the process pool of this process, started on first use and kept for later batches.
+
+    Returns None on a single CPU, where a pool only adds overhead to the plain loop, and
+    under gevent, where the batch is decrypted in the calling greenlet instead.
+    """
+    global _decrypt_pool, _decrypt_pool_pid
+    if not _pool_supported():
+        return None
+
+    with _decrypt_pool_lock:
+        # a pool inherited through fork belongs to the parent, its workers are not ours to use
+        if _decrypt_pool is None or _decrypt_pool_pid != os.getpid():
+            _decrypt_pool = ProcessPoolExecutor(max_workers=DECRYPT_MANY_MAX_WORKERS)
+            _decrypt_pool_pid = os.getpid()
+        return _decrypt_pool
+
+
+def _discard_decrypt_pool(pool):
+    global _decrypt_pool
+    with _decrypt_pool_lock:
+        if _decrypt_pool is pool:
+            _decrypt_pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown_decrypt_pool():
+    """Stop the workers of this process's pool, if one was started."""
+    global _decrypt_pool
+    with _decrypt_pool_lock:
+        pool, _decrypt_pool = _decrypt_pool, None
+    if pool is not None and _decrypt_pool_pid == os.getpid():
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+atexit.register(shutdown_decrypt_pool)
+
+
+def decrypt_many(items):
+    """
+    Decrypt a batch of `(encrypted_text, tenant_id)` pairs.
+
+    Items are grouped by tenant so each private key is loaded once. Groups of at least
+    DECRYPT_MANY_POOL_THRESHOLD items spread the RSA private-key work over a process pool
+    that is reused across calls, when more than one CPU is available and gevent has not
+    patched threading. Results are returned in input order; an item that fails to decrypt
+    yields its exception instead of the plaintext.
+    """
+    items = list(items)
+    results = [None] * len(items)
+
+    groups = {}
+    for index, (encrypted_text, tenant_id) in enumerate(items):
+        groups.setdefault(tenant_id, []).append(index)
+
+    pool = None
+    futures = []
+    for tenant_id, indexes in groups.items():
+        try:
+            rsa_key, cipher_rsa = get_decrypt_decoding(tenant_id)
+        except Exception as e:
+            for index in indexes:
+                results[index] = e
+            continue
+
+        if len(indexes) >= DECRYPT_MANY_POOL_THRESHOLD:
+            pool = pool or _get_decrypt_pool()
+        if pool is None or len(indexes) < DECRYPT_MANY_POOL_THRESHOLD:
+            for index in indexes:
+                results[index] = _decrypt_item(items[index][0], rsa_key, cipher_rsa)
+            continue
+
+        pem_private = rsa_key.export_key()
+        for i in range(0, len(indexes), DECRYPT_MANY_CHUNK_SIZE):
+            chunk = indexes[i:i + DECRYPT_MANY_CHUNK_SIZE]
+            future = pool.submit(_decrypt_chunk, pem_private, [items[index][0] for index in chunk])
+            futures.append((chunk, rsa_key, cipher_rsa, future))
+
+    for chunk, rsa_key, cipher_rsa, future in futures:
+        try:
+            chunk_results = future.result()
+        except BrokenProcessPool:
+            # a worker died, start a fresh pool next time and finish this chunk here
+            _discard_decrypt_pool(pool)
+            chunk_results = [_decrypt_item(items[index][0], rsa_key, cipher_rsa) for index in chunk]
+        except Exception as e:
+            chunk_results = [e] * len(chunk)
+
+        for index, result in zip(chunk, chunk_results):
+            results[index] = result
+
+    return results
+
+
+def _decrypt_item(encrypted_text, rsa_key, cipher_rsa):
+    try:
+        return decrypt_token_with_decoding(encrypted_text, rsa_key, cipher_rsa)
+    except Exception as e:
+        return e
+
+
+def _decrypt_chunk(pem_private, encrypted_texts):
+    # runs in a pool worker, so the key is re-imported once per chunk rather than pickled
+    rsa_key = RSA.import_key(pem_private)
+    cipher_rsa = gmpy2_pkcs10aep_cipher.new(rsa_key)
+
+    return [_decrypt_item(encrypted_text, rsa_key, cipher_rsa) for encrypted_text in encrypted_texts]
+
+
 class PrivkeyNotFoundError(Exception):
     pass
@@ -0,0 +1,19 @@
+import fakeredis
+import pytest
+import redis
+
+from extensions.ext_redis import redis_client
+
+
+@pytest.fixture
+def fake_redis_server() -> fakeredis.FakeServer:
+    """In-process Redis server, set ``connected = False`` to simulate an outage."""
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch, fake_redis_server):
+    """Point the shared redis client at the fake server."""
+    pool = redis.ConnectionPool(connection_class=fakeredis.FakeRedisConnection, server=fake_redis_server)
+    monkeypatch.setattr(redis_client, 'connection_pool', pool)
+    return redis_client
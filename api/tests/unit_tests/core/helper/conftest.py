@@ -0,0 +1,68 @@
+import threading
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from configs import app_config
+from core.helper import circuit_breaker, http_cache
+
+
+class Upstream:
+    """Local HTTP server answering with `respond(method, path, headers)`, which returns
+    ``(status, headers, body)``, and recording every request it receives."""
+
+    def __init__(self):
+        self.requests: list[tuple[str, str, dict]] = []
+        self.respond: Callable[[str, str, dict], tuple[int, dict, bytes]] = lambda method, path, headers: (200, {}, b'ok')
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _handle(self):
+                headers = {name.lower(): value for name, value in self.headers.items()}
+                upstream.requests.append((self.command, self.path, headers))
+                status, response_headers, body = upstream.respond(self.command, self.path, headers)
+                self.send_response(status)
+                for name, value in response_headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            do_GET = do_HEAD = do_POST = do_PUT = do_DELETE = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{port}'.format(port=self.server.server_address[1])
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream():
+    upstream = Upstream()
+    yield upstream
+    upstream.close()
+
+
+@pytest.fixture
+def outbound_config(fake_redis, monkeypatch):
+    """Settings of the outbound helpers, with breakers, retries and adaptive timeouts off unless overridden."""
+    def configure(**settings):
+        config = app_config.model_copy(update={
+            'SSRF_PROXY_BREAKER_ENABLED': False,
+            'SSRF_PROXY_MAX_RETRIES': 0,
+            'SSRF_PROXY_ADAPTIVE_TIMEOUT_ENABLED': False,
+            **settings,
+        })
+        for module in (circuit_breaker, http_cache):
+            monkeypatch.setattr(module, 'app_config', config)
+        return config
+
+    return configure
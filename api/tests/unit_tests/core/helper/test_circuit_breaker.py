@@ -0,0 +1,118 @@
+import asyncio
+
+import httpx
+import pytest
+
+from configs import app_config
+from core.errors.error import CircuitBreakerOpenError
+from core.helper import circuit_breaker
+from core.helper.circuit_breaker import OPEN, CircuitBreaker, OutboundGuard, get_breaker_stat
+
+
+@pytest.fixture(autouse=True)
+def breaker_config(fake_redis, monkeypatch):
+    monkeypatch.setattr(circuit_breaker, 'app_config', app_config.model_copy(update={
+        'SSRF_PROXY_BREAKER_ENABLED': True,
+        'SSRF_PROXY_BREAKER_MIN_REQUESTS': 4,
+        'SSRF_PROXY_BREAKER_FAILURE_RATE': 0.5,
+        'SSRF_PROXY_MAX_RETRIES': 0,
+        'SSRF_PROXY_ADAPTIVE_TIMEOUT_ENABLED': False,
+        'SSRF_PROXY_RETRY_BACKOFF': 0,
+    }))
+    # every outcome reaches Redis right away unless a test batches them
+    monkeypatch.setattr(circuit_breaker, 'RECORD_FLUSH_INTERVAL', 0)
+
+
+def _failing_send(method, url, **kwargs):
+    raise httpx.ConnectError('refused')
+
+
+def test_breaker_opens_after_failures(fake_redis):
+    guard = OutboundGuard()
+    for _ in range(4):
+        with pytest.raises(httpx.ConnectError):
+            guard.request(_failing_send, 'GET', 'https://example.com/')
+
+    with pytest.raises(CircuitBreakerOpenError):
+        guard.request(_failing_send, 'GET', 'https://example.com/')
+
+    state, until = fake_redis.hmget(CircuitBreaker('example.com').key, 'state', 'until')
+    assert state.decode() == OPEN and until is not None
+    assert [(stat['host'], stat['state']) for stat in get_breaker_stat()] == [('example.com', OPEN)]
+
+
+def test_outcomes_are_flushed_in_batches(fake_redis, monkeypatch, mocker):
+    monkeypatch.setattr(circuit_breaker, 'RECORD_FLUSH_INTERVAL', 60)
+    pipeline = mocker.spy(fake_redis, 'pipeline')
+    breaker = CircuitBreaker('example.com')
+
+    def window_requests() -> int:
+        return sum(int(fake_redis.hget(key, 'requests'))
+                   for key in fake_redis.scan_iter(match=breaker.key + ':window:*'))
+
+    for _ in range(5):
+        breaker.record(probe=False, failure=False)
+    assert window_requests() == 1
+    assert pipeline.call_count == 1
+
+    # the flush interval has passed
+    breaker._flush_at = 0.0
+    breaker.record(probe=False, failure=True)
+    assert window_requests() == 6
+    assert pipeline.call_count == 2
+
+
+def test_async_requests_open_the_breaker():
+    guard = OutboundGuard()
+
+    async def failing_send(method, url, **kwargs):
+        raise httpx.ConnectError('refused')
+
+    async def requests():
+        for _ in range(4):
+            with pytest.raises(httpx.ConnectError):
+                await guard.async_request(failing_send, 'GET', 'https://example.com/')
+        with pytest.raises(CircuitBreakerOpenError):
+            await guard.async_request(failing_send, 'GET', 'https://example.com/')
+
+    asyncio.run(requests())
+
+
+def test_async_requests_are_retried(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, 'app_config', circuit_breaker.app_config.model_copy(update={
+        'SSRF_PROXY_MAX_RETRIES': 2,
+    }))
+    guard = OutboundGuard()
+    statuses = [503, 200]
+
+    async def send(method, url, **kwargs):
+        return httpx.Response(statuses.pop(0))
+
+    assert asyncio.run(guard.async_request(send, 'GET', 'https://example.com/')).status_code == 200
+    assert not statuses
+
+
+def test_breaker_without_reopen_time_is_open(fake_redis):
+    breaker = CircuitBreaker('example.com')
+    fake_redis.hset(breaker.key, 'state', OPEN)
+    fake_redis.zadd(circuit_breaker.HOSTS_KEY, {'example.com': 1e12})
+
+    with pytest.raises(CircuitBreakerOpenError):
+        breaker.acquire()
+    assert get_breaker_stat()[0]['state'] == OPEN
+
+
+def test_hosts_and_labels_are_bounded(monkeypatch):
+    monkeypatch.setattr(circuit_breaker, 'MAX_TRACKED_HOSTS', 3)
+    monkeypatch.setattr(circuit_breaker, 'MAX_LABELLED_HOSTS', 2)
+    guard = OutboundGuard()
+
+    guards = [guard.host('https://host{i}.example.com/'.format(i=i)) for i in range(5)]
+
+    assert [host_guard.label for host_guard in guards] == [
+        'host0.example.com', 'host1.example.com', 'other', 'other', 'other'
+    ]
+    assert len(guard._hosts) == 3
+    # a host coming back keeps its label even after its guard was dropped
+    assert guard.host('https://host0.example.com/').label == 'host0.example.com'
+    assert guard.host('https://host0.example.com/') is guard.host('https://HOST0.example.com/')
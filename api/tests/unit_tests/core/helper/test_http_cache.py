@@ -0,0 +1,148 @@
+import pytest
+
+from core.helper import ssrf_proxy
+from core.helper.http_cache import http_cache
+
+
+@pytest.fixture(autouse=True)
+def config(outbound_config):
+    outbound_config(inner_SSRF_PROXY_CACHE_HOSTS='127.0.0.1')
+    http_cache.reset()
+
+
+def _respond(upstream, headers: dict, body: bytes = b'ok'):
+    upstream.respond = lambda method, path, request_headers: (200, headers, body)
+
+
+def test_fresh_response_is_answered_from_the_cache(upstream):
+    _respond(upstream, {'Cache-Control': 'max-age=60'})
+
+    first = ssrf_proxy.get(upstream.url + '/a')
+    second = ssrf_proxy.get(upstream.url + '/a')
+
+    assert first.content == second.content == b'ok'
+    assert 'age' in second.headers
+    assert len(upstream.requests) == 1
+
+
+def test_query_parameters_select_the_entry(upstream):
+    _respond(upstream, {'Cache-Control': 'max-age=60'})
+
+    ssrf_proxy.get(upstream.url + '/a', params={'page': 1})
+    ssrf_proxy.get(upstream.url + '/a', params={'page': 2})
+    ssrf_proxy.get(upstream.url + '/a?page=1')
+
+    assert [path for _, path, _ in upstream.requests] == ['/a?page=1', '/a?page=2']
+
+
+def test_stale_response_is_revalidated(upstream):
+    def respond(method, path, headers):
+        if headers.get('if-none-match') == '"v1"':
+            return 304, {'Cache-Control': 'max-age=60', 'ETag': '"v1"'}, b''
+        return 200, {'Cache-Control': 'max-age=0', 'ETag': '"v1"'}, b'ok'
+
+    upstream.respond = respond
+
+    ssrf_proxy.get(upstream.url + '/a')
+    revalidated = ssrf_proxy.get(upstream.url + '/a')
+    fresh = ssrf_proxy.get(upstream.url + '/a')
+
+    assert revalidated.status_code == fresh.status_code == 200
+    assert revalidated.content == fresh.content == b'ok'
+    assert [headers.get('if-none-match') for _, _, headers in upstream.requests] == [None, '"v1"']
+
+
+def test_vary_selects_the_response(upstream):
+    upstream.respond = lambda method, path, headers: (
+        200, {'Cache-Control': 'max-age=60', 'Vary': 'Accept-Language, Accept-Encoding'},
+        headers.get('accept-language', '').encode())
+
+    assert ssrf_proxy.get(upstream.url + '/a', headers={'Accept-Language': 'en'}).content == b'en'
+    # Accept-Encoding is added by the client, the entry is selected by what it sent
+    assert ssrf_proxy.get(upstream.url + '/a', headers={'Accept-Language': 'en'}).content == b'en'
+    assert ssrf_proxy.get(upstream.url + '/a', headers={'Accept-Language': 'fr'}).content == b'fr'
+    assert len(upstream.requests) == 2
+
+
+def test_vary_star_is_not_stored(upstream):
+    _respond(upstream, {'Cache-Control': 'max-age=60', 'Vary': '*'})
+
+    ssrf_proxy.get(upstream.url + '/a')
+    ssrf_proxy.get(upstream.url + '/a')
+
+    assert len(upstream.requests) == 2
+
+
+@pytest.mark.parametrize('cache_control', ['no-store, max-age=60', 'private, max-age=60'])
+def test_no_store_and_private_are_not_stored(upstream, cache_control):
+    _respond(upstream, {'Cache-Control': cache_control})
+
+    ssrf_proxy.get(upstream.url + '/a')
+    ssrf_proxy.get(upstream.url + '/a')
+
+    assert len(upstream.requests) == 2
+
+
+def test_request_no_store_and_no_cache(upstream):
+    _respond(upstream, {'Cache-Control': 'max-age=60'})
+
+    ssrf_proxy.get(upstream.url + '/a', headers={'Cache-Control': 'no-store'})
+    ssrf_proxy.get(upstream.url + '/a')
+    ssrf_proxy.get(upstream.url + '/a', headers={'Cache-Control': 'no-cache'})
+
+    assert len(upstream.requests) == 3
+
+
+@pytest.mark.parametrize('header', ['Authorization', 'Cookie'])
+def test_credentials_are_not_stored_without_public(upstream, header):
+    _respond(upstream, {'Cache-Control': 'max-age=60'})
+
+    ssrf_proxy.get(upstream.url + '/a', headers={header: 'secret'})
+    ssrf_proxy.get(upstream.url + '/a', headers={header: 'secret'})
+
+    assert len(upstream.requests) == 2
+
+
+def test_public_response_is_selected_by_authorization(upstream):
+    upstream.respond = lambda method, path, headers: (
+        200, {'Cache-Control': 'public, max-age=60'}, headers.get('authorization', 'anonymous').encode())
+
+    assert ssrf_proxy.get(upstream.url + '/a', headers={'Authorization': 'Bearer a'}).content == b'Bearer a'
+    assert ssrf_proxy.get(upstream.url + '/a', headers={'Authorization': 'Bearer a'}).content == b'Bearer a'
+    assert ssrf_proxy.get(upstream.url + '/a', headers={'Authorization': 'Bearer b'}).content == b'Bearer b'
+    assert ssrf_proxy.get(upstream.url + '/a').content == b'anonymous'
+    assert len(upstream.requests) == 3
+
+
+@pytest.mark.parametrize('kwargs', [{'auth': ('user', 'secret')}, {'cookies': {'session': 'secret'}}])
+def test_credentials_added_by_the_client_bypass_the_cache(upstream, kwargs):
+    upstream.respond = lambda method, path, headers: (
+        200, {'Cache-Control': 'public, max-age=60'},
+        (headers.get('authorization') or headers.get('cookie') or 'anonymous').encode())
+
+    first = ssrf_proxy.get(upstream.url + '/a', **kwargs)
+    anonymous = ssrf_proxy.get(upstream.url + '/a')
+
+    assert first.content != b'anonymous'
+    assert anonymous.content == b'anonymous'
+    assert len(upstream.requests) == 2
+
+
+def test_unsafe_request_invalidates(upstream):
+    _respond(upstream, {'Cache-Control': 'max-age=60'})
+
+    ssrf_proxy.get(upstream.url + '/a')
+    ssrf_proxy.post(upstream.url + '/a')
+    ssrf_proxy.get(upstream.url + '/a')
+
+    assert [method for method, _, _ in upstream.requests] == ['GET', 'POST', 'GET']
+
+
+def test_hosts_not_configured_are_not_cached(upstream, outbound_config):
+    outbound_config(inner_SSRF_PROXY_CACHE_HOSTS='.example.com')
+    _respond(upstream, {'Cache-Control': 'max-age=60'})
+
+    ssrf_proxy.get(upstream.url + '/a')
+    ssrf_proxy.get(upstream.url + '/a')
+
+    assert len(upstream.requests) == 2
@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+from core.helper import ssrf_proxy
+
+
+@pytest.fixture(autouse=True)
+def config(outbound_config):
+    outbound_config()
+
+
+@pytest.fixture
+def cookie_upstream(upstream):
+    def respond(method, path, headers):
+        if path == '/login':
+            return 200, {'Set-Cookie': 'session=tenantA; Path=/'}, b'ok'
+        return 200, {}, headers.get('cookie', '').encode()
+
+    upstream.respond = respond
+    return upstream
+
+
+def test_cookies_are_not_shared_between_requests(cookie_upstream):
+    ssrf_proxy.get(cookie_upstream.url + '/login')
+
+    assert ssrf_proxy.get(cookie_upstream.url + '/echo').content == b''
+    with ssrf_proxy.stream('GET', cookie_upstream.url + '/echo') as response:
+        assert response.read() == b''
+    assert not ssrf_proxy.get_client().cookies
+
+
+def test_cookies_passed_per_request_are_sent(cookie_upstream):
+    response = ssrf_proxy.get(cookie_upstream.url + '/echo', cookies={'session': 'mine'})
+
+    assert response.content == b'session=mine'
+    assert ssrf_proxy.get(cookie_upstream.url + '/echo').content == b''
+
+
+def test_async_cookies_are_not_shared_between_requests(cookie_upstream):
+    async def requests():
+        await ssrf_proxy.async_make_request('GET', cookie_upstream.url + '/login')
+        return await ssrf_proxy.async_make_request('GET', cookie_upstream.url + '/echo')
+
+    assert asyncio.run(requests()).content == b''
+
+
+def test_client_settings_use_a_one_off_client(upstream):
+    response = ssrf_proxy.get(upstream.url + '/', trust_env=False)
+
+    assert response.content == b'ok'
+    with ssrf_proxy.stream('GET', upstream.url + '/', trust_env=False) as response:
+        assert response.read() == b'ok'
+
+
+@pytest.mark.parametrize('name', ['proxy', 'proxies', 'mounts'])
+def test_proxy_settings_are_rejected(upstream, name):
+    with pytest.raises(ValueError, match=name):
+        ssrf_proxy.get(upstream.url + '/', **{name: 'http://127.0.0.1:1'})
+    assert not upstream.requests
+
+
+def test_async_requests_go_through_the_outbound_guard(upstream, outbound_config):
+    outbound_config(SSRF_PROXY_MAX_RETRIES=1, SSRF_PROXY_RETRY_BACKOFF=0)
+    statuses = [503, 200]
+    upstream.respond = lambda method, path, headers: (statuses.pop(0), {}, b'ok')
+
+    responses = asyncio.run(ssrf_proxy.async_gather_requests([('GET', upstream.url + '/')]))
+
+    assert [response.status_code for response in responses] == [200]
+    assert len(upstream.requests) == 2
@@ -0,0 +1,100 @@
+import hashlib
+import io
+from collections.abc import Generator, Iterable, Iterator
+
+import pytest
+from flask import Flask
+
+from extensions.storage.base_storage import BaseStorage, ObjectInfo
+
+
+class MemoryStorage(BaseStorage):
+    """In-memory storage runner that counts backend calls."""
+
+    def __init__(self, app: Flask):
+        super().__init__(app)
+        self.files: dict[str, bytes] = {}
+        self.calls: list[tuple[str, str]] = []
+
+    def save(self, filename, data):
+        self.calls.append(('save', filename))
+        self.files[filename] = bytes(data)
+
+    def save_stream(self, filename: str, data: Iterable[bytes] | io.IOBase):
+        self.calls.append(('save_stream', filename))
+        self.files[filename] = b''.join(self.iter_parts(data, self.chunk_size))
+
+    def load_once(self, filename: str) -> bytes:
+        self.calls.append(('load_once', filename))
+        if filename not in self.files:
+            raise FileNotFoundError(filename)
+        return self.files[filename]
+
+    def load_stream(self, filename: str) -> Generator:
+        data = self.load_once(filename)
+        for i in range(0, len(data), self.chunk_size):
+            yield data[i:i + self.chunk_size]
+
+    def load_stream_with_etag(self, filename: str) -> tuple[Iterator[bytes], str | None]:
+        self.calls.append(('load_stream_with_etag', filename))
+        if filename not in self.files:
+            raise FileNotFoundError(filename)
+        data = self.files[filename]
+        return iter([data[i:i + self.chunk_size] for i in range(0, len(data), self.chunk_size)]), self.get_etag(filename)
+
+    def load_range(self, filename: str, start: int, end: int | None = None) -> bytes:
+        self.calls.append(('load_range', filename))
+        if filename not in self.files:
+            raise FileNotFoundError(filename)
+        return self.files[filename][start:None if end is None else end + 1]
+
+    def size(self, filename: str) -> int:
+        self.calls.append(('size', filename))
+        if filename not in self.files:
+            raise FileNotFoundError(filename)
+        return len(self.files[filename])
+
+    def get_etag(self, filename: str) -> str | None:
+        if filename not in self.files:
+            raise FileNotFoundError(filename)
+        return hashlib.md5(self.files[filename]).hexdigest()
+
+    def head(self, filename: str) -> ObjectInfo:
+        self.calls.append(('head', filename))
+        if filename not in self.files:
+            raise FileNotFoundError(filename)
+        return ObjectInfo(len(self.files[filename]), self.get_etag(filename))
+
+    def download(self, filename, target_filepath):
+        with open(target_filepath, 'wb') as f:
+            f.write(self.load_once(filename))
+
+    def exists(self, filename):
+        self.calls.append(('exists', filename))
+        return filename in self.files
+
+    def delete(self, filename):
+        self.calls.append(('delete', filename))
+        self.files.pop(filename, None)
+
+    def list(self, prefix: str = '') -> Generator:
+        return (filename for filename in sorted(self.files) if filename.startswith(prefix))
+
+
+@pytest.fixture
+def app(tmp_path) -> Flask:
+    app = Flask(__name__)
+    app.config.update(
+        STORAGE_STREAM_CHUNK_SIZE=4,
+        STORAGE_CACHE_PATH=str(tmp_path / 'cache'),
+        STORAGE_CACHE_MAX_SIZE=100,
+        STORAGE_CACHE_REVALIDATE_INTERVAL=60,
+        STORAGE_CACHE_EXCLUDED_PREFIXES='privkeys/',
+    )
+    return app
+
+
+@pytest.fixture
+def memory_storage(app) -> MemoryStorage:
+    return MemoryStorage(app)
+
@@ -0,0 +1,36 @@
+import oss2
+import pytest
+
+from extensions.storage.aliyun_storage import AliyunStorage
+
+
+@pytest.fixture
+def aliyun_storage(app) -> AliyunStorage:
+    app.config.update(
+        ALIYUN_OSS_BUCKET_NAME='dify-test',
+        ALIYUN_OSS_ACCESS_KEY='testing',
+        ALIYUN_OSS_SECRET_KEY='testing',
+        ALIYUN_OSS_ENDPOINT='https://oss-cn-hangzhou.aliyuncs.com',
+    )
+    return AliyunStorage(app)
+
+
+def test_missing_file(aliyun_storage, mocker):
+    # OSS answers a HEAD of a missing key with a bare 404 and a GET with NoSuchKey
+    mocker.patch.object(aliyun_storage.client, 'head_object', side_effect=oss2.exceptions.NotFound(404, {}, b'', {}))
+    mocker.patch.object(aliyun_storage.client, 'get_object',
+                        side_effect=oss2.exceptions.NoSuchKey(404, {}, b'', {'Code': 'NoSuchKey'}))
+
+    for load in (aliyun_storage.size, aliyun_storage.get_etag, aliyun_storage.head, aliyun_storage.load_once,
+                 aliyun_storage.load_stream_with_etag, lambda filename: b''.join(aliyun_storage.load_stream(filename)),
+                 lambda filename: aliyun_storage.load_range(filename, 0, 1)):
+        with pytest.raises(FileNotFoundError):
+            load('missing.txt')
+
+
+def test_head_is_a_single_request(aliyun_storage, mocker):
+    head_object = mocker.patch.object(aliyun_storage.client, 'head_object',
+                                      return_value=mocker.Mock(content_length=11, etag='abc'))
+
+    assert aliyun_storage.head('a.txt') == (11, 'abc')
+    head_object.assert_called_once_with('a.txt')
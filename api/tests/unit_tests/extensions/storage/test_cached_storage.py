@@ -0,0 +1,101 @@
+import os
+
+from extensions.storage.cached_storage import CachedStorage
+
+
+def test_read_through(app, memory_storage):
+    cache = CachedStorage(app, memory_storage)
+    memory_storage.files['a.txt'] = b'hello'
+
+    assert cache.load_once('a.txt') == b'hello'
+    assert cache.load_once('a.txt') == b'hello'
+    assert b''.join(cache.load_stream('a.txt')) == b'hello'
+    # the ETag comes with the read, a miss is a single request
+    assert memory_storage.calls == [('load_stream_with_etag', 'a.txt')]
+    assert cache.stats()['entries'] == 1
+
+
+def test_streamed_miss_is_a_single_request(app, memory_storage):
+    cache = CachedStorage(app, memory_storage)
+    memory_storage.files['a.txt'] = b'hello'
+
+    assert b''.join(cache.load_stream('a.txt')) == b'hello'
+    assert cache.load_once('a.txt') == b'hello'
+    assert memory_storage.calls == [('load_stream_with_etag', 'a.txt')]
+
+
+def test_write_invalidates_other_processes(app, memory_storage):
+    # two instances on one directory stand in for two workers of a host
+    worker1 = CachedStorage(app, memory_storage)
+    worker2 = CachedStorage(app, memory_storage)
+    memory_storage.files['a.txt'] = b'old'
+    assert worker1.load_once('a.txt') == b'old'
+    assert worker2.load_once('a.txt') == b'old'
+
+    worker1.save('a.txt', b'new')
+
+    assert worker2.load_once('a.txt') == b'new'
+
+
+def test_budget_covers_all_processes(app, memory_storage):
+    worker1 = CachedStorage(app, memory_storage)
+    worker2 = CachedStorage(app, memory_storage)
+    for i in range(10):
+        memory_storage.files['{i}.bin'.format(i=i)] = bytes(30)
+        (worker1 if i % 2 else worker2).load_once('{i}.bin'.format(i=i))
+
+    # a restarted worker enforces the budget on files it did not write
+    CachedStorage(app, memory_storage)
+
+    assert worker1.stats()['size'] <= app.config['STORAGE_CACHE_MAX_SIZE']
+
+
+def test_revalidates_stale_copies(app, memory_storage):
+    cache = CachedStorage(app, memory_storage)
+    memory_storage.files['a.txt'] = b'old'
+    cache.load_once('a.txt')
+    memory_storage.files['a.txt'] = b'new'
+    path = cache.get_local_path('a.txt')
+    os.utime(path, (0, 0))
+
+    assert cache.load_once('a.txt') == b'new'
+
+
+def test_revalidation_is_a_single_head(app, memory_storage):
+    cache = CachedStorage(app, memory_storage)
+    memory_storage.files['a.txt'] = b'old'
+    cache.load_once('a.txt')
+    # same size, only the ETag tells the versions apart
+    memory_storage.files['a.txt'] = b'new'
+    os.utime(cache.get_local_path('a.txt'), (0, 0))
+    memory_storage.calls.clear()
+
+    assert cache.load_once('a.txt') == b'new'
+    assert memory_storage.calls == [('head', 'a.txt'), ('load_stream_with_etag', 'a.txt')]
+
+    os.utime(cache.get_local_path('a.txt'), (0, 0))
+    memory_storage.calls.clear()
+
+    assert cache.load_once('a.txt') == b'new'
+    assert memory_storage.calls == [('head', 'a.txt')]
+
+
+def test_revalidation_of_a_deleted_file(app, memory_storage):
+    cache = CachedStorage(app, memory_storage)
+    memory_storage.files['a.txt'] = b'old'
+    cache.load_once('a.txt')
+    del memory_storage.files['a.txt']
+    os.utime(cache.get_local_path('a.txt'), (0, 0))
+
+    assert cache.get_local_path('a.txt') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_excluded_prefixes_are_not_cached(app, memory_storage):
+    cache = CachedStorage(app, memory_storage)
+    memory_storage.files['privkeys/t/private.pem'] = b'key'
+
+    assert cache.load_once('privkeys/t/private.pem') == b'key'
+    assert b''.join(cache.load_stream('privkeys/t/private.pem')) == b'key'
+    assert cache.get_local_path('privkeys/t/private.pem') is None
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,179 @@
+import gzip
+import os
+
+import pytest
+
+from extensions.storage.compressed_storage import BLOCK_SIZE, HEADER_MAGIC, CompressedStorage
+from extensions.storage.dedup_storage import DedupStorage
+
+# three and a half blocks of compressible text
+DATA = ''.join('line {i:08d} of a compressible document\n'.format(i=i) for i in range(BLOCK_SIZE * 7 // 2 // 41)).encode()
+BENCHMARK_READ_SIZE = 64 * 1024
+
+
+@pytest.fixture(params=['gzip', 'zstd'])
+def compressed_storage(request, app, memory_storage) -> CompressedStorage:
+    app.config.update(STORAGE_COMPRESSION=request.param, STORAGE_COMPRESSION_MIN_SIZE=16)
+    memory_storage.chunk_size = 64 * 1024
+    return CompressedStorage(app, memory_storage)
+
+
+def _chunks(data: bytes, size: int = 100_000):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def test_round_trip(compressed_storage, memory_storage, tmp_path):
+    compressed_storage.save('a.txt', DATA)
+    compressed_storage.save_stream('b.txt', _chunks(DATA))
+
+    for filename in ('a.txt', 'b.txt'):
+        assert memory_storage.files[filename].startswith(HEADER_MAGIC)
+        assert len(memory_storage.files[filename]) < len(DATA) // 4
+        assert compressed_storage.load_once(filename) == DATA
+        assert b''.join(compressed_storage.load_stream(filename)) == DATA
+        assert compressed_storage.size(filename) == len(DATA)
+        assert compressed_storage.load_range(filename, BLOCK_SIZE - 10, BLOCK_SIZE + 9) == DATA[BLOCK_SIZE - 10:BLOCK_SIZE + 10]
+        assert compressed_storage.load_range(filename, len(DATA) - 5) == DATA[-5:]
+        assert compressed_storage.load_range(filename, len(DATA)) == b''
+
+        target = tmp_path / filename
+        compressed_storage.download(filename, str(target))
+        assert target.read_bytes() == DATA
+
+
+def test_streamed_size_and_range_do_not_decompress(compressed_storage, memory_storage):
+    compressed_storage.save_stream('a.txt', _chunks(DATA))
+    memory_storage.calls.clear()
+
+    assert compressed_storage.size('a.txt') == len(DATA)
+    assert memory_storage.calls == [('load_range', 'a.txt')]
+
+    stored = memory_storage.files['a.txt']
+    fetched = []
+    load_range = memory_storage.load_range
+
+    def recording_load_range(filename, start, end=None):
+        data = load_range(filename, start, end)
+        fetched.append(len(data))
+        return data
+
+    memory_storage.load_range = recording_load_range
+    compressed_storage.load_range('a.txt', len(DATA) - 10)
+
+    # header, block index and the last block only
+    assert len(fetched) == 3
+    assert sum(fetched) < len(stored) // 2
+
+
+def test_open_reader_reads_every_block_once(compressed_storage, memory_storage):
+    compressed_storage.save('a.txt', DATA)
+    memory_storage.calls.clear()
+
+    with compressed_storage.open_reader('a.txt') as reader:
+        assert reader.read(10) == DATA[:10]
+        reader.seek(BLOCK_SIZE * 2 + 5)
+        assert reader.read(10) == DATA[BLOCK_SIZE * 2 + 5:BLOCK_SIZE * 2 + 15]
+        reader.seek(0)
+        assert reader.read() == DATA
+
+    # header and block index, then one fetch per block plus one for the seek back to the first
+    blocks = -(-len(DATA) // BLOCK_SIZE)
+    assert memory_storage.calls.count(('load_range', 'a.txt')) == 2 + blocks + 2
+
+
+@pytest.mark.parametrize('save', ['save', 'save_stream'])
+def test_small_and_incompressible_data_is_stored_raw(compressed_storage, memory_storage, save):
+    incompressible = os.urandom(BLOCK_SIZE + 100)
+    for filename, data in (('small.txt', b'tiny'), ('random.bin', incompressible), ('image.png', DATA)):
+        if save == 'save':
+            compressed_storage.save(filename, data)
+        else:
+            compressed_storage.save_stream(filename, _chunks(data))
+
+        assert memory_storage.files[filename] == data
+        assert compressed_storage.load_once(filename) == data
+        assert compressed_storage.size(filename) == len(data)
+
+
+@pytest.mark.parametrize('save', ['save', 'save_stream'])
+def test_compressed_formats_without_extension_are_stored_raw(compressed_storage, memory_storage, save):
+    # compressible past the format's signature, so only sniffing keeps them raw
+    for filename, data in (('blobs/ab/gzip', gzip.compress(DATA)[:10] + DATA),
+                           ('blobs/ab/png', b'\x89PNG\r\n\x1a\n' + DATA),
+                           ('blobs/ab/mp4', b'\x00\x00\x00\x20ftypisom' + DATA)):
+        if save == 'save':
+            compressed_storage.save(filename, data)
+        else:
+            compressed_storage.save_stream(filename, _chunks(data))
+
+        assert memory_storage.files[filename] == data
+
+    compressed_storage.save('blobs/ab/text', DATA)
+    assert memory_storage.files['blobs/ab/text'].startswith(HEADER_MAGIC)
+
+
+def test_dedup_over_compression(compressed_storage, memory_storage, fake_redis, app):
+    dedup_storage = DedupStorage(app, compressed_storage)
+    image = b'\x89PNG\r\n\x1a\n' + DATA
+
+    dedup_storage.save('a.txt', DATA)
+    dedup_storage.save_stream('b.txt', _chunks(DATA))
+    dedup_storage.save('c.png', image)
+
+    blobs = {filename: data for filename, data in memory_storage.files.items() if filename.startswith('blobs/')}
+    assert len(blobs) == 2
+    assert sum(data.startswith(HEADER_MAGIC) for data in blobs.values()) == 1
+    assert image in blobs.values()
+    for filename in ('a.txt', 'b.txt'):
+        assert dedup_storage.load_once(filename) == DATA
+        assert dedup_storage.load_range(filename, BLOCK_SIZE - 1, BLOCK_SIZE) == DATA[BLOCK_SIZE - 1:BLOCK_SIZE + 1]
+        assert dedup_storage.size(filename) == len(DATA)
+    assert dedup_storage.load_once('c.png') == image
+
+
+@pytest.mark.parametrize('save', ['save', 'save_stream'])
+def test_data_looking_like_a_header_is_wrapped(compressed_storage, memory_storage, save):
+    data = HEADER_MAGIC + b'\x01' * 20
+    if save == 'save':
+        compressed_storage.save('a.bin', data)
+    else:
+        compressed_storage.save_stream('a.bin', iter([data]))
+
+    assert memory_storage.files['a.bin'] != data
+    assert compressed_storage.load_once('a.bin') == data
+    assert compressed_storage.load_range('a.bin', 2, 5) == data[2:6]
+
+
+def test_files_saved_before_compression(compressed_storage, memory_storage):
+    memory_storage.files['legacy.txt'] = DATA
+
+    assert compressed_storage.load_once('legacy.txt') == DATA
+    assert compressed_storage.load_range('legacy.txt', 5, 9) == DATA[5:10]
+    assert compressed_storage.size('legacy.txt') == len(DATA)
+    with compressed_storage.open_reader('legacy.txt') as reader:
+        assert reader.read() == DATA
+
+
+def _read_sequentially(storage, filename: str) -> int:
+    total = 0
+    with storage.open_reader(filename, BENCHMARK_READ_SIZE) as reader:
+        while data := reader.read(BENCHMARK_READ_SIZE):
+            total += len(data)
+    return total
+
+
+def test_benchmark_open_reader_raw(benchmark, app, memory_storage):
+    benchmark.group = 'storage-open-reader'
+    memory_storage.files['a.txt'] = DATA
+    benchmark.extra_info.update(stored_size=len(DATA), ratio=1.0)
+
+    assert benchmark(_read_sequentially, memory_storage, 'a.txt') == len(DATA)
+
+
+def test_benchmark_open_reader_compressed(benchmark, compressed_storage, memory_storage):
+    benchmark.group = 'storage-open-reader'
+    compressed_storage.save('a.txt', DATA)
+    stored_size = len(memory_storage.files['a.txt'])
+    benchmark.extra_info.update(stored_size=stored_size, ratio=round(len(DATA) / stored_size, 2))
+
+    assert benchmark(_read_sequentially, compressed_storage, 'a.txt') == len(DATA)
@@ -0,0 +1,67 @@
+import pytest
+
+from extensions.storage.dedup_storage import DedupStorage
+
+
+@pytest.fixture
+def dedup_storage(app, memory_storage, fake_redis) -> DedupStorage:
+    return DedupStorage(app, memory_storage)
+
+
+def _blobs(memory_storage) -> list[str]:
+    return [filename for filename in memory_storage.files if filename.startswith('blobs/')]
+
+
+def test_same_data_is_stored_once(dedup_storage, memory_storage):
+    dedup_storage.save('a.txt', b'hello')
+    dedup_storage.save_stream('b.txt', iter([b'hel', b'lo']))
+
+    assert len(_blobs(memory_storage)) == 1
+    assert memory_storage.calls.count(('save', _blobs(memory_storage)[0])) == 1
+    assert dedup_storage.load_once('a.txt') == dedup_storage.load_once('b.txt') == b'hello'
+
+    dedup_storage.delete('a.txt')
+    assert dedup_storage.load_once('b.txt') == b'hello'
+
+    dedup_storage.delete('b.txt')
+    assert not _blobs(memory_storage)
+    assert not dedup_storage.exists('b.txt')
+
+
+def test_failed_upload_is_not_referenced(dedup_storage, memory_storage, monkeypatch):
+    def failing_save(filename, data):
+        raise ConnectionError('upload failed')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(memory_storage, 'save', failing_save)
+        with pytest.raises(ConnectionError):
+            dedup_storage.save('a.txt', b'hello')
+
+    assert not dedup_storage.exists('a.txt')
+
+    # the next saver of the same data uploads it instead of linking to the missing blob
+    dedup_storage.save('b.txt', b'hello')
+    assert dedup_storage.load_once('b.txt') == b'hello'
+
+
+def test_overwrite_releases_previous_blob(dedup_storage, memory_storage):
+    dedup_storage.save('a.txt', b'old')
+    dedup_storage.save('a.txt', b'old')
+    assert dedup_storage.load_once('a.txt') == b'old'
+
+    dedup_storage.save('a.txt', b'new')
+
+    assert len(_blobs(memory_storage)) == 1
+    assert dedup_storage.load_once('a.txt') == b'new'
+
+
+def test_files_saved_before_dedup(dedup_storage, memory_storage):
+    memory_storage.files['legacy.txt'] = b'legacy'
+    assert dedup_storage.load_once('legacy.txt') == b'legacy'
+
+    dedup_storage.save('legacy.txt', b'updated')
+    assert dedup_storage.load_once('legacy.txt') == b'updated'
+    assert ('exists', 'legacy.txt') not in memory_storage.calls
+
+    dedup_storage.delete('legacy.txt')
+    assert not memory_storage.files
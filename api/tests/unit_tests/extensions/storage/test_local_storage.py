@@ -0,0 +1,32 @@
+import os
+import stat
+
+import pytest
+
+from extensions.storage.local_storage import FILE_MODE, LocalStorage
+
+
+@pytest.fixture(params=['flat', 'sharded'])
+def local_storage(request, app, tmp_path) -> LocalStorage:
+    app.config.update(STORAGE_LOCAL_PATH=str(tmp_path / 'storage'), STORAGE_LOCAL_LAYOUT=request.param)
+    return LocalStorage(app)
+
+
+def test_list_skips_only_files_being_written(local_storage):
+    local_storage.save('upload_files/a.txt', b'a')
+    local_storage.save('upload_files/backup.tmp', b'b')
+    local_storage.save('upload_files/.hidden', b'c')
+    # what save_stream writes before renaming it into place
+    local_storage.save('upload_files/.x1y2.tmp', b'partial')
+
+    assert sorted(local_storage.list('upload_files/')) == [
+        'upload_files/.hidden', 'upload_files/a.txt', 'upload_files/backup.tmp']
+    assert list(local_storage.list('upload_files/b')) == ['upload_files/backup.tmp']
+
+
+def test_save_stream_creates_files_like_open(local_storage, tmp_path):
+    local_storage.save_stream('upload_files/a.txt', iter([b'a']))
+    (tmp_path / 'reference.txt').write_bytes(b'a')
+
+    mode = stat.S_IMODE(os.stat(local_storage.get_path('upload_files/a.txt')).st_mode)
+    assert mode == FILE_MODE == stat.S_IMODE(os.stat(tmp_path / 'reference.txt').st_mode)
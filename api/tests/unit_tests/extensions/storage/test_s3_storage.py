@@ -0,0 +1,112 @@
+import pytest
+from moto import mock_aws
+
+from extensions.storage.base_storage import BatchDeleteError
+from extensions.storage.s3_storage import S3Storage
+
+BUCKET_NAME = 'dify-test'
+# moto rejects multipart parts below the 5 MiB S3 minimum like S3 does
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def s3_storage(app, monkeypatch) -> S3Storage:
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    app.config.update(
+        S3_BUCKET_NAME=BUCKET_NAME,
+        S3_REGION='us-east-1',
+        S3_ADDRESS_STYLE='auto',
+        S3_USE_AWS_MANAGED_IAM=True,
+        S3_MAX_POOL_CONNECTIONS=4,
+        S3_CONNECT_TIMEOUT=5,
+        S3_READ_TIMEOUT=5,
+        STORAGE_MULTIPART_PART_SIZE=PART_SIZE,
+    )
+    with mock_aws():
+        storage = S3Storage(app)
+        storage.client.create_bucket(Bucket=BUCKET_NAME)
+        yield storage
+
+
+def test_save_and_load(s3_storage, tmp_path):
+    s3_storage.save('upload_files/a.txt', b'hello world')
+
+    assert s3_storage.exists('upload_files/a.txt')
+    assert s3_storage.load_once('upload_files/a.txt') == b'hello world'
+    assert b''.join(s3_storage.load_stream('upload_files/a.txt')) == b'hello world'
+    assert s3_storage.load_range('upload_files/a.txt', 6) == b'world'
+    assert s3_storage.load_range('upload_files/a.txt', 0, 4) == b'hello'
+    assert s3_storage.size('upload_files/a.txt') == 11
+    assert s3_storage.get_etag('upload_files/a.txt')
+    assert s3_storage.head('upload_files/a.txt') == (11, s3_storage.get_etag('upload_files/a.txt'))
+    chunks, etag = s3_storage.load_stream_with_etag('upload_files/a.txt')
+    assert b''.join(chunks) == b'hello world'
+    assert etag == s3_storage.get_etag('upload_files/a.txt')
+    assert list(s3_storage.list('upload_files/')) == ['upload_files/a.txt']
+
+    target = tmp_path / 'a.txt'
+    s3_storage.download('upload_files/a.txt', str(target))
+    assert target.read_bytes() == b'hello world'
+
+
+def test_missing_file(s3_storage):
+    assert not s3_storage.exists('missing.txt')
+    with pytest.raises(FileNotFoundError):
+        s3_storage.load_once('missing.txt')
+    with pytest.raises(FileNotFoundError):
+        b''.join(s3_storage.load_stream('missing.txt'))
+    with pytest.raises(FileNotFoundError):
+        s3_storage.load_range('missing.txt', 0, 1)
+    with pytest.raises(FileNotFoundError):
+        s3_storage.size('missing.txt')
+    with pytest.raises(FileNotFoundError):
+        s3_storage.head('missing.txt')
+    with pytest.raises(FileNotFoundError):
+        s3_storage.load_stream_with_etag('missing.txt')
+
+
+def test_save_stream_multipart(s3_storage):
+    data = bytes(range(256)) * (PART_SIZE // 256) + b'tail'
+    chunks = (data[i:i + 1024 * 1024] for i in range(0, len(data), 1024 * 1024))
+
+    s3_storage.save_stream('big.bin', chunks)
+
+    assert s3_storage.load_once('big.bin') == data
+    # the ETag of a multipart object ends with its part count
+    assert s3_storage.get_etag('big.bin').strip('"').endswith('-2')
+    assert not s3_storage.client.list_multipart_uploads(Bucket=BUCKET_NAME).get('Uploads')
+
+
+def test_save_stream_single_part(s3_storage):
+    s3_storage.save_stream('small.bin', iter([b'abc', b'def']))
+
+    assert s3_storage.load_once('small.bin') == b'abcdef'
+    assert '-' not in s3_storage.get_etag('small.bin')
+
+
+def test_delete_many(s3_storage):
+    for i in range(5):
+        s3_storage.save('{i}.txt'.format(i=i), b'x')
+
+    s3_storage.delete_many(['0.txt', '1.txt', '2.txt', 'missing.txt'], concurrency=2)
+
+    assert list(s3_storage.list()) == ['3.txt', '4.txt']
+
+
+def test_delete_many_reports_failed_keys(s3_storage, monkeypatch):
+    for i in range(3):
+        s3_storage.save('{i}.txt'.format(i=i), b'x')
+    delete_objects = s3_storage.client.delete_objects
+
+    def delete_objects_with_error(**kwargs):
+        response = delete_objects(**kwargs)
+        response['Errors'] = [{'Key': '1.txt', 'Code': 'AccessDenied', 'Message': 'Access Denied'}]
+        return response
+
+    monkeypatch.setattr(s3_storage.client, 'delete_objects', delete_objects_with_error)
+
+    with pytest.raises(BatchDeleteError) as exc_info:
+        s3_storage.delete_many(['0.txt', '1.txt', '2.txt'])
+
+    assert exc_info.value.errors == {'1.txt': 'AccessDenied: Access Denied'}
@@ -0,0 +1,45 @@
+import pytest
+from qcloud_cos.cos_exception import CosServiceError
+
+from extensions.storage.tencent_storage import TencentStorage
+
+
+@pytest.fixture
+def tencent_storage(app) -> TencentStorage:
+    app.config.update(
+        TENCENT_COS_BUCKET_NAME='dify-test-1250000000',
+        TENCENT_COS_REGION='ap-guangzhou',
+        TENCENT_COS_SECRET_ID='testing',
+        TENCENT_COS_SECRET_KEY='testing',
+        TENCENT_COS_SCHEME='https',
+    )
+    return TencentStorage(app)
+
+
+def test_missing_file(tencent_storage, mocker):
+    mocker.patch.object(tencent_storage.client, 'head_object', side_effect=CosServiceError('HEAD', '', 404))
+    mocker.patch.object(tencent_storage.client, 'get_object', side_effect=CosServiceError('GET', {
+        'code': 'NoSuchKey', 'message': 'The specified key does not exist.', 'resource': '', 'requestid': '',
+        'traceid': ''}, 404))
+
+    for load in (tencent_storage.size, tencent_storage.get_etag, tencent_storage.head, tencent_storage.load_once,
+                 tencent_storage.load_stream_with_etag,
+                 lambda filename: b''.join(tencent_storage.load_stream(filename)),
+                 lambda filename: tencent_storage.load_range(filename, 0, 1)):
+        with pytest.raises(FileNotFoundError):
+            load('missing.txt')
+
+
+def test_other_errors_are_raised(tencent_storage, mocker):
+    mocker.patch.object(tencent_storage.client, 'head_object', side_effect=CosServiceError('HEAD', '', 403))
+
+    with pytest.raises(CosServiceError):
+        tencent_storage.head('a.txt')
+
+
+def test_head_is_a_single_request(tencent_storage, mocker):
+    head_object = mocker.patch.object(tencent_storage.client, 'head_object',
+                                      return_value={'Content-Length': '11', 'ETag': '"abc"'})
+
+    assert tencent_storage.head('a.txt') == (11, '"abc"')
+    head_object.assert_called_once()
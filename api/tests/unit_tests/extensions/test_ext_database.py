@@ -0,0 +1,104 @@
+import pytest
+from flask import Flask, g
+from sqlalchemy import Column, Integer, MetaData, Table, insert, literal, select
+
+from extensions import ext_database
+from extensions.ext_database import db, replica_router
+
+items = Table('items', MetaData(), Column('id', Integer, primary_key=True))
+
+
+class User:
+    is_authenticated = True
+
+    def __init__(self, user_id: str, tenant_id: str):
+        self.id = user_id
+        self.current_tenant_id = tenant_id
+
+    def get_id(self) -> str:
+        return self.id
+
+
+@pytest.fixture
+def app(fake_redis, monkeypatch) -> Flask:
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        SQLALCHEMY_BINDS={'replica_0': 'sqlite://'},
+        DB_REPLICA_MAX_LAG=10,
+        DB_REPLICA_HEALTH_CHECK_INTERVAL=5,
+        DB_REPLICA_ROUTE_SAFE_METHODS=True,
+        DB_REPLICA_STICKY_SECONDS=15,
+    )
+    ext_database.init_app(app)
+    # the health check thread would query the lag with Postgres functions
+    monkeypatch.setattr(replica_router, 'ensure_started', lambda: None)
+    for replica in replica_router.replicas:
+        replica.healthy = True
+
+    with app.app_context():
+        items.create(db.engine)
+
+    def login():
+        user_id, _, tenant_id = app.config.get('TEST_USER', '').partition('@')
+        if user_id:
+            # what flask_login keeps once a view loaded the user
+            g._login_user = User(user_id, tenant_id)
+
+    @app.get('/items')
+    def read():
+        login()
+        return 'primary' if db.session.get_bind(clause=select(literal(1))) is db.engine else 'replica'
+
+    @app.post('/items')
+    def write():
+        login()
+        db.session.execute(insert(items))
+        db.session.commit()
+        return 'ok'
+
+    yield app
+    replica_router.replicas = []
+
+
+def _get(client, authorization: str = 'Bearer a') -> str:
+    return client.get('/items', headers={'Authorization': authorization}).get_data(as_text=True)
+
+
+def test_reads_after_a_write_use_the_primary(app):
+    client = app.test_client()
+    assert _get(client) == 'replica'
+
+    client.post('/items', headers={'Authorization': 'Bearer a'})
+
+    assert _get(client) == 'primary'
+    assert _get(client, 'Bearer b') == 'replica'
+    assert client.get('/items').get_data(as_text=True) == 'replica'
+
+
+def test_stickiness_is_shared_by_the_tenant(app):
+    client = app.test_client()
+    app.config['TEST_USER'] = 'user1@tenant1'
+    client.post('/items', headers={'Authorization': 'Bearer a'})
+
+    app.config['TEST_USER'] = 'user2@tenant1'
+    assert _get(client, 'Bearer b') == 'primary'
+    app.config['TEST_USER'] = 'user3@tenant2'
+    assert _get(client, 'Bearer c') == 'replica'
+
+
+def test_stickiness_expires(app, fake_redis):
+    client = app.test_client()
+    client.post('/items', headers={'Authorization': 'Bearer a'})
+
+    for key in fake_redis.scan_iter(match='db_primary_sticky:*'):
+        assert 0 < fake_redis.ttl(key) <= 15
+        fake_redis.delete(key)
+
+    assert _get(client) == 'replica'
+
+
+def test_redis_outage_uses_the_primary(app, fake_redis_server):
+    fake_redis_server.connected = False
+
+    assert _get(app.test_client()) == 'primary'
@@ -0,0 +1,34 @@
+import pytest
+from flask import Flask
+
+from extensions import ext_profiling
+from extensions.ext_profiling import generate_profiling_token
+
+
+@pytest.fixture
+def app(fake_redis) -> Flask:
+    app = Flask(__name__)
+    app.config.update(
+        SECRET_KEY='secret',
+        PROFILING_ENABLED=False,
+        PROFILING_SAMPLE_RATE=0.0,
+        PROFILING_INTERVAL_MS=10,
+        PROFILING_OUTPUT_FORMAT='collapsed',
+        PROFILING_TOP_N=5,
+        PROFILING_TOKEN_MAX_AGE=60,
+    )
+    ext_profiling.init_app(app)
+    return app
+
+
+@pytest.mark.parametrize('headers', [{}, {'X-Profile-Token': 'invalid'},
+                                     {'X-Profile-Token': generate_profiling_token('other')}])
+def test_slowest_requires_a_token(app, headers):
+    assert app.test_client().get('/profiling/slowest', headers=headers).status_code == 401
+
+
+def test_slowest_with_a_token(app):
+    result = app.test_client().get('/profiling/slowest', headers={'X-Profile-Token': generate_profiling_token('secret')})
+
+    assert result.status_code == 200
+    assert result.json == {}
@@ -0,0 +1,69 @@
+import pytest
+from Crypto.Cipher import PKCS1_OAEP
+from Crypto.PublicKey import RSA
+from Crypto.Random import get_random_bytes
+
+from libs import gmpy2_pkcs10aep_cipher
+
+
+@pytest.fixture(scope='module')
+def rsa_key():
+    return RSA.generate(2048)
+
+
+@pytest.fixture(scope='module')
+def messages():
+    return [get_random_bytes(length) for length in (0, 1, 16, 32, 100, 214)]
+
+
+def test_decrypts_pycryptodome_ciphertexts(rsa_key, messages):
+    cipher = gmpy2_pkcs10aep_cipher.new(rsa_key)
+    reference = PKCS1_OAEP.new(rsa_key.publickey())
+
+    for message in messages:
+        assert cipher.decrypt(reference.encrypt(message)) == message
+
+
+def test_pycryptodome_decrypts_ciphertexts(rsa_key, messages):
+    cipher = gmpy2_pkcs10aep_cipher.new(rsa_key.publickey())
+    reference = PKCS1_OAEP.new(rsa_key)
+
+    for message in messages:
+        assert reference.decrypt(cipher.encrypt(message)) == message
+
+
+def test_crt_matches_plain_exponentiation(rsa_key):
+    cipher = gmpy2_pkcs10aep_cipher.new(rsa_key)
+
+    for _ in range(20):
+        ct_int = int.from_bytes(get_random_bytes(rsa_key.size_in_bytes()), 'big') % rsa_key.n
+        assert cipher._decrypt_int(ct_int) == pow(ct_int, rsa_key.d, rsa_key.n)
+
+
+def test_rejects_invalid_ciphertexts(rsa_key):
+    cipher = gmpy2_pkcs10aep_cipher.new(rsa_key)
+    ciphertext = bytearray(cipher.encrypt(b'secret'))
+    ciphertext[-1] ^= 1
+
+    with pytest.raises(ValueError):
+        cipher.decrypt(bytes(ciphertext))
+    with pytest.raises(ValueError):
+        cipher.decrypt(bytes(ciphertext[1:]))
+    with pytest.raises(TypeError):
+        gmpy2_pkcs10aep_cipher.new(rsa_key.publickey()).decrypt(bytes(ciphertext))
+
+
+def test_benchmark_decrypt(benchmark, rsa_key):
+    benchmark.group = 'oaep-decrypt'
+    cipher = gmpy2_pkcs10aep_cipher.new(rsa_key)
+    ciphertext = cipher.encrypt(get_random_bytes(16))
+
+    assert benchmark(cipher.decrypt, ciphertext)
+
+
+def test_benchmark_decrypt_pycryptodome(benchmark, rsa_key):
+    benchmark.group = 'oaep-decrypt'
+    cipher = PKCS1_OAEP.new(rsa_key)
+    ciphertext = cipher.encrypt(get_random_bytes(16))
+
+    assert benchmark(cipher.decrypt, ciphertext)
@@ -0,0 +1,162 @@
+import os
+
+import pytest
+from flask import Flask, Response
+from werkzeug.test import EnvironBuilder
+
+from extensions.storage.local_storage import LocalStorage
+from libs import response
+
+DATA = bytes(range(256)) * 4
+
+# throughput over one large local object, written once per session
+BENCHMARK_SIZE = 1024 * 1024 * 1024
+BENCHMARK_FILENAME = 'large.bin'
+
+
+class SendfileWrapper:
+    """`wsgi.file_wrapper` of a server using sendfile(2), like gunicorn's."""
+
+    def __init__(self, file, block_size=8192):
+        self.file = file
+
+    def close(self):
+        self.file.close()
+
+
+@pytest.fixture(scope='session')
+def large_file_folder(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('storage')
+    block = os.urandom(1024 * 1024)
+    with open(folder / BENCHMARK_FILENAME, 'wb') as f:
+        for _ in range(BENCHMARK_SIZE // len(block)):
+            f.write(block)
+    yield folder
+    # pytest keeps the temporary directories of recent sessions
+    (folder / BENCHMARK_FILENAME).unlink()
+
+
+@pytest.fixture
+def file_app(large_file_folder, monkeypatch) -> Flask:
+    app = Flask(__name__)
+    app.config.update(STORAGE_LOCAL_PATH=str(large_file_folder))
+    storage = LocalStorage(app)
+    monkeypatch.setattr(response, 'storage', storage)
+
+    @app.get('/buffered/<filename>')
+    def buffered(filename):
+        # before streaming, the whole object was read into memory first
+        return Response(storage.load_once(filename), mimetype='application/octet-stream')
+
+    @app.get('/streamed/<filename>')
+    def streamed(filename):
+        # what storages without local files are served with
+        return Response(storage.load_stream(filename), mimetype='application/octet-stream')
+
+    @app.get('/files/<filename>')
+    def files(filename):
+        return response.storage_file_response(filename)
+
+    return app
+
+
+@pytest.fixture(params=['local', 'remote'])
+def client(request, tmp_path, monkeypatch):
+    app = Flask(__name__)
+    app.config.update(STORAGE_LOCAL_PATH=str(tmp_path))
+    storage = LocalStorage(app)
+    storage.save('a.bin', DATA)
+    if request.param == 'remote':
+        # served from ranged reads like objects of S3, OSS or COS
+        monkeypatch.setattr(storage, 'get_local_path', lambda filename: None)
+        monkeypatch.setattr(storage, 'get_etag', lambda filename: 'abc123')
+    monkeypatch.setattr(response, 'storage', storage)
+
+    @app.get('/files/<filename>')
+    def files(filename):
+        return response.storage_file_response(filename)
+
+    return app.test_client()
+
+
+def test_whole_file(client):
+    result = client.get('/files/a.bin')
+
+    assert result.status_code == 200
+    assert result.data == DATA
+    assert result.headers['Accept-Ranges'] == 'bytes'
+    assert result.headers['ETag']
+
+
+@pytest.mark.parametrize(('header', 'start', 'stop'), [
+    ('bytes=10-19', 10, 20),
+    ('bytes=1000-', 1000, 1024),
+    ('bytes=-5', 1019, 1024),
+    ('bytes=1000-5000', 1000, 1024),
+])
+def test_single_range(client, header, start, stop):
+    result = client.get('/files/a.bin', headers={'Range': header})
+
+    assert result.status_code == 206
+    assert result.data == DATA[start:stop]
+    assert result.headers['Content-Range'] == 'bytes {start}-{end}/1024'.format(start=start, end=stop - 1)
+
+
+def test_multiple_ranges_get_the_whole_file(client):
+    result = client.get('/files/a.bin', headers={'Range': 'bytes=0-1,5-6'})
+
+    assert result.status_code == 200
+    assert result.data == DATA
+
+
+@pytest.mark.parametrize('header', ['bytes=1024-', 'bytes=2000-3000'])
+def test_unsatisfiable_range(client, header):
+    result = client.get('/files/a.bin', headers={'Range': header})
+
+    assert result.status_code == 416
+    assert result.headers['Content-Range'] == 'bytes */1024'
+
+
+def test_if_range(client):
+    etag = client.get('/files/a.bin').headers['ETag']
+
+    matching = client.get('/files/a.bin', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    changed = client.get('/files/a.bin', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    dated = client.get('/files/a.bin', headers={'Range': 'bytes=0-9', 'If-Range': 'Mon, 01 Jan 2001 00:00:00 GMT'})
+
+    assert matching.status_code == 206
+    assert matching.data == DATA[:10]
+    assert changed.status_code == dated.status_code == 200
+    assert changed.data == dated.data == DATA
+
+
+def _serve(app: Flask, path: str) -> int:
+    """Run a request like a WSGI server writing to a socket, return the number of bytes sent."""
+    environ = EnvironBuilder(path=path).get_environ()
+    environ['wsgi.file_wrapper'] = SendfileWrapper
+    body = app(environ, lambda status, headers, exc_info=None: None)
+
+    sent = 0
+    with open(os.devnull, 'wb', buffering=0) as out:
+        try:
+            if isinstance(body, SendfileWrapper):
+                fd = body.file.fileno()
+                while count := os.sendfile(out.fileno(), fd, sent, 1024 * 1024 * 1024):
+                    sent += count
+            else:
+                for chunk in body:
+                    sent += out.write(chunk)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+    return sent
+
+
+@pytest.mark.parametrize('path', ['buffered', 'streamed', 'files'])
+def test_benchmark_storage_file_response(benchmark, file_app, path):
+    benchmark.group = 'storage-file-response-1GiB'
+
+    sent = benchmark.pedantic(_serve, args=(file_app, '/{path}/{filename}'.format(
+        path=path, filename=BENCHMARK_FILENAME)), rounds=3)
+
+    assert sent == BENCHMARK_SIZE
@@ -0,0 +1,58 @@
+import pytest
+import redis
+from flask import Flask
+
+from libs.response_cache import cached_response
+
+
+@pytest.fixture
+def app(fake_redis) -> Flask:
+    app = Flask(__name__)
+    app.config['RESPONSE_CACHE_ENABLED'] = True
+    return app
+
+
+@pytest.fixture
+def resource():
+    calls = []
+
+    @cached_response(ttl=60)
+    def get(app_id):
+        calls.append(app_id)
+        return {'app_id': app_id, 'calls': len(calls)}
+
+    get.calls = calls
+    return get
+
+
+def test_cached(app, resource):
+    with app.test_request_context('/apps/1'):
+        first = resource('1')
+        second = resource('1')
+
+    assert first[0] == second[0] == {'app_id': '1', 'calls': 1}
+    assert first[2]['X-Cache'] == 'MISS'
+    assert second[2]['X-Cache'] == 'HIT'
+    assert resource.calls == ['1']
+
+
+def test_falls_back_when_redis_is_unavailable(app, resource, fake_redis_server):
+    fake_redis_server.connected = False
+
+    with app.test_request_context('/apps/1'):
+        first = resource('1')
+        second = resource('1')
+
+    assert first == {'app_id': '1', 'calls': 1}
+    assert second == {'app_id': '1', 'calls': 2}
+
+
+def test_serves_computed_response_when_store_fails(app, resource, fake_redis, mocker):
+    mocker.patch.object(fake_redis, 'pipeline', side_effect=redis.ConnectionError('down'))
+
+    with app.test_request_context('/apps/1'):
+        data, status, headers = resource('1')
+
+    assert data == {'app_id': '1', 'calls': 1}
+    assert headers['X-Cache'] == 'MISS'
+    assert resource.calls == ['1']
@@ -0,0 +1,103 @@
+import pytest
+from Crypto.PublicKey import RSA
+
+from libs import gmpy2_pkcs10aep_cipher, rsa
+
+BENCHMARK_ITEMS = 1000
+
+
+@pytest.fixture(scope='module')
+def rsa_key():
+    return RSA.generate(2048)
+
+
+@pytest.fixture(autouse=True)
+def decrypt_pool():
+    yield
+    rsa.shutdown_decrypt_pool()
+
+
+@pytest.fixture
+def tenant_key(mocker, rsa_key):
+    mocker.patch.object(rsa, 'get_decrypt_decoding',
+                        return_value=(rsa_key, gmpy2_pkcs10aep_cipher.new(rsa_key)))
+    return rsa_key
+
+
+@pytest.fixture
+def stored_tenant_key(fake_redis, rsa_key):
+    """The key as `get_decrypt_decoding` finds it once a tenant was used, in Redis and in memory."""
+    fake_redis.set(rsa._get_privkey_cache_key('privkeys/tenant/private.pem'), rsa_key.export_key())
+    rsa.tenant_key_cache.clear()
+    yield rsa_key
+    rsa.tenant_key_cache.clear()
+
+
+@pytest.fixture(scope='module')
+def benchmark_items(rsa_key):
+    texts = ['secret {i}'.format(i=i) for i in range(BENCHMARK_ITEMS)]
+    return [(encrypted, 'tenant') for encrypted in rsa.encrypt_many(texts, rsa_key.publickey().export_key())]
+
+
+def test_decrypt_many_keeps_order_and_errors(tenant_key):
+    texts = ['secret {i}'.format(i=i) for i in range(10)]
+    items = [(encrypted, 'tenant') for encrypted in rsa.encrypt_many(texts, tenant_key.publickey().export_key())]
+    items.insert(3, (rsa.prefix_hybrid + b'broken', 'tenant'))
+
+    results = rsa.decrypt_many(items)
+
+    assert isinstance(results[3], ValueError)
+    assert results[:3] + results[4:] == texts
+
+
+def test_decrypt_many_with_pool(tenant_key, monkeypatch):
+    monkeypatch.setattr(rsa, 'DECRYPT_MANY_POOL_THRESHOLD', 4)
+    monkeypatch.setattr(rsa, 'DECRYPT_MANY_CHUNK_SIZE', 3)
+    monkeypatch.setattr(rsa, 'DECRYPT_MANY_MAX_WORKERS', 2)
+    texts = ['secret {i}'.format(i=i) for i in range(10)]
+    items = [(encrypted, 'tenant') for encrypted in rsa.encrypt_many(texts, tenant_key.publickey().export_key())]
+
+    assert rsa.decrypt_many(items) == texts
+    # the pool is kept for the next batch
+    pool = rsa._get_decrypt_pool()
+    assert rsa.decrypt_many(items) == texts
+    assert rsa._get_decrypt_pool() is pool
+
+    rsa.shutdown_decrypt_pool()
+    assert rsa._decrypt_pool is None
+
+
+def test_decrypt_many_without_pool_under_gevent(tenant_key, monkeypatch, mocker):
+    monkeypatch.setattr(rsa, 'DECRYPT_MANY_POOL_THRESHOLD', 4)
+    monkeypatch.setattr(rsa, 'DECRYPT_MANY_MAX_WORKERS', 2)
+    mocker.patch('gevent.monkey.is_module_patched', return_value=True)
+    texts = ['secret {i}'.format(i=i) for i in range(10)]
+    items = [(encrypted, 'tenant') for encrypted in rsa.encrypt_many(texts, tenant_key.publickey().export_key())]
+
+    assert rsa.decrypt_many(items) == texts
+    assert rsa._decrypt_pool is None
+
+
+def test_decrypt_many_tenant_error(mocker):
+    error = rsa.PrivkeyNotFoundError('Private key not found')
+    mocker.patch.object(rsa, 'get_decrypt_decoding', side_effect=error)
+
+    assert rsa.decrypt_many([(b'x', 'a'), (b'y', 'a')]) == [error, error]
+
+
+def test_benchmark_decrypt(benchmark, stored_tenant_key, benchmark_items):
+    # what callers did before decrypt_many, one decrypt() and key lookup per item
+    benchmark.group = 'rsa-decrypt-{count}'.format(count=BENCHMARK_ITEMS)
+
+    def decrypt_each():
+        return [rsa.decrypt(encrypted, tenant_id) for encrypted, tenant_id in benchmark_items]
+
+    benchmark.pedantic(decrypt_each, rounds=3)
+
+
+def test_benchmark_decrypt_many(benchmark, stored_tenant_key, benchmark_items):
+    # the pool is started in the warm-up round, later batches reuse it
+    benchmark.group = 'rsa-decrypt-{count}'.format(count=BENCHMARK_ITEMS)
+    results = benchmark.pedantic(rsa.decrypt_many, args=(benchmark_items,), rounds=3, warmup_rounds=1)
+
+    assert results[0] == 'secret 0'
@@ -0,0 +1,29 @@
+from flask import Flask
+from flask.testing import FlaskCliRunner
+
+from commands import migrate_storage_layout
+from extensions.storage.local_storage import LocalStorage
+
+
+def _migrate(app: Flask, layout: str) -> str:
+    with app.app_context():
+        return FlaskCliRunner(app).invoke(migrate_storage_layout, ['--to', layout]).output
+
+
+def test_migrate_storage_layout_keeps_user_tmp_files(tmp_path):
+    app = Flask(__name__)
+    app.config.update(STORAGE_LOCAL_PATH=str(tmp_path))
+    for name in ('upload_files/a.txt', 'upload_files/backup.tmp', 'upload_files/.x1y2.tmp'):
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(name.encode())
+
+    assert 'Migrated 2 files' in _migrate(app, 'sharded')
+    app.config['STORAGE_LOCAL_LAYOUT'] = 'sharded'
+    storage = LocalStorage(app)
+    assert storage.load_once('upload_files/a.txt') == b'upload_files/a.txt'
+    assert storage.load_once('upload_files/backup.tmp') == b'upload_files/backup.tmp'
+    # a file still being written is left where save_stream will rename it
+    assert (tmp_path / 'upload_files/.x1y2.tmp').exists()
+
+    assert 'Migrated 2 files' in _migrate(app, 'flat')
+    assert (tmp_path / 'upload_files/backup.tmp').read_bytes() == b'upload_files/backup.tmp'
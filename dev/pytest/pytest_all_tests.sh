@@ -1,5 +1,8 @@
 #!/bin/bash
 set -x
 
+# Unit tests
+dev/pytest/pytest_unit_tests.sh
+
 # Tools
 dev/pytest/pytest_tools.sh
\ No newline at end of file
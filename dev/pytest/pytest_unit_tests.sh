@@ -0,0 +1,5 @@
+#!/bin/bash
+set -x
+
+# Unit tests
+pytest api/tests/unit_tests